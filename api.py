@@ -0,0 +1,201 @@
+"""Read-only JSON API for users, posts and tags, mounted at /api/v1.
+
+    GET /api/v1/users                 ?after=&limit=
+    GET /api/v1/users/<id>
+    GET /api/v1/posts                 ?user=&tag=&after=&limit=   (newest first)
+    GET /api/v1/posts/<id>
+    GET /api/v1/tags                  ?after=&limit=
+    GET /api/v1/tags/<id>
+    GET /api/v1/<users|posts|tags>/export?format=ndjson|csv
+
+List calls return {"<things>": [...], "next": cursor}. Pass next back as
+?after= to get the following page; it is null on the last page.
+
+Exports stream every row, in id order. Rows come off a server-side cursor
+(stream_results) EXPORT_CHUNK at a time and are written out as they arrive,
+so an export of any size runs in constant memory and sends its first bytes
+straight away. Post exports carry their tags' names ("|"-separated in CSV).
+"""
+
+import csv
+import io
+import itertools
+import json
+
+from flask import Blueprint, Response, abort, jsonify, request, stream_with_context
+from sqlalchemy import select
+
+import queries
+from models import db, User, Post, Tag, PostTag
+from pagination import keyset_page, PER_PAGE
+
+api = Blueprint("api", __name__, url_prefix="/api/v1")
+
+# most rows a list call will return, whatever ?limit= says
+MAX_PER_PAGE = 500
+# rows fetched from the server-side cursor at a time during an export
+EXPORT_CHUNK = 1000
+
+USER_FIELDS = ["id", "first_name", "last_name", "img_url"]
+POST_FIELDS = ["id", "title", "content", "created_at", "user_id", "tags"]
+TAG_FIELDS = ["id", "name"]
+
+
+def user_json(user):
+    return {"id": user.id, "first_name": user.first_name, "last_name": user.last_name, "img_url": user.img_url}
+
+
+def post_json(post):
+    return {"id": post.id, "title": post.title, "content": post.content, "created_at": post.created_at.isoformat(),
+            "user_id": post.user_id, "tags": [tag.name for tag in post.tags]}
+
+
+def tag_json(tag):
+    return {"id": tag.id, "name": tag.name}
+
+
+def per_page():
+    return max(1, min(request.args.get("limit", PER_PAGE, type=int), MAX_PER_PAGE))
+
+
+@api.errorhandler(404)
+def not_found(error):
+    return jsonify(error="not found"), 404
+
+
+@api.errorhandler(400)
+def bad_request(error):
+    return jsonify(error=error.description), 400
+
+
+################### USERS ############################
+
+@api.route("/users")
+def list_users():
+    page = keyset_page(User.query, [(User.id, "asc")], request.args.get("after"), per_page())
+    return jsonify(users=[user_json(user) for user in page], next=page.next_cursor)
+
+
+@api.route("/users/<int:user_id>")
+def show_user(user_id):
+    return jsonify(user_json(User.query.get_or_404(user_id)))
+
+
+################### POSTS ############################
+
+@api.route("/posts")
+def list_posts():
+    user_id = request.args.get("user", type=int)
+    tag_id = request.args.get("tag", type=int)
+    query = queries.with_author_and_tags(Post.query)
+    if user_id is not None:
+        query = query.filter(Post.user_id == user_id)
+    if tag_id is not None:
+        query = query.join(PostTag, PostTag.post_id == Post.id).filter(PostTag.tag_id == tag_id)
+    page = Post.newest_first(query, request.args.get("after"), per_page())
+    return jsonify(posts=[post_json(post) for post in page], next=page.next_cursor)
+
+
+@api.route("/posts/<int:post_id>")
+def show_post(post_id):
+    return jsonify(post_json(queries.post_details(post_id)))
+
+
+################### TAGS ############################
+
+@api.route("/tags")
+def list_tags():
+    page = keyset_page(Tag.query, [(Tag.id, "asc")], request.args.get("after"), per_page())
+    return jsonify(tags=[tag_json(tag) for tag in page], next=page.next_cursor)
+
+
+@api.route("/tags/<int:tag_id>")
+def show_tag(tag_id):
+    return jsonify(tag_json(Tag.query.get_or_404(tag_id)))
+
+
+################### EXPORTS ############################
+
+def stream_rows(statement):
+    """Yield result rows off a server-side cursor, EXPORT_CHUNK at a time."""
+
+    result = db.session.execute(statement.execution_options(stream_results=True))
+    for chunk in result.partitions(EXPORT_CHUNK):
+        yield from chunk
+
+
+def user_rows():
+    for row in stream_rows(select(User.id, User.first_name, User.last_name, User.img_url).order_by(User.id)):
+        yield dict(row._mapping)
+
+
+def tag_rows():
+    for row in stream_rows(select(Tag.id, Tag.name).order_by(Tag.id)):
+        yield dict(row._mapping)
+
+
+def post_rows():
+    """Posts with their tag names, from one pass over posts joined to their tags in post id order.
+
+    A post's rows arrive together, so they are folded into one as they stream
+    past, with no per-post tag query and nothing held beyond the current post.
+    """
+
+    statement = (select(Post.id, Post.title, Post.content, Post.created_at, Post.user_id, Tag.name.label("tag"))
+                 .outerjoin(PostTag, PostTag.post_id == Post.id)
+                 .outerjoin(Tag, Tag.id == PostTag.tag_id)
+                 .order_by(Post.id))
+    for _, rows in itertools.groupby(stream_rows(statement), key=lambda row: row.id):
+        rows = list(rows)
+        first = rows[0]
+        yield {"id": first.id, "title": first.title, "content": first.content,
+               "created_at": first.created_at.isoformat(), "user_id": first.user_id,
+               "tags": [row.tag for row in rows if row.tag is not None]}
+
+
+def ndjson_lines(rows):
+    buffer = []
+    for row in rows:
+        buffer.append(json.dumps(row, separators=(",", ":")))
+        if len(buffer) == EXPORT_CHUNK:
+            yield "\n".join(buffer) + "\n"
+            buffer = []
+    if buffer:
+        yield "\n".join(buffer) + "\n"
+
+
+def csv_lines(rows, fields):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(fields)
+    for n, row in enumerate(rows, 1):
+        writer.writerow(["|".join(row[f]) if f == "tags" else row[f] for f in fields])
+        if n % EXPORT_CHUNK == 0:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+    yield out.getvalue()
+
+
+EXPORTS = {
+    "users": (user_rows, USER_FIELDS),
+    "posts": (post_rows, POST_FIELDS),
+    "tags": (tag_rows, TAG_FIELDS),
+}
+
+
+@api.route("/<any(users, posts, tags):kind>/export")
+def export(kind):
+    """Stream every user, post or tag as NDJSON (the default) or CSV."""
+
+    rows, fields = EXPORTS[kind]
+    format = request.args.get("format", "ndjson")
+    if format == "ndjson":
+        body, mimetype = ndjson_lines(rows()), "application/x-ndjson"
+    elif format == "csv":
+        body, mimetype = csv_lines(rows(), fields), "text/csv"
+    else:
+        abort(400, "format must be ndjson or csv")
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename={kind}.{format}"
+    return response
@@ -0,0 +1,388 @@
+"""Async read path: the high-fan-out read pages as ASGI routes on an async engine.
+
+    BLOGLY_CONFIG=prod uvicorn --factory asgi:create_asgi --workers 4
+    python bench.py --db postgresql:///bench_db --no-generate --http --threads 32 --route show_user
+    python bench.py --db postgresql:///bench_db --no-generate --asgi --threads 32 --route show_user
+
+create_asgi builds the Flask app as usual and puts an ASGI app in front of it.
+GET requests for the pages in VIEWS (root, list_users, show_user, show_post,
+list_tags, show_tag) are answered here on an asyncpg engine, so a worker
+waiting on the database holds no thread and keeps serving other requests.
+Everything else goes to the Flask app, each request in a thread of the event
+loop's executor, as a threaded WSGI server would run it.
+
+The async views run the same statements as the sync ones: the models, the eager
+loads in queries.py, the keyset pages (given a select(), keyset_page returns a
+PendingPage to run here) and readmodels' columns. They render the same
+templates in a Flask request context, so the pages, the page cache and its
+ETags and 304s, session cookies and compression behave as on the sync path.
+Rendering runs in an executor thread (render_page), so a page being rendered
+doesn't hold up the event loop's other requests.
+Queries a page doesn't need in order run at the same time, each on its own
+connection: show_user reads the user and their posts concurrently, show_tag the
+tag and its posts. The tag list reads tags from the database rather than the
+in-process tag catalog.
+
+Not here: the read replica (these read the primary), per-request metrics and
+the profiler (their hooks run in Flask's dispatch) and streamed templates. A
+missing user, post or tag aborts with a 404, and errors go through the app's
+handlers as in Flask's own dispatch, so they get the pages the sync path gives.
+"""
+
+import asyncio
+import io
+import os
+import sys
+import threading
+
+from flask import abort, make_response, render_template, request, session
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from werkzeug.exceptions import HTTPException
+
+import queries
+import readmodels
+from app import create_app
+from cache import page_key, validator_statement, validator_from, not_modified, validated
+from models import User, Post, Tag
+from streaming import Compressor
+
+# chunks of a Flask response waiting to be sent; the thread producing them waits when this many are queued
+QUEUED_CHUNKS = 8
+
+
+def async_url(url):
+    """The database URL with the asyncpg driver: postgresql:///unit23_db -> postgresql+asyncpg:///unit23_db."""
+
+    return make_url(url).set(drivername="postgresql+asyncpg")
+
+
+def async_engine_options(config):
+    """create_async_engine options for the pool settings in config, as config.engine_options."""
+
+    options = {
+        "pool_size": config["ASYNC_DB_POOL_SIZE"],
+        "max_overflow": config["DB_MAX_OVERFLOW"],
+        "pool_recycle": config["DB_POOL_RECYCLE"],
+        "pool_pre_ping": config["DB_POOL_PRE_PING"],
+    }
+    if config["DB_STATEMENT_TIMEOUT_MS"]:
+        options["connect_args"] = {"server_settings": {"statement_timeout": str(config["DB_STATEMENT_TIMEOUT_MS"])}}
+    return options
+
+
+def wsgi_environ(scope, body=b""):
+    """The WSGI environ for an ASGI http request."""
+
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+        "PATH_INFO": scope["path"].encode().decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name, value = name.decode("latin-1").upper().replace("-", "_"), value.decode("latin-1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+        else:
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    if body and "CONTENT_LENGTH" not in environ:
+        # a chunked upload: the body has been read whole, so its length is known
+        environ["CONTENT_LENGTH"] = str(len(body))
+    return environ
+
+
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return bytes(body)
+
+
+def serve_response(environ, start_response):
+    """WSGI app sending the response an async view made, so Compressor can wrap it."""
+
+    return environ["blogly.response"](environ, start_response)
+
+
+class AsyncReads:
+    """ASGI app answering VIEWS on an async engine and handing every other request to the Flask app."""
+
+    def __init__(self, app):
+        self.app = app
+        self.engine = create_async_engine(async_url(app.config["SQLALCHEMY_DATABASE_URI"]),
+                                          **async_engine_options(app.config))
+        self.sessions = sessionmaker(self.engine, class_=AsyncSession)
+        self.compressor = Compressor(serve_response, app.config)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        view = None
+        if scope["method"] == "GET":
+            environ = wsgi_environ(scope)
+            try:
+                endpoint, args = self.app.url_map.bind_to_environ(environ).match()
+                view = VIEWS.get(endpoint)
+            except HTTPException:
+                pass
+        if view is None:
+            return await self.fall_through(scope, receive, send)
+
+        with self.app.request_context(environ):
+            try:
+                try:
+                    page = await view(self, **args)
+                except Exception as e:
+                    # as Flask's full_dispatch_request: an abort() or a registered handler answers here
+                    page = self.app.handle_user_exception(e)
+                response = self.app.process_response(make_response(page))
+            except Exception as e:
+                response = self.app.handle_exception(e)
+        await self.respond(response, environ, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.engine.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def respond(self, response, environ, send):
+        """Send a Flask response, compressed as the WSGI middleware would."""
+
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started.update(status=status, headers=headers)
+
+        environ["blogly.response"] = response
+        body = self.compressor(environ, start_response)
+        try:
+            await send(response_start(started["status"], started["headers"]))
+            for chunk in body:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+
+    async def fall_through(self, scope, receive, send):
+        """Answer with the Flask app, run in an executor thread (one per request, like a threaded server).
+
+        The response is iterated in that same thread, since a streamed one carries
+        Flask's context with it, and handed over through a short queue, so a slow
+        client holds up its own thread rather than buffering the whole body.
+        """
+
+        environ = wsgi_environ(scope, await read_body(receive))
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=QUEUED_CHUNKS)
+        abandoned = threading.Event()
+
+        def put(item):
+            if abandoned.is_set():
+                raise ConnectionAbortedError("client went away")
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        def run():
+            try:
+                def start_response(status, headers, exc_info=None):
+                    put(("start", status, headers))
+                    return lambda data: put(("body", data))
+
+                body = self.app(environ, start_response)
+                try:
+                    for chunk in body:
+                        if chunk:
+                            put(("body", chunk))
+                finally:
+                    if hasattr(body, "close"):
+                        body.close()
+            finally:
+                if not abandoned.is_set():
+                    put(("end",))
+
+        worker = loop.run_in_executor(None, run)
+        try:
+            while True:
+                item = await queue.get()
+                if item[0] == "start":
+                    await send(response_start(item[1], item[2]))
+                elif item[0] == "body":
+                    await send({"type": "http.response.body", "body": item[1], "more_body": True})
+                else:
+                    break
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if not worker.done():
+                abandoned.set()
+                # free a slot for a put the thread may be blocked in, so it sees it was abandoned
+                while not queue.empty():
+                    queue.get_nowait()
+        await worker
+
+    # ---- database
+
+    async def all(self, statement):
+        """Result rows of statement, on a connection of its own."""
+
+        async with self.sessions() as db_session:
+            return (await db_session.execute(statement)).all()
+
+    async def entities(self, statement):
+        async with self.sessions() as db_session:
+            return (await db_session.execute(statement)).scalars().all()
+
+    async def first(self, statement):
+        async with self.sessions() as db_session:
+            return (await db_session.execute(statement)).scalars().first()
+
+    async def page(self, pending, summary):
+        """Run a PendingPage, with its rows as summary namedtuples, like readmodels' functions."""
+
+        return readmodels.summaries(summary, pending.page(await self.all(pending.statement)))
+
+    async def cached(self, route, view_args, render):
+        """PageCache.cached for an async view; render is a coroutine function giving the page."""
+
+        page_cache = self.app.extensions["page_cache"]
+        # a page carrying a flash message is for this visitor alone: no validator, no cache
+        if session.get("_flashes"):
+            return await render()
+
+        key = page_key(route, view_args)
+        etag, last_modified = validator_from(await self.all(validator_statement(key)), key)
+        unchanged = not_modified(etag, last_modified)
+        if unchanged is not None:
+            return unchanged
+
+        page = page_cache.lookup(key, etag)
+        if page is None:
+            page = await render()
+            page_cache.store(key, page, etag)
+        return validated(page, etag, last_modified)
+
+
+def response_start(status, headers):
+    return {
+        "type": "http.response.start",
+        "status": int(status.split(" ", 1)[0]),
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+    }
+
+
+async def render_page(template, **context):
+    """render_template in an executor thread; the request context goes with it (it lives in context variables)."""
+
+    return await asyncio.to_thread(render_template, template, **context)
+
+
+################### ASYNC VIEWS ############################
+
+async def root(reads):
+    """Async app.root."""
+
+    async def render():
+        statement = queries.with_author_and_tags(select(Post)).order_by(Post.created_at.desc()).limit(5)
+        return await render_page("homepage.html", posts=await reads.entities(statement))
+
+    return await reads.cached("home", {}, render)
+
+
+async def list_users(reads):
+    """Async app.list_users."""
+
+    pending = User.order_by_last_name(request.args.get("after"), query=select(*readmodels.USER_COLUMNS))
+    return await render_page("user_list.html", users=await reads.page(pending, readmodels.UserSummary))
+
+
+async def show_user(reads, user_id):
+    """Async app.show_user: the user and their posts at the same time."""
+
+    async def render():
+        pending = Post.by_user(user_id, request.args.get("after"), query=select(*readmodels.POST_COLUMNS))
+        user, posts = await asyncio.gather(
+            reads.first(queries.guard(select(User)).where(User.id == user_id)),
+            reads.page(pending, readmodels.PostSummary))
+        if user is None:
+            abort(404)
+        return await render_page("user_details.html", user=user, posts=posts)
+
+    return await reads.cached("user", {"user_id": user_id}, render)
+
+
+async def show_post(reads, post_id):
+    """Async app.show_post."""
+
+    async def render():
+        post = await reads.first(queries.with_author_and_tags(select(Post)).where(Post.id == post_id))
+        if post is None:
+            abort(404)
+        return await render_page("post_details.html", post=post)
+
+    return await reads.cached("post", {"post_id": post_id}, render)
+
+
+async def list_tags(reads):
+    """Async app.list_tags."""
+
+    sort = request.args.get("sort")
+    query = select(*readmodels.TAG_COLUMNS)
+    if sort == "popular":
+        pending = Tag.by_popularity(request.args.get("after"), query=query)
+    else:
+        pending = Tag.order_by_name(request.args.get("after"), query=query)
+    return await render_page("tag_list.html", tags=await reads.page(pending, readmodels.TagSummary), sort=sort)
+
+
+async def show_tag(reads, tag_id):
+    """Async app.show_tag: the tag and its posts at the same time."""
+
+    async def render():
+        pending = Post.by_tag(tag_id, request.args.get("after"), query=select(*readmodels.POST_COLUMNS))
+        tag, posts = await asyncio.gather(
+            reads.first(queries.guard(select(Tag)).where(Tag.id == tag_id)),
+            reads.page(pending, readmodels.PostSummary))
+        if tag is None:
+            abort(404)
+        return await render_page("tag_details.html", tag=tag, posts=posts)
+
+    return await reads.cached("tag", {"tag_id": tag_id}, render)
+
+
+# endpoint -> async view; requests for any other endpoint go to the Flask app
+VIEWS = {
+    "blog.root": root,
+    "blog.list_users": list_users,
+    "blog.show_user": show_user,
+    "blog.show_post": show_post,
+    "blog.list_tags": list_tags,
+    "blog.show_tag": show_tag,
+}
+
+
+def create_asgi(config=None):
+    """The ASGI app for a profile in config.PROFILES (default: BLOGLY_CONFIG, else "dev"), or a config object."""
+
+    return AsyncReads(create_app(config or os.environ.get("BLOGLY_CONFIG", "dev")))
@@ -0,0 +1,234 @@
+"""Static asset pipeline: fingerprinted, precompressed CSS/JS served with immutable caching.
+
+    python assets.py vendor     # fetch the third-party CSS/JS into static/vendor, checking their hashes
+    python assets.py build      # write static/dist: fingerprinted copies, .gz/.br variants, manifest.json
+
+build copies each file in ASSETS to static/dist under a name carrying a hash of
+its content (app.css -> app.3f2a9c01d4e7.css), next to gzip and brotli
+(if the brotli package is installed) variants compressed at their highest
+levels. manifest.json maps each source name to its built name.
+
+Templates link assets with asset_url("app.css"). With a manifest it points at
+/assets/<built name>, served with the variant the browser accepts, its
+Content-Encoding, and a one-year immutable Cache-Control: a changed file gets a
+new name, so nothing is revalidated or fetched twice. Without one (a fresh
+checkout, or dev with ASSETS_USE_MANIFEST off) it points at /static/ as before,
+and at the CDN for vendored files that haven't been fetched yet.
+
+Builds only add files, so pages rendered (or cached) before a deploy keep
+working until the old files are cleaned out of static/dist.
+"""
+
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import urllib.request
+
+from flask import abort, current_app, request, send_file, url_for
+from werkzeug.security import safe_join
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+MANIFEST = "manifest.json"
+# a year, the longest Cache-Control max-age browsers honour
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# third-party files base.html used to load from CDNs: name under static/ -> (source URL, SRI hash).
+# vendor refuses an entry with no hash: pin it from a copy checked against the upstream release first
+VENDOR = {
+    "vendor/pure-min.css": (
+        "https://unpkg.com/purecss@1.0.1/build/pure-min.css",
+        "sha384-oAOxQR6DkCoMliIh8yFnu25d7Eq/PHS21PClpwjOTeU2jRSq11vu66rf90/cZr47"),
+    "vendor/bootstrap.min.css": (
+        "https://stackpath.bootstrapcdn.com/bootstrap/4.3.1/css/bootstrap.min.css",
+        "sha384-ggOyR0iXCbMQv3Xipma34MD+dH/1fQ784/j6cY/iJTQUOhcWr7x9JvoRxT2MZw1T"),
+    "vendor/bootstrap-select.min.css": (
+        "https://cdn.jsdelivr.net/npm/bootstrap-select@1.13.14/dist/css/bootstrap-select.min.css",
+        None),
+    "vendor/jquery.slim.min.js": (
+        "https://code.jquery.com/jquery-3.3.1.slim.min.js",
+        "sha384-q8i/X+965DzO0rT7abK41JStQIAqVgRVzpbzo5smXKp4YfRvH+8abtTE1Pi6jizo"),
+    "vendor/popper.min.js": (
+        "https://cdnjs.cloudflare.com/ajax/libs/popper.js/1.14.7/umd/popper.min.js",
+        "sha384-UO2eT0CpHqdSJQ6hJty5KVphtPhzWj9WO1clHTMGa3JDZwrnQq4sF86dIHNDz0W1"),
+    "vendor/bootstrap.min.js": (
+        "https://stackpath.bootstrapcdn.com/bootstrap/4.3.1/js/bootstrap.min.js",
+        "sha384-JjSmVgyd0p3pXB1rRibZUAYoIIy6OrQ6VrjIEaFf/nJGzIxFDsf4x0xIM+B07jRM"),
+    "vendor/bootstrap-select.min.js": (
+        "https://cdn.jsdelivr.net/npm/bootstrap-select@1.13.14/dist/js/bootstrap-select.min.js",
+        None),
+}
+# everything build fingerprints, by name under static/
+ASSETS = ["app.css", "app.js", *VENDOR]
+# Content-Encoding -> file suffix of the precompressed variant, in order of preference
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+MIMETYPES = {".css": "text/css", ".js": "application/javascript"}
+
+
+class AssetError(Exception):
+    """A vendored file that couldn't be fetched or didn't match its hash."""
+
+
+class Assets:
+    """Flask extension linking and serving the built assets."""
+
+    def __init__(self, app=None):
+        self.manifest = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("ASSETS_DIR", os.path.join(STATIC_DIR, "dist"))
+        # link the built files when there is a manifest; dev turns this off to see edits to static/ directly
+        app.config.setdefault("ASSETS_USE_MANIFEST", True)
+
+        self.manifest = {}
+        if app.config["ASSETS_USE_MANIFEST"]:
+            self.load(os.path.join(app.config["ASSETS_DIR"], MANIFEST))
+        app.add_template_global(self.url, "asset_url")
+        app.extensions["assets"] = self
+
+    def load(self, path):
+        """Use the manifest at path (none: link the source files)."""
+
+        self.manifest = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.manifest = json.load(f)
+
+    def url(self, name):
+        """Where a page should load the asset name (its path under static/) from."""
+
+        if name in self.manifest:
+            return url_for("blog.asset", filename=self.manifest[name])
+        if name in VENDOR and not os.path.exists(os.path.join(STATIC_DIR, name)):
+            return VENDOR[name][0]
+        return url_for("static", filename=name)
+
+    def send(self, filename):
+        """Response for /assets/<built name>: the best precompressed variant the browser accepts."""
+
+        path = safe_join(current_app.config["ASSETS_DIR"], filename)
+        if path is None or filename == MANIFEST or filename.endswith(tuple(ENCODINGS.values())) \
+                or not os.path.isfile(path):
+            abort(404)
+
+        encoding = None
+        for candidate, suffix in ENCODINGS.items():
+            if request.accept_encodings[candidate] and os.path.exists(path + suffix):
+                encoding, path = candidate, path + suffix
+                break
+        mimetype = MIMETYPES.get(os.path.splitext(filename)[1], "application/octet-stream")
+        response = send_file(path, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE, conditional=True)
+        if encoding:
+            response.content_encoding = encoding
+        response.vary.add("Accept-Encoding")
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+def fingerprinted(name, data):
+    """name with a hash of data before its extension: css/app.css -> css/app.<hash>.css."""
+
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+
+def compressors():
+    """Encoding -> function compressing bytes at the highest level; brotli only when it is installed."""
+
+    found = {"gzip": lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        found["br"] = lambda data: brotli.compress(data, quality=11)
+    return found
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build(static_dir=STATIC_DIR, out_dir=None, names=ASSETS, out=sys.stdout):
+    """Fingerprint and precompress names from static_dir into out_dir; return the manifest.
+
+    Missing files (vendored ones not fetched yet) are skipped, so they keep linking their CDN.
+    """
+
+    out_dir = out_dir or os.path.join(static_dir, "dist")
+    compress = compressors()
+    manifest = {}
+    for name in names:
+        source = os.path.join(static_dir, name)
+        if not os.path.exists(source):
+            print(f"{name}: missing, skipped", file=out)
+            continue
+        with open(source, "rb") as f:
+            data = f.read()
+        built = fingerprinted(name, data)
+        target = os.path.join(out_dir, built)
+        sizes = [f"{len(data)} B"]
+        if not os.path.exists(target):
+            write_file(target, data)
+        for encoding, function in compress.items():
+            compressed = function(data)
+            # a variant no smaller than the file itself isn't worth sending
+            if len(compressed) < len(data):
+                write_file(target + ENCODINGS[encoding], compressed)
+                sizes.append(f"{encoding} {len(compressed)} B")
+        manifest[name] = built
+        print(f"{name} -> {built} ({', '.join(sizes)})", file=out)
+
+    write_file(os.path.join(out_dir, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+def vendor(static_dir=STATIC_DIR, entries=VENDOR, out=sys.stdout):
+    """Download the VENDOR files into static_dir, refusing any without an SRI hash or not matching it."""
+
+    # checked up front, so a missing hash doesn't leave static_dir half vendored
+    unpinned = [name for name, (url, integrity) in entries.items() if not integrity]
+    if unpinned:
+        raise AssetError(f"{', '.join(unpinned)}: no integrity hash pinned in VENDOR")
+
+    for name, (url, integrity) in entries.items():
+        try:
+            with urllib.request.urlopen(url, timeout=30) as response:
+                data = response.read()
+        except OSError as e:
+            raise AssetError(f"{name}: fetching {url} failed: {e}") from None
+        algorithm, expected = integrity.split("-", 1)
+        actual = base64.b64encode(hashlib.new(algorithm, data).digest()).decode()
+        if actual != expected:
+            raise AssetError(f"{name}: {url} does not match its integrity hash")
+        write_file(os.path.join(static_dir, name), data)
+        print(f"{name}: {len(data)} B from {url}", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("command", choices=["vendor", "build"])
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "vendor":
+            vendor()
+        else:
+            build()
+    except AssetError as e:
+        sys.exit(str(e))
+
+
+if __name__ == "__main__":
+    main()
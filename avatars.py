@@ -0,0 +1,368 @@
+"""Local avatar store: user images fetched once, kept on disk, served in fixed sizes.
+
+    python avatars.py --db postgresql:///unit23_db backfill    # fetch every user's img_url not stored yet
+    python avatars.py --db postgresql:///unit23_db refresh     # re-check stored URLs for changed images
+
+A user's img_url (or an uploaded file) is ingested when the user is saved: the
+image is read once, checked, and stored under the SHA-256 of its bytes with a
+WEBP variant for each size in SIZES. User.avatar_hash points at it and the
+pages link to /avatars/<hash>-<size>.webp, which never changes content, so it
+is served with an immutable one-year Cache-Control.
+
+The avatars table remembers which hash each URL gave, with its ETag and
+Last-Modified: saving a user with a URL already seen fetches nothing, and
+refresh asks the remote host with a conditional GET, so an unchanged image is
+not downloaded again. The default avatar (User.url, a large remote PNG) is
+taken from the copy in static/ instead of its host.
+
+URLs are fetched only over http(s), only from public addresses (unless
+AVATAR_ALLOW_PRIVATE_HOSTS, for tests and local stand-ins), and only up to
+AVATAR_MAX_BYTES. The address is checked again as the connection is made, to the
+address connected to, so a host that resolves differently the second time
+(DNS rebinding) can't point the fetch at an internal one.
+"""
+
+import argparse
+import datetime
+import functools
+import hashlib
+import http.client
+import io
+import ipaddress
+import os
+import re
+import socket
+import tempfile
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from flask import abort, current_app, send_file, url_for
+from sqlalchemy import select
+
+from models import db, User, Avatar
+
+# variant name -> width and height in pixels, twice the size the pages show them at for high-DPI screens
+SIZES = {"thumb": 48, "profile": 250}
+VARIANT_FORMAT = "webp"
+# a year, the longest Cache-Control max-age browsers honour
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+DEFAULT_AVATAR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "default-avatar.png")
+
+HASH_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+
+class AvatarError(ValueError):
+    """An image that can't be used as an avatar (unreachable, too big, not an image)."""
+
+
+class AvatarStore:
+    """Flask extension storing avatars on disk and linking pages to them."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # where originals and variants are written; content addressed, so safe to share between processes
+        app.config.setdefault("AVATAR_DIR", os.path.join(app.instance_path, "avatars"))
+        app.config.setdefault("AVATAR_MAX_BYTES", 5 * 1024 * 1024)
+        app.config.setdefault("AVATAR_FETCH_TIMEOUT", 5.0)
+        app.config.setdefault("AVATAR_ALLOW_PRIVATE_HOSTS", False)
+
+        app.add_template_global(self.url, "avatar_url")
+        app.extensions["avatars"] = self
+
+    def url(self, user, size="profile"):
+        """Where a page should load user's avatar from: the local variant, else img_url itself."""
+
+        if user.avatar_hash:
+            return url_for("blog.avatar", avatar_hash=user.avatar_hash, size=SIZES[size])
+        return user.img_url
+
+    def send(self, avatar_hash, size):
+        """Response for /avatars/<hash>-<size>.webp."""
+
+        if not HASH_PATTERN.fullmatch(avatar_hash) or size not in SIZES.values():
+            abort(404)
+        path = self.variant_path(avatar_hash, size)
+        if not os.path.exists(path):
+            abort(404)
+        response = send_file(path, mimetype=f"image/{VARIANT_FORMAT}", max_age=IMMUTABLE_MAX_AGE,
+                             etag=f"{avatar_hash}-{size}", conditional=True)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    def original_path(self, avatar_hash):
+        return os.path.join(current_app.config["AVATAR_DIR"], avatar_hash[:2], avatar_hash)
+
+    def variant_path(self, avatar_hash, size):
+        return os.path.join(current_app.config["AVATAR_DIR"], avatar_hash[:2], f"{avatar_hash}-{size}.{VARIANT_FORMAT}")
+
+    def ingest_bytes(self, data):
+        """Store an image and its variants; return its hash. Stored images are not written again."""
+
+        avatar_hash = hashlib.sha256(data).hexdigest()
+        wanted = [size for size in SIZES.values() if not os.path.exists(self.variant_path(avatar_hash, size))]
+        if not wanted and os.path.exists(self.original_path(avatar_hash)):
+            return avatar_hash
+
+        image = open_image(data)
+        os.makedirs(os.path.dirname(self.original_path(avatar_hash)), exist_ok=True)
+        write_atomically(self.original_path(avatar_hash), data)
+        for size in wanted:
+            buffer = io.BytesIO()
+            square(image, size).save(buffer, VARIANT_FORMAT, quality=85)
+            write_atomically(self.variant_path(avatar_hash, size), buffer.getvalue())
+        return avatar_hash
+
+    def ingest_file(self, stream):
+        """Store an uploaded image; return its hash."""
+
+        data = stream.read(current_app.config["AVATAR_MAX_BYTES"] + 1)
+        if len(data) > current_app.config["AVATAR_MAX_BYTES"]:
+            raise AvatarError(f"image is over {current_app.config['AVATAR_MAX_BYTES']} bytes")
+        return self.ingest_bytes(data)
+
+    def ingest_url(self, url):
+        """Store the image at url, fetching it only if this URL hasn't been stored before; return its hash."""
+
+        avatar = Avatar.query.get(url)
+        if avatar is not None:
+            return avatar.hash
+
+        if url == User.url:
+            with open(DEFAULT_AVATAR, "rb") as f:
+                data, etag, last_modified = f.read(), None, None
+        else:
+            data, etag, last_modified = self.fetch(url)
+        avatar_hash = self.ingest_bytes(data)
+        db.session.merge(Avatar(url=url, hash=avatar_hash, etag=etag, last_modified=last_modified,
+                                fetched_at=now()))
+        return avatar_hash
+
+    def refresh(self, avatar):
+        """Re-fetch a stored URL if its image changed (conditional GET); return the hash it has now."""
+
+        if avatar.url == User.url:
+            return avatar.hash
+        fetched = self.fetch(avatar.url, etag=avatar.etag, last_modified=avatar.last_modified)
+        avatar.fetched_at = now()
+        if fetched is not None:
+            data, avatar.etag, avatar.last_modified = fetched
+            avatar.hash = self.ingest_bytes(data)
+        return avatar.hash
+
+    def fetch(self, url, etag=None, last_modified=None):
+        """(bytes, etag, last_modified) of the image at url, or None if the validators say it is unchanged."""
+
+        self.check_host(url)
+        request = urllib.request.Request(url, headers={"User-Agent": "blogly-avatars"})
+        if etag:
+            request.add_header("If-None-Match", etag)
+        if last_modified:
+            request.add_header("If-Modified-Since", last_modified)
+        limit = current_app.config["AVATAR_MAX_BYTES"]
+        allow_private = current_app.config["AVATAR_ALLOW_PRIVATE_HOSTS"]
+        opener = urllib.request.build_opener(CheckedRedirects(self), CheckedHTTPHandler(allow_private),
+                                             CheckedHTTPSHandler(allow_private))
+        try:
+            with opener.open(request, timeout=current_app.config["AVATAR_FETCH_TIMEOUT"]) as response:
+                data = response.read(limit + 1)
+                headers = response.headers
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None
+            raise AvatarError(f"fetching the image failed: HTTP {e.code}") from None
+        except (urllib.error.URLError, OSError) as e:
+            raise AvatarError(f"fetching the image failed: {e}") from None
+        if len(data) > limit:
+            raise AvatarError(f"image is over {limit} bytes")
+        return data, headers.get("ETag"), headers.get("Last-Modified")
+
+
+    def check_host(self, url):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise AvatarError("image URL must be http or https")
+        if not current_app.config["AVATAR_ALLOW_PRIVATE_HOSTS"] and not public_host(parts.hostname):
+            raise AvatarError(f"won't fetch images from {parts.hostname}")
+
+
+class CheckedRedirects(urllib.request.HTTPRedirectHandler):
+    """Follow redirects only to URLs the store would fetch directly."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        self.store.check_host(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+class CheckedHTTPHandler(urllib.request.HTTPHandler):
+    """Open http URLs with connections made only to checked addresses."""
+
+    def __init__(self, allow_private):
+        super().__init__()
+        self.allow_private = allow_private
+
+    def http_open(self, req):
+        return self.do_open(checked_connection(http.client.HTTPConnection, self.allow_private), req)
+
+
+class CheckedHTTPSHandler(urllib.request.HTTPSHandler):
+    """Open https URLs with connections made only to checked addresses; certificates are still checked by hostname."""
+
+    def __init__(self, allow_private):
+        super().__init__()
+        self.allow_private = allow_private
+
+    def https_open(self, req):
+        return self.do_open(checked_connection(http.client.HTTPSConnection, self.allow_private), req,
+                            context=self._context, check_hostname=self._check_hostname)
+
+
+def checked_connection(connection_class, allow_private):
+    """connection_class, connecting through connect_checked (Host header and SNI stay the hostname)."""
+
+    def connection(host, **kwargs):
+        conn = connection_class(host, **kwargs)
+        conn._create_connection = functools.partial(connect_checked, allow_private=allow_private)
+        return conn
+    return connection
+
+
+def connect_checked(address, timeout, source_address=None, *, allow_private):
+    """socket.create_connection, resolving the host once and connecting only to the addresses checked."""
+
+    host, port = address
+    ips = [info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)]
+    if not allow_private and not all(public_address(ip) for ip in ips):
+        raise AvatarError(f"won't fetch images from {host}")
+
+    error = None
+    for ip in ips:
+        try:
+            return socket.create_connection((ip, port), timeout, source_address)
+        except OSError as e:
+            error = e
+    raise error
+
+
+def public_host(hostname):
+    """Whether every address hostname resolves to is a public one."""
+
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(hostname, None)}
+    except OSError:
+        return False
+    return all(public_address(address) for address in addresses)
+
+
+def public_address(address):
+    return ipaddress.ip_address(address.split("%")[0]).is_global
+
+
+def open_image(data):
+    # Pillow is only needed when an image is stored, so it stays out of app startup
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise AvatarError("not an image") from None
+    return image
+
+
+def square(image, size):
+    """image center-cropped to a size x size square."""
+
+    from PIL import ImageOps
+
+    image = image.convert("RGBA") if image.mode in ("P", "LA", "RGBA") else image.convert("RGB")
+    return ImageOps.fit(image, (size, size))
+
+
+def write_atomically(path, data):
+    """Write data to path via a temporary file, so readers never see a partial image."""
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def backfill(store):
+    """Ingest the img_url of every user without a stored avatar, one fetch per distinct URL.
+
+    Returns (users updated, URLs that failed).
+    """
+
+    urls = db.session.execute(select(User.img_url).where(User.avatar_hash.is_(None)).distinct()).scalars().all()
+    updated, failed = 0, []
+    for url in urls:
+        try:
+            avatar_hash = store.ingest_url(url)
+        except AvatarError as e:
+            failed.append((url, str(e)))
+            continue
+        updated += User.query.filter(User.img_url == url, User.avatar_hash.is_(None)) \
+            .update({"avatar_hash": avatar_hash}, synchronize_session=False)
+        db.session.commit()
+    return updated, failed
+
+
+def refresh_all(store):
+    """Conditional GET for every stored URL, moving its users to the new image if it changed.
+
+    Returns (URLs whose image changed, URLs that failed).
+    """
+
+    changed, failed = 0, []
+    for avatar in Avatar.query.order_by(Avatar.url).all():
+        old_hash = avatar.hash
+        try:
+            new_hash = store.refresh(avatar)
+        except AvatarError as e:
+            failed.append((avatar.url, str(e)))
+            continue
+        if new_hash != old_hash:
+            changed += 1
+            User.query.filter(User.img_url == avatar.url) \
+                .update({"avatar_hash": new_hash}, synchronize_session=False)
+        db.session.commit()
+    return changed, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db", default="postgresql:///unit23_db", help="database url")
+    parser.add_argument("command", choices=["backfill", "refresh"])
+    args = parser.parse_args(argv)
+
+    from app import app, avatars, page_cache
+    app.config["SQLALCHEMY_DATABASE_URI"] = args.db
+
+    with app.app_context():
+        if args.command == "backfill":
+            count, failed = backfill(avatars)
+            print(f"{count} users now have a stored avatar")
+        else:
+            count, failed = refresh_all(avatars)
+            print(f"{count} images changed")
+        if count:
+            # user pages rendered before link to the old images
+            page_cache.clear()
+    for url, error in failed:
+        print(f"{url}: {error}")
+
+
+if __name__ == "__main__":
+    main()
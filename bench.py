@@ -0,0 +1,408 @@
+"""Route-level benchmarks for Blogly.
+
+    python bench.py --db postgresql:///bench_db --users 10000 --posts 200000 --save bench.json
+    python bench.py --db postgresql:///bench_db --no-generate --baseline bench.json --threshold 20
+
+Loads a generated dataset (see generate.py), then drives every route the app
+serves (the pages, the JSON API and its exports, imports, avatars and built
+assets; not the /metrics and /_profiler endpoints) either in-process through
+app.test_client() (the default) or over HTTP against a threaded server with
+--http --threads N. --asgi --threads N serves them with uvicorn and the async
+read path instead (see asgi.py), to compare the two under the same concurrency.
+For each route it reports p50/p95/p99 latency, throughput and SQL queries per
+request, timing each response until its whole body has been read. A route with
+nothing to request (no assets built) is skipped.
+
+--startup instead times a cold start (importing app.py and create_app) in fresh
+interpreters for each config profile, the cost every new worker pays.
+
+--save writes the results as a JSON baseline. --baseline compares against one and
+exits non-zero when a route's p95 got more than --threshold percent slower or it
+started issuing more queries.
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import string
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from sqlalchemy import event, func, select
+from sqlalchemy.engine import Engine
+
+from avatars import DEFAULT_AVATAR, SIZES
+from models import db, User, Post, Tag
+
+# (name, method, path, form data or raw body); {user_id}, {post_id}, {tag_id},
+# {avatar_hash}, {asset} and {victim} are filled in per request, victims being
+# rows created just to be deleted
+ROUTES = [
+    ("root", "GET", "/", None),
+    ("list_users", "GET", "/users", None),
+    ("get_user_form", "GET", "/users/new", None),
+    ("add_user", "POST", "/users/new", {"first_name": "Bench", "last_name": "Mark", "img_url": ""}),
+    ("show_user", "GET", "/users/{user_id}", None),
+    ("get_edit_user_form", "GET", "/users/{user_id}/edit", None),
+    ("edit_user", "POST", "/users/{user_id}/edit", {"first_name": "Bench", "last_name": "Mark", "img_url": ""}),
+    ("delete_user", "POST", "/users/{victim}/delete", None),
+    ("get_post_form", "GET", "/users/{user_id}/posts/new", None),
+    ("add_post", "POST", "/users/{user_id}/posts/new", {"title": "Bench", "content": "Mark", "tag_group": ["{tag_id}"]}),
+    ("show_post", "GET", "/posts/{post_id}", None),
+    ("get_edit_post_form", "GET", "/posts/{post_id}/edit", None),
+    ("edit_post", "POST", "/posts/{post_id}/edit", {"title": "Bench", "content": "Mark", "tag_group": ["{tag_id}"]}),
+    ("delete_post", "POST", "/posts/{victim}/delete", None),
+    ("post_picker", "GET", "/posts/picker?q=park", None),
+    ("search", "GET", "/search?q=park+waffle", None),
+    ("search_json", "GET", "/api/search?q=park+waffle", None),
+    ("list_tags", "GET", "/tags", None),
+    ("show_tag", "GET", "/tags/{tag_id}", None),
+    ("get_tag_form", "GET", "/tags/new", None),
+    ("add_tag", "POST", "/tags/new", {"name": "bench", "post_group": ["{post_id}"]}),
+    ("get_edit_tag_form", "GET", "/tags/{tag_id}/edit", None),
+    ("edit_tag", "POST", "/tags/{tag_id}/edit", {"name": "bench"}),
+    ("delete_tag", "POST", "/tags/{victim}/delete", None),
+    ("avatar", "GET", f"/avatars/{{avatar_hash}}-{SIZES['thumb']}.webp", None),
+    ("asset", "GET", "/assets/{asset}", None),
+    ("import_tags", "POST", "/import/tags?format=jsonl", b'{"name": "bench"}\n'),
+    ("api_users", "GET", "/api/v1/users", None),
+    ("api_user", "GET", "/api/v1/users/{user_id}", None),
+    ("api_posts", "GET", "/api/v1/posts", None),
+    ("api_post", "GET", "/api/v1/posts/{post_id}", None),
+    ("api_tags", "GET", "/api/v1/tags", None),
+    ("api_tag", "GET", "/api/v1/tags/{tag_id}", None),
+    ("export_users", "GET", "/api/v1/users/export", None),
+    ("export_posts", "GET", "/api/v1/posts/export", None),
+    ("export_posts_csv", "GET", "/api/v1/posts/export?format=csv", None),
+    ("export_tags", "GET", "/api/v1/tags/export", None),
+]
+# routes sending a whole table per request get fewer requests than --requests
+MAX_REQUESTS = {"export_users": 5, "export_posts": 5, "export_posts_csv": 5}
+
+
+class QueryCounter:
+    """Thread-safe count of SQL statements across every engine."""
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        event.listen(Engine, "before_cursor_execute", self.callback)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(Engine, "before_cursor_execute", self.callback)
+
+    def callback(self, *args):
+        with self.lock:
+            self.count += 1
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+# run in a fresh interpreter: seconds to import app.py and build the app for a profile
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+import app
+app.create_app({profile!r})
+print(time.perf_counter() - start)
+"""
+
+
+def startup_seconds(profile, runs=5):
+    """Median cold-start time for a config profile, over runs fresh interpreters."""
+
+    times = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-W", "ignore", "-c", STARTUP_SCRIPT.format(profile=profile)],
+                             capture_output=True, text=True, check=True).stdout
+        times.append(float(out))
+    return percentile(times, 50)
+
+
+def sample_ids():
+    """Ids of a busy user, a recent post and a popular tag to aim the routes at, a stored avatar and a built asset."""
+
+    post_id, user_id = db.session.execute(select(Post.id, Post.user_id).order_by(Post.id.desc()).limit(1)).first()
+    tag_id = db.session.execute(select(func.min(Tag.id))).scalar()
+    ids = {"user_id": user_id, "post_id": post_id, "tag_id": tag_id}
+
+    # the default avatar, stored if it isn't yet: every avatar is served the same way
+    with open(DEFAULT_AVATAR, "rb") as f:
+        ids["avatar_hash"] = current_app.extensions["avatars"].ingest_bytes(f.read())
+    asset = current_app.extensions["assets"].manifest.get("app.css")
+    if asset:
+        ids["asset"] = asset
+    return ids
+
+
+def placeholders(path):
+    return {field for _, field, _, _ in string.Formatter().parse(path) if field}
+
+
+def make_victims(name, count, ids):
+    """Rows for the delete routes to delete, created outside the timed section."""
+
+    if name == "delete_user":
+        users = [User(first_name="Victim", last_name="User") for _ in range(count)]
+        db.session.add_all(users)
+        db.session.flush()
+        db.session.add_all([Post(title="Victim", content="Post", user_id=u.id) for u in users])
+        rows = users
+    elif name == "delete_post":
+        rows = [Post(title="Victim", content="Post", user_id=ids["user_id"]) for _ in range(count)]
+        db.session.add_all(rows)
+    else:
+        rows = [Tag(name="victim") for _ in range(count)]
+        db.session.add_all(rows)
+    db.session.commit()
+    ids = [row.id for row in rows]
+    db.session.remove()
+    return iter(ids)
+
+
+def fill(value, ids):
+    if isinstance(value, list):
+        return [fill(v, ids) for v in value]
+    return value.format(**ids)
+
+
+def requests_for(name, path, data, ids, count):
+    """(path, form data or raw body) for each request to make against a route."""
+
+    victims = make_victims(name, count, ids) if "{victim}" in path else itertools.repeat(None)
+    for victim in itertools.islice(victims, count):
+        ids = dict(ids, victim=victim)
+        body = data if isinstance(data, bytes) else {k: fill(v, ids) for k, v in (data or {}).items()}
+        yield fill(path, ids), body
+
+
+def run_in_process(app, method, requests):
+    """Time each request through the test client; returns a list of seconds."""
+
+    client = app.test_client(use_cookies=False)
+    timings = []
+    for path, data in requests:
+        start = time.perf_counter()
+        resp = client.open(path, method=method, data=data or None)
+        # a streamed response does its work as its body is read
+        resp.get_data()
+        timings.append(time.perf_counter() - start)
+        if resp.status_code >= 400:
+            raise RuntimeError(f"{method} {path} returned {resp.status_code}")
+    return timings
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Time the POST itself, not the page it redirects to."""
+
+    def http_error_302(self, req, fp, code, msg, headers):
+        return fp
+
+    http_error_301 = http_error_303 = http_error_307 = http_error_302
+
+
+def run_http(base_url, method, requests, threads):
+    """Time each request over HTTP from a pool of threads; returns a list of seconds."""
+
+    opener = urllib.request.build_opener(NoRedirect)
+
+    def one(request):
+        path, data = request
+        body = None
+        if method == "POST":
+            body = data if isinstance(data, bytes) else urllib.parse.urlencode(data, doseq=True).encode()
+        start = time.perf_counter()
+        try:
+            with opener.open(urllib.request.Request(base_url + path, data=body, method=method)) as resp:
+                resp.read()
+        except urllib.error.HTTPError as err:
+            raise RuntimeError(f"{method} {path} returned {err.code}")
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(one, list(requests)))
+
+
+def start_server(app, asgi=False):
+    """Serve app on a free local port from a background thread: a threaded WSGI server, or uvicorn
+    running asgi.py's async read path in front of it. Returns (base URL, function stopping it)."""
+
+    # one access log line per request would drown the results
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    if not asgi:
+        from werkzeug.serving import make_server
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{server.server_port}", server.shutdown
+
+    import socket
+    import uvicorn
+    from asgi import AsyncReads
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(AsyncReads(app), log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+    return f"http://127.0.0.1:{sock.getsockname()[1]}", stop
+
+
+def benchmark(app, requests=50, threads=1, http=False, warmup=3, routes=None, out=sys.stdout, asgi=False):
+    """Benchmark every route (or the named ones) and return the results dict."""
+
+    stop = None
+    if http or asgi:
+        base_url, stop = start_server(app, asgi)
+
+    results = {}
+    try:
+        with app.app_context():
+            ids = sample_ids()
+            db.session.remove()
+
+            for name, method, path, data in ROUTES:
+                if routes and name not in routes:
+                    continue
+                missing = placeholders(path) - set(ids) - {"victim"}
+                if missing:
+                    print(f"{name:<20} skipped: nothing to request for {', '.join(sorted(missing))}", file=out)
+                    continue
+                if warmup:
+                    run_in_process(app, method, requests_for(name, path, data, ids, warmup))
+                count = min(requests, MAX_REQUESTS.get(name, requests))
+                batch = requests_for(name, path, data, ids, count)
+                # build victims before the clock starts
+                batch = list(batch)
+
+                start = time.perf_counter()
+                with QueryCounter() as counter:
+                    if http or asgi:
+                        timings = run_http(base_url, method, batch, threads)
+                    else:
+                        timings = run_in_process(app, method, batch)
+                elapsed = time.perf_counter() - start
+
+                results[name] = {
+                    "requests": len(timings),
+                    "p50_ms": round(percentile(timings, 50) * 1000, 3),
+                    "p95_ms": round(percentile(timings, 95) * 1000, 3),
+                    "p99_ms": round(percentile(timings, 99) * 1000, 3),
+                    "rps": round(len(timings) / elapsed, 1),
+                    "queries_per_request": round(counter.count / len(timings), 2),
+                }
+                print_row(name, results[name], out)
+    finally:
+        if stop:
+            stop()
+    return results
+
+
+def print_row(name, result, out):
+    print(f"{name:<20} p50 {result['p50_ms']:>9.2f}ms  p95 {result['p95_ms']:>9.2f}ms  "
+          f"p99 {result['p99_ms']:>9.2f}ms  {result['rps']:>8.1f} req/s  "
+          f"{result['queries_per_request']:>6.2f} queries/req", file=out)
+
+
+def regressions(baseline, current, threshold):
+    """Routes whose p95 grew by more than threshold percent, or that run more queries."""
+
+    found = []
+    for name, before in baseline.get("routes", {}).items():
+        after = current.get("routes", {}).get(name)
+        if after is None:
+            continue
+        limit = before["p95_ms"] * (1 + threshold / 100)
+        if after["p95_ms"] > limit:
+            found.append(f"{name}: p95 {before['p95_ms']}ms -> {after['p95_ms']}ms (limit {limit:.3f}ms)")
+        if after["queries_per_request"] > before["queries_per_request"]:
+            found.append(f"{name}: queries/request {before['queries_per_request']} -> {after['queries_per_request']}")
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db", default="postgresql:///bench_db", help="database to load and benchmark against")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=20000)
+    parser.add_argument("--tags", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-generate", dest="generate", action="store_false",
+                        help="reuse the data already in --db")
+    parser.add_argument("--requests", type=int, default=50, help="requests per route")
+    parser.add_argument("--http", action="store_true", help="go through a threaded HTTP server")
+    parser.add_argument("--asgi", action="store_true", help="go through uvicorn and the async read path (asgi.py)")
+    parser.add_argument("--threads", type=int, default=8, help="client threads in --http and --asgi mode")
+    parser.add_argument("--route", action="append", dest="routes", help="only benchmark this route (repeatable)")
+    parser.add_argument("--cache", action="store_true", help="leave the page cache on")
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="compare against this JSON file")
+    parser.add_argument("--threshold", type=float, default=20.0, help="allowed p95 slowdown, in percent")
+    parser.add_argument("--startup", action="store_true", help="time a cold start per config profile instead")
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        for profile in ("dev", "test", "prod"):
+            print(f"{profile:<6} {startup_seconds(profile) * 1000:8.1f} ms")
+        return
+
+    if args.generate:
+        from generate import generate
+        generate(args.db, args.users, args.posts, args.tags, seed=args.seed, reset=True)
+
+    from app import app
+    app.config["SQLALCHEMY_DATABASE_URI"] = args.db
+    app.config["PAGE_CACHE_ENABLED"] = args.cache
+
+    served = args.http or args.asgi
+    routes = benchmark(app, requests=args.requests, threads=args.threads if served else 1,
+                       http=args.http, routes=args.routes, asgi=args.asgi)
+    mode = "asgi" if args.asgi else "http" if args.http else "in-process"
+    current = {
+        "meta": {"db": args.db, "users": args.users, "posts": args.posts, "tags": args.tags,
+                 "mode": mode, "threads": args.threads if served else 1,
+                 "requests": args.requests},
+        "routes": routes,
+    }
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("mode") != current["meta"]["mode"]:
+            print("warning: baseline was recorded in a different mode", file=sys.stderr)
+        found = regressions(baseline, current, args.threshold)
+        for line in found:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+"""Rendered-page cache for the read-heavy pages.
+
+Pages are cached by route and entity id ("home", "post:3", "user:1", "tag:2").
+The write handlers in app.py invalidate exactly the keys their change touches,
+using the keys_for_* helpers below to work out which pages show the data.
+
+The same keys carry the pages' HTTP validators. Every invalidation bumps the
+key's row in page_versions (clear() bumps the "*" row that covers every page),
+and the cached routes answer with an ETag and Last-Modified built from those
+rows. A request whose If-None-Match/If-Modified-Since still matches gets a 304
+after one primary-key lookup, without rendering or touching the cache. A page
+is cached along with the ETag it was rendered under, and served only while that
+is still the current one: a write handled by another worker drops the page from
+that worker's cache alone, but moves the shared version on. Writes
+made outside the app's handlers (generate.py, hand-run SQL) aren't seen; call
+page_cache.clear() after them, and after deploying template changes.
+
+Entries live in an in-process LRU by default. Set PAGE_CACHE_BACKEND to a
+SharedBackend (anything with redis-style get/set/delete, e.g. a redis client or
+the LocalClient stand-in) to share one cache between worker processes.
+"""
+
+import datetime
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, make_response, request, session
+from sqlalchemy import select
+from werkzeug.wrappers import Response
+
+from models import db, Post, PostTag, PageVersion
+
+# invalidations touching more pages than this (deleting a prolific user) bump the "*" row instead
+MAX_BUMPED_KEYS = 500
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class MemoryBackend:
+    """In-process LRU with a size bound and per-entry TTL."""
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class SharedBackend:
+    """Cache shared between processes through a redis-style client."""
+
+    def __init__(self, client, ttl=300, prefix="blogly:page:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if isinstance(value, bytes):
+            value = value.decode()
+        return value
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+    def delete_many(self, keys):
+        keys = [self.prefix + key for key in keys]
+        if keys:
+            self.client.delete(*keys)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + "*"))
+        if keys:
+            self.client.delete(*keys)
+
+
+class LocalClient:
+    """Dict-backed stand-in for a redis client, for local runs and tests."""
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self.data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + ex if ex else None)
+
+    def delete(self, *keys):
+        with self.lock:
+            return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def scan_iter(self, match="*"):
+        prefix = match.rstrip("*")
+        with self.lock:
+            return [key for key in self.data if key.startswith(prefix)]
+
+
+class PageCache:
+    """Cache rendered pages and drop them when the data they show changes."""
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("PAGE_CACHE_ENABLED", True)
+        app.config.setdefault("PAGE_CACHE_SIZE", 1024)
+        app.config.setdefault("PAGE_CACHE_TTL", 300)
+        app.config.setdefault("PAGE_CACHE_BACKEND", None)
+
+        self.backend = app.config["PAGE_CACHE_BACKEND"] or MemoryBackend(
+            app.config["PAGE_CACHE_SIZE"], app.config["PAGE_CACHE_TTL"])
+        app.extensions["page_cache"] = self
+
+    def cached(self, route):
+        """Cache a view's rendered page under "<route>:<first url arg>" (or just route).
+
+        The response carries the page's ETag and Last-Modified, and a request
+        that still has the current page gets a 304 instead.
+        """
+
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                # a page carrying a flash message is for this visitor alone: no validator, no cache
+                if session.get("_flashes"):
+                    return view(*args, **kwargs)
+
+                key = page_key(route, kwargs)
+                etag, last_modified = self.validator(key)
+                unchanged = not_modified(etag, last_modified)
+                if unchanged is not None:
+                    return unchanged
+
+                page = self.lookup(key, etag)
+                if page is None:
+                    page = view(*args, **kwargs)
+                    self.store(key, page, etag)
+                return validated(page, etag, last_modified)
+            return wrapper
+        return decorator
+
+    def lookup(self, key, etag):
+        """The page cached under key if it was rendered under etag, or None.
+
+        Only whole first pages are shared, paged views always render.
+        """
+
+        if not current_app.config["PAGE_CACHE_ENABLED"] or request.args:
+            return None
+        entry = self.backend.get(key)
+        if entry is None:
+            return None
+        cached_etag, _, page = entry.partition("\n")
+        # rendered before a write this process's cache didn't hear about
+        return page if cached_etag == etag else None
+
+    def store(self, key, page, etag):
+        """Keep a page the view just rendered under etag, if it is one lookup would share."""
+
+        if not current_app.config["PAGE_CACHE_ENABLED"] or request.args:
+            return
+        if isinstance(page, str):
+            self.backend.set(key, f"{etag}\n{page}")
+        elif isinstance(page, Response) and page.is_streamed:
+            # a streamed page (streaming.py) is stored once all of it has been sent
+            page.response = teed(page.response, lambda sent: self.backend.set(key, f"{etag}\n{sent}"))
+
+    def validator(self, key):
+        """(ETag, Last-Modified) for the page under key, from its page_versions row and the "*" row."""
+
+        return validator_from(db.session.execute(validator_statement(key)), key)
+
+    def invalidate(self, keys):
+        """Drop the cached pages under keys and move them to new versions."""
+
+        keys = set(keys)
+        self.backend.delete_many(keys)
+        self.bump(keys)
+
+    def clear(self):
+        self.backend.clear()
+        self.bump([PageVersion.ALL])
+
+    def bump(self, keys):
+        if len(keys) > MAX_BUMPED_KEYS:
+            # cheaper to have every page revalidate once than to upsert thousands of rows
+            keys = [PageVersion.ALL]
+        if keys:
+            # sorted, so concurrent bumps lock rows in the same order
+            db.session.execute(PageVersion.bump(db.engine.dialect.name), [{"key": key} for key in sorted(keys)])
+            db.session.commit()
+
+
+def page_key(route, view_args):
+    """The cache key for a page: "<route>:<first url arg>", or just route."""
+
+    return ":".join([route, *map(str, view_args.values())])
+
+
+def validator_statement(key):
+    """The page_versions rows behind the validator of the page under key."""
+
+    return select(PageVersion.key, PageVersion.version, PageVersion.changed_at) \
+        .where(PageVersion.key.in_([key, PageVersion.ALL]))
+
+
+def validator_from(rows, key):
+    """(ETag, Last-Modified) from validator_statement's rows."""
+
+    rows = {row.key: row for row in rows}
+    everything = rows.get(PageVersion.ALL)
+    all_version, all_changed = (everything.version, utc(everything.changed_at)) if everything else (0, EPOCH)
+    page = rows.get(key)
+    version, changed = (page.version, utc(page.changed_at)) if page else (0, all_changed)
+    last_modified = max(all_changed, changed).replace(microsecond=0)
+    return f"{all_version}.{version}.{int(last_modified.timestamp())}", last_modified
+
+
+def not_modified(etag, last_modified):
+    """A 304 response if the request's If-None-Match/If-Modified-Since still match, else None."""
+
+    conditional = Response()
+    conditional.set_etag(etag)
+    conditional.last_modified = last_modified
+    if conditional.make_conditional(request).status_code == 304:
+        return conditional
+    return None
+
+
+def validated(page, etag, last_modified):
+    """The response for a page, carrying its validators if it rendered."""
+
+    response = make_response(page)
+    if response.status_code == 200:
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        # browsers and the CDN may keep the page, but must check it is current
+        response.cache_control.no_cache = True
+    return response
+
+
+def teed(chunks, store):
+    """Pass chunks through, then hand them joined to store; a client that goes away first stores nothing."""
+
+    sent = []
+    for chunk in chunks:
+        sent.append(chunk)
+        yield chunk
+    store("".join(sent))
+
+
+def utc(moment):
+    """SQLite hands back naive datetimes (CURRENT_TIMESTAMP is UTC there)."""
+
+    return moment if moment.tzinfo else moment.replace(tzinfo=datetime.timezone.utc)
+
+
+def keys_for_posts(post_ids, user_ids=(), tag_ids=()):
+    """Pages showing these posts: the homepage, the posts, their authors and tags."""
+
+    keys = ["home"]
+    keys += [f"post:{post_id}" for post_id in post_ids]
+    keys += [f"user:{user_id}" for user_id in user_ids]
+    keys += [f"tag:{tag_id}" for tag_id in tag_ids]
+    return keys
+
+
+def keys_for_post(post_id, user_id):
+    """Pages showing a post, including every tag page it is listed on."""
+
+    tag_ids = [tag_id for (tag_id,) in db.session.query(PostTag.tag_id).filter(PostTag.post_id == post_id)]
+    return keys_for_posts([post_id], [user_id], tag_ids)
+
+
+def keys_for_user(user_id, deleting=False):
+    """Pages showing a user's name: their page, their posts' pages and the homepage.
+
+    Deleting the user also takes their posts off every tag page they're listed on.
+    """
+
+    post_ids = [post_id for (post_id,) in db.session.query(Post.id).filter(Post.user_id == user_id)]
+    tag_ids = []
+    if deleting:
+        query = db.session.query(PostTag.tag_id).join(Post, Post.id == PostTag.post_id)
+        tag_ids = [tag_id for (tag_id,) in query.filter(Post.user_id == user_id).distinct()]
+    return keys_for_posts(post_ids, [user_id], tag_ids)
+
+
+def keys_for_tag(tag_id):
+    """Pages showing a tag's name: its page, its posts' pages and the homepage."""
+
+    post_ids = [post_id for (post_id,) in db.session.query(PostTag.post_id).filter(PostTag.tag_id == tag_id)]
+    return keys_for_posts(post_ids, tag_ids=[tag_id])
@@ -0,0 +1,148 @@
+"""Process-local copy of the tags table.
+
+There are few tags and they rarely change, yet the post forms, the tag list and
+tag validation on post writes all need them. Each process keeps them in memory
+instead: an id -> name map plus the tags sorted by name. Each copy is tagged with
+the version it was loaded at.
+
+The version is a row in catalog_versions. Any ORM write to tags, whether through
+the unit of work or a bulk query.update()/delete(), bumps it in the same
+transaction. Other workers see the new version the next time they check, which
+is at most every TAG_CATALOG_CHECK_SECONDS, and reload. The process that made the
+change reloads on its next read.
+"""
+
+import bisect
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import event
+
+from models import db, Tag, CatalogVersion
+from pagination import Page, decode_cursor, encode_cursor, PER_PAGE
+
+# stands in for a Tag in templates: just its id and name
+CatalogTag = namedtuple("CatalogTag", "id name")
+
+# the tag list's sort order, as for Tag.order_by_name
+KEYS = [(Tag.name, "asc"), (Tag.id, "asc")]
+
+
+class Snapshot:
+    """Every tag at one catalog version."""
+
+    def __init__(self, version, local_changes, tags):
+        self.version = version
+        self.local_changes = local_changes
+        self.by_name = [CatalogTag(tag_id, name) for name, tag_id in sorted((name, tag_id) for tag_id, name in tags)]
+        # (name, id) of each tag in by_name, to bisect for a cursor
+        self.keys = [(tag.name, tag.id) for tag in self.by_name]
+        self.names = {tag.id: tag.name for tag in self.by_name}
+
+
+class TagCatalog:
+    """Flask extension holding the current Snapshot and keeping it current."""
+
+    # commits in this process that changed tags; a snapshot older than the latest is reloaded
+    local_changes = 0
+
+    def __init__(self, app=None):
+        self.snapshot = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+        self.check_seconds = 1.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # how long a process trusts its copy before asking the database for the version
+        app.config.setdefault("TAG_CATALOG_CHECK_SECONDS", 1.0)
+        self.check_seconds = app.config["TAG_CATALOG_CHECK_SECONDS"]
+
+        if not event.contains(db.session, "before_flush", bump_on_flush):
+            event.listen(db.session, "before_flush", bump_on_flush)
+            event.listen(db.session, "do_orm_execute", bump_on_bulk_write)
+            event.listen(db.session, "after_commit", count_local_change)
+            event.listen(db.session, "after_rollback", forget_bump)
+        app.extensions["tag_catalog"] = self
+
+    # ---- reads
+
+    def current(self):
+        """The Snapshot, reloaded first if the database has a newer version."""
+
+        now = time.monotonic()
+        snapshot = self.snapshot
+        local_changes = TagCatalog.local_changes
+        if (snapshot is not None and snapshot.local_changes == local_changes
+                and now - self.checked_at < self.check_seconds):
+            return snapshot
+
+        with self.lock:
+            version = db.session.query(CatalogVersion.version).filter(CatalogVersion.name == "tags").scalar() or 0
+            snapshot = self.snapshot
+            if snapshot is None or snapshot.version != version or snapshot.local_changes != local_changes:
+                tags = db.session.query(Tag.id, Tag.name).all()
+                self.snapshot = snapshot = Snapshot(version, local_changes, tags)
+            self.checked_at = now
+            return snapshot
+
+    def all(self):
+        """Every tag, by name."""
+
+        return self.current().by_name
+
+    def known(self, tag_ids):
+        """The ids in tag_ids that belong to a tag."""
+
+        names = self.current().names
+        return {tag_id for tag_id in tag_ids if tag_id in names}
+
+    def get(self, tag_id):
+        """The CatalogTag with this id, or None."""
+
+        name = self.current().names.get(tag_id)
+        return None if name is None else CatalogTag(tag_id, name)
+
+    def page(self, cursor=None, per_page=PER_PAGE):
+        """Page of tags by name, like Tag.order_by_name but from memory."""
+
+        snapshot = self.current()
+        values = decode_cursor(cursor, KEYS)
+        start = bisect.bisect_right(snapshot.keys, tuple(values)) if values else 0
+        rows = snapshot.by_name[start:start + per_page]
+        next_cursor = None
+        if start + per_page < len(snapshot.by_name):
+            next_cursor = encode_cursor([rows[-1].name, rows[-1].id])
+        return Page(rows, next_cursor)
+
+
+def bump(session):
+    """Move the tag catalog to a new version, once per transaction."""
+
+    if not session.info.get("tag_catalog_bumped"):
+        session.info["tag_catalog_bumped"] = True
+        session.execute(CatalogVersion.bump("tags"))
+
+
+def bump_on_flush(session, flush_context, instances):
+    # a tag is only "dirty" when a post is added to it; that doesn't change the catalog
+    changed = [*session.new, *session.deleted] + [obj for obj in session.dirty
+                                                  if session.is_modified(obj, include_collections=False)]
+    if any(isinstance(obj, Tag) for obj in changed):
+        bump(session)
+
+
+def bump_on_bulk_write(state):
+    if (state.is_update or state.is_delete) and state.bind_mapper is Tag.__mapper__:
+        bump(state.session)
+
+
+def count_local_change(session):
+    if session.info.pop("tag_catalog_bumped", False):
+        TagCatalog.local_changes += 1
+
+
+def forget_bump(session):
+    session.info.pop("tag_catalog_bumped", None)
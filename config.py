@@ -0,0 +1,114 @@
+"""Configuration profiles for create_app: "dev", "test" and "prod".
+
+    app = create_app("prod")
+    gunicorn --preload -w 4 "app:create_app('prod')"
+    BLOGLY_CONFIG=prod python -m flask run    # profile for app.app
+
+Settings a deployment needs to change come from the environment:
+
+    DATABASE_URL             primary database (default postgresql:///unit23_db)
+    READ_REPLICA_URL         replica to read GET requests from (see routing.py)
+    SECRET_KEY
+    DB_POOL_SIZE             connections each worker keeps open
+    DB_MAX_OVERFLOW          extra connections allowed under load, closed when returned
+    DB_POOL_RECYCLE          seconds before a connection is replaced
+    DB_POOL_PRE_PING         1 to test connections as they are checked out
+    DB_STATEMENT_TIMEOUT_MS  PostgreSQL statement_timeout; 0 for none
+    ASYNC_DB_POOL_SIZE       connections each ASGI worker keeps open for the async reads (see asgi.py)
+    SLOW_QUERY_SECONDS       queries slower than this are logged (see metrics.py)
+    SQLALCHEMY_ECHO          1 to print every statement (dev only)
+    WRITE_BEHIND             1 to batch new posts into group commits (see writebehind.py)
+    STREAM_TEMPLATES         1 to stream the user and tag pages as they render (see streaming.py)
+    PROFILER_TOKEN           bearer token for the /_profiler endpoints; unset, they 404 (see profiler.py)
+    PROFILER_ROUTE           route pattern every worker profiles from startup, PROFILER_PERCENT of requests
+"""
+
+import os
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def env_flag(name, default):
+    return os.environ.get(name, "1" if default else "0") == "1"
+
+
+class Config:
+    """Settings shared by every profile."""
+
+    SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL", "postgresql:///unit23_db")
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    SECRET_KEY = os.environ.get("SECRET_KEY", "secret")
+    SLOW_QUERY_SECONDS = float(os.environ.get("SLOW_QUERY_SECONDS", 0.25))
+    PROFILER_TOKEN = os.environ.get("PROFILER_TOKEN")
+    PROFILER_ROUTE = os.environ.get("PROFILER_ROUTE")
+    PROFILER_PERCENT = float(os.environ.get("PROFILER_PERCENT", 100))
+
+    # connection pool, per worker process; create_app turns these into SQLALCHEMY_ENGINE_OPTIONS
+    DB_POOL_SIZE = env_int("DB_POOL_SIZE", 5)
+    DB_MAX_OVERFLOW = env_int("DB_MAX_OVERFLOW", 10)
+    DB_POOL_RECYCLE = env_int("DB_POOL_RECYCLE", 1800)
+    DB_POOL_PRE_PING = env_flag("DB_POOL_PRE_PING", False)
+    DB_STATEMENT_TIMEOUT_MS = env_int("DB_STATEMENT_TIMEOUT_MS", 0)
+    # the async read path's pool (asgi.py): one event loop has many requests waiting on the database at once
+    ASYNC_DB_POOL_SIZE = env_int("ASYNC_DB_POOL_SIZE", 20)
+
+    # new posts go through the write-behind queue instead of committing one by one
+    WRITE_BEHIND = env_flag("WRITE_BEHIND", False)
+
+    # the user and tag pages render as they are sent, with longer post lists read off a server-side cursor
+    STREAM_TEMPLATES = env_flag("STREAM_TEMPLATES", False)
+
+    # debug-only extensions (the debug toolbar), imported only when on
+    DEBUG_TOOLBAR = False
+
+
+class DevConfig(Config):
+    """Local development: debug toolbar (active under FLASK_ENV=development), SQL echo on request."""
+
+    DEBUG_TOOLBAR = True
+    # link static/ itself, so edits show up without rebuilding the assets
+    ASSETS_USE_MANIFEST = False
+    # makes sure redirects aren't stopped by the debugtoolbar
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+    # print all SQL statements to terminal; off unless asked for with SQLALCHEMY_ECHO=1
+    SQLALCHEMY_ECHO = env_flag("SQLALCHEMY_ECHO", False)
+
+
+class TestConfig(Config):
+    """The test suite: its own database, no page cache, lazy loads are errors."""
+
+    SQLALCHEMY_DATABASE_URI = os.environ.get("TEST_DATABASE_URL", "postgresql:///test_db")
+    TESTING = True
+    PAGE_CACHE_ENABLED = False
+    RAISE_ON_LAZY_LOAD = True
+    DB_POOL_SIZE = 2
+
+
+class ProdConfig(Config):
+    """Preforking server: checked connections and a statement timeout."""
+
+    DB_POOL_SIZE = env_int("DB_POOL_SIZE", 10)
+    DB_MAX_OVERFLOW = env_int("DB_MAX_OVERFLOW", 20)
+    DB_POOL_RECYCLE = env_int("DB_POOL_RECYCLE", 300)
+    DB_POOL_PRE_PING = env_flag("DB_POOL_PRE_PING", True)
+    DB_STATEMENT_TIMEOUT_MS = env_int("DB_STATEMENT_TIMEOUT_MS", 30000)
+
+
+PROFILES = {"dev": DevConfig, "test": TestConfig, "prod": ProdConfig}
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the pool settings in config."""
+
+    options = {
+        "pool_size": config["DB_POOL_SIZE"],
+        "max_overflow": config["DB_MAX_OVERFLOW"],
+        "pool_recycle": config["DB_POOL_RECYCLE"],
+        "pool_pre_ping": config["DB_POOL_PRE_PING"],
+    }
+    if config["DB_STATEMENT_TIMEOUT_MS"]:
+        options["connect_args"] = {"options": f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT_MS']}"}
+    return options
@@ -0,0 +1,68 @@
+"""Check and repair the post counters on users and tags.
+
+    python counters.py                    # fix any counter that disagrees with the rows
+    python counters.py --check            # only report them; exits 1 if there are any
+
+users.post_count and tags.post_count are kept by triggers (see models.py), so
+they only drift if something bypasses them: a TRUNCATE, a restore of one table,
+or triggers disabled for a bulk load. This recounts every user's and tag's posts
+and rewrites only the counters that are wrong.
+"""
+
+import argparse
+import sys
+
+from sqlalchemy import create_engine, func, select, text
+
+from models import User, Post, Tag, PostTag
+
+# each counter, and the rows it counts
+COUNTERS = [(User.__table__, Post.user_id), (Tag.__table__, PostTag.tag_id)]
+
+
+def actual_count(table, key):
+    """Correlated subquery counting table's rows by key."""
+
+    return select(func.count()).where(key == table.c.id).scalar_subquery()
+
+
+def reconcile(conn, check=False):
+    """Recount the counters; return {table name: number of wrong counters}, fixed unless check.
+
+    On PostgreSQL posts and post_tags are locked against writes meanwhile, so no
+    post lands between a count and its counter.
+    """
+
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("LOCK TABLE posts, post_tags IN SHARE MODE"))
+    drift = {}
+    for table, key in COUNTERS:
+        actual = actual_count(table, key)
+        if check:
+            statement = select(func.count()).select_from(table).where(table.c.post_count != actual)
+            drift[table.name] = conn.execute(statement).scalar()
+        else:
+            statement = table.update().where(table.c.post_count != actual).values(post_count=actual)
+            drift[table.name] = conn.execute(statement).rowcount
+    return drift
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db", default="postgresql:///unit23_db", help="database url")
+    parser.add_argument("--check", action="store_true", help="report wrong counters without fixing them")
+    args = parser.parse_args(argv)
+
+    engine = create_engine(args.db)
+    with engine.begin() as conn:
+        drift = reconcile(conn, check=args.check)
+    engine.dispose()
+
+    for name, wrong in drift.items():
+        print(f"{name}: {wrong} wrong post_count{'' if wrong == 1 else 's'}{'' if args.check else ' fixed'}")
+    if args.check and any(drift.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
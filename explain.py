@@ -0,0 +1,129 @@
+"""Flag sequential scans in the queries Blogly's routes issue.
+
+    python explain.py --db postgresql:///bench_db --threshold 10000
+
+Drives every route in app.py once (the same routes bench.py uses), records each
+SQL statement it sends, then runs EXPLAIN on the SELECT/UPDATE/DELETE ones with
+the same parameters. Any plan that sequentially scans a table holding more than
+--threshold rows is reported, and the exit status is non-zero if there are any.
+Run it against a database big enough for the planner to care (see generate.py).
+"""
+
+import argparse
+import sys
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+from bench import ROUTES, requests_for, run_in_process, sample_ids
+from models import db
+
+EXPLAINABLE = ("SELECT", "UPDATE", "DELETE", "WITH")
+
+
+class StatementRecorder:
+    """Record (statement, parameters) for everything sent to any engine."""
+
+    def __init__(self):
+        self.statements = []
+
+    def __enter__(self):
+        event.listen(Engine, "before_cursor_execute", self.callback)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(Engine, "before_cursor_execute", self.callback)
+
+    def callback(self, conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(EXPLAINABLE):
+            self.statements.append((statement, parameters))
+
+
+def capture(app, routes=None):
+    """{route name: [(statement, parameters), ...]} from one request to each route."""
+
+    captured = {}
+    with app.app_context():
+        ids = sample_ids()
+        db.session.remove()
+        for name, method, path, data in ROUTES:
+            if routes and name not in routes:
+                continue
+            batch = list(requests_for(name, path, data, ids, 1))
+            with StatementRecorder() as recorder:
+                run_in_process(app, method, batch)
+            captured[name] = recorder.statements
+    return captured
+
+
+def plan_nodes(node):
+    """Every node in an EXPLAIN (FORMAT JSON) plan tree."""
+
+    yield node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def explain(conn, statement, parameters):
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+        return cursor.fetchone()[0][0]["Plan"]
+    finally:
+        cursor.close()
+
+
+def table_rows(conn):
+    """Planner's row estimate for every table."""
+
+    rows = conn.execute(text("SELECT relname, reltuples FROM pg_class WHERE relkind IN ('r', 'p')"))
+    return {name: tuples for name, tuples in rows}
+
+
+def check(app, threshold, routes=None, out=sys.stdout):
+    """Return a list of (route, table, table rows, statement) for every flagged seq scan."""
+
+    captured = capture(app, routes)
+    flagged = []
+    with app.app_context():
+        engine = db.engine
+        if engine.dialect.name != "postgresql":
+            raise RuntimeError("explain.py reads PostgreSQL plans")
+        with engine.connect() as conn:
+            sizes = table_rows(conn)
+            for name, statements in captured.items():
+                seen = set()
+                for statement, parameters in statements:
+                    if statement in seen:
+                        continue
+                    seen.add(statement)
+                    for node in plan_nodes(explain(conn, statement, parameters)):
+                        if node["Node Type"] != "Seq Scan":
+                            continue
+                        table = node["Relation Name"]
+                        if sizes.get(table, 0) > threshold:
+                            flagged.append((name, table, int(sizes[table]), statement))
+                            print(f"{name}: seq scan on {table} (~{int(sizes[table])} rows)\n    "
+                                  f"{' '.join(statement.split())}", file=out)
+    return flagged
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db", default="postgresql:///bench_db", help="database to explain against")
+    parser.add_argument("--threshold", type=int, default=10000, help="flag seq scans of tables bigger than this")
+    parser.add_argument("--route", action="append", dest="routes", help="only check this route (repeatable)")
+    args = parser.parse_args(argv)
+
+    from app import app
+    app.config["SQLALCHEMY_DATABASE_URI"] = args.db
+    app.config["PAGE_CACHE_ENABLED"] = False
+
+    flagged = check(app, args.threshold, args.routes)
+    if flagged:
+        sys.exit(1)
+    print("no sequential scans over the threshold")
+
+
+if __name__ == "__main__":
+    main()
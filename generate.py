@@ -0,0 +1,241 @@
+"""Generate a large synthetic Blogly dataset for load testing.
+
+    python generate.py --db postgresql:///unit23_db --users 100000 --posts 2000000 --tags 500 --reset
+
+Unlike seed.py (a handful of hand-written rows) this streams rows in chunks,
+so memory stays flat however many rows are asked for, and the same --seed
+always produces the same data. The shape is meant to look like production:
+
+* posts per user follow a power law (a few prolific authors, a long tail)
+* tag popularity is Zipfian (a few tags are on most posts)
+* created_at is spread over --days, ending at --end (default now), in id order
+
+PostgreSQL targets are loaded with COPY; anything else (e.g. a local SQLite
+file, sqlite:///blogly.db) with chunked executemany inserts.
+"""
+
+import argparse
+import bisect
+import csv
+import datetime
+import io
+import itertools
+import math
+import random
+import sys
+
+from sqlalchemy import create_engine, func, select, text
+
+from models import db, User, Post, Tag, PostTag, CatalogVersion, PageVersion
+
+FIRST_NAMES = ["Leslie", "Ron", "Ann", "April", "Andy", "Tom", "Ben", "Chris", "Donna", "Jerry",
+               "Tammy", "Mark", "Craig", "Jean-Ralphio", "Mona-Lisa", "Ethel", "Perd", "Joan", "Shauna", "Dave"]
+LAST_NAMES = ["Knope", "Swanson", "Perkins", "Ludgate", "Dwyer", "Haverford", "Wyatt", "Traeger", "Meagle",
+              "Gergich", "Brendanawicz", "Saperstein", "Beavers", "Hapley", "Malone", "Sanderson", "Nygaard"]
+WORDS = ("the a of and to in is it that for on with as was at by this be from or have not are but one "
+         "pawnee park waffle parks recreation council budget calzone pit lot eagleton town hall meeting "
+         "mini horse li'l sebastian grant permit festival harvest swing set library raccoon bacon eggs "
+         "whiskey woodworking canoe river trail gazebo mural petition campaign election bulletin").split()
+
+# generated rows are inserted this many at a time
+CHUNK = 10000
+
+
+def zipf_cdf(n, s):
+    """Cumulative weights for ranks 1..n with weight 1/rank**s."""
+
+    return list(itertools.accumulate(1 / (rank ** s) for rank in range(1, n + 1)))
+
+
+def zipf_pick(rng, cdf):
+    """Pick a 0-based rank from a cumulative weight list."""
+
+    return bisect.bisect_left(cdf, rng.random() * cdf[-1])
+
+
+def coprime_step(n):
+    """A step coprime with n; i * step % n then visits 0..n-1 in a scrambled order."""
+
+    step = int(n * 0.6180339887) | 1
+    while math.gcd(step, n) != 1:
+        step += 2
+    return step
+
+
+def sentence(rng, low, high):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+
+def generate_users(rng, first_id, count):
+    """Users with Zipf-skewed first and last names, so sorting by name has plenty of ties."""
+
+    first_cdf = zipf_cdf(len(FIRST_NAMES), 1.1)
+    last_cdf = zipf_cdf(len(LAST_NAMES), 1.1)
+    for user_id in range(first_id, first_id + count):
+        yield {
+            "id": user_id,
+            "first_name": FIRST_NAMES[zipf_pick(rng, first_cdf)],
+            "last_name": LAST_NAMES[zipf_pick(rng, last_cdf)],
+            "img_url": User.url,
+        }
+
+
+def generate_tags(first_id, count):
+    for tag_id in range(first_id, first_id + count):
+        yield {"id": tag_id, "name": f"{WORDS[tag_id % len(WORDS)]}-{tag_id}"}
+
+
+def generate_posts(rng, first_id, count, user_ids, tag_ids, start, days, skew, max_tags, tag_skew):
+    """Posts and their post_tags rows, in created_at order.
+
+    The author of each post is user rank floor(n * u**skew) for uniform u, which
+    gives a power-law number of posts per user; ranks are then scrambled over the
+    user ids so the prolific authors aren't simply the oldest accounts.
+    """
+
+    first_user, n_users = user_ids
+    first_tag, n_tags = tag_ids
+    step = coprime_step(n_users)
+    tag_cdf = zipf_cdf(n_tags, tag_skew) if n_tags else None
+    span = days * 86400
+
+    for i in range(count):
+        post_id = first_id + i
+        rank = min(int(n_users * rng.random() ** skew), n_users - 1)
+        seconds = span * i / count + rng.random() * span / count
+        post = {
+            "id": post_id,
+            "title": sentence(rng, 2, 8).capitalize(),
+            "content": sentence(rng, 10, 120),
+            "created_at": start + datetime.timedelta(seconds=seconds),
+            "user_id": first_user + rank * step % n_users,
+        }
+        tags = set()
+        if tag_cdf:
+            for _ in range(rng.randint(0, max_tags)):
+                tags.add(first_tag + zipf_pick(rng, tag_cdf))
+        yield post, [{"post_id": post_id, "tag_id": tag_id} for tag_id in sorted(tags)]
+
+
+def chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def copy_rows(conn, table, rows):
+    """Load rows into a PostgreSQL table with COPY ... FROM STDIN."""
+
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[c] for c in columns])
+    buffer.seek(0)
+    cursor = conn.connection.cursor()
+    cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def insert_rows(conn, table, rows, use_copy):
+    if not rows:
+        return
+    if use_copy:
+        copy_rows(conn, table, rows)
+    else:
+        conn.execute(table.insert(), rows)
+
+
+def next_id(conn, table):
+    return (conn.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+
+
+def reset_sequences(conn):
+    """Move PostgreSQL id sequences past the explicitly inserted ids."""
+
+    for table in ("users", "posts", "tags"):
+        conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                          f"COALESCE((SELECT MAX(id) FROM {table}), 1))"))
+
+
+def generate(url, users, posts, tags, seed=0, days=365, end=None, skew=3.0, max_tags=4, tag_skew=1.1,
+             chunk=CHUNK, reset=False, copy=None, out=sys.stderr):
+    """Stream users, tags, posts and post_tags into the database at url."""
+
+    engine = create_engine(url)
+    postgres = engine.dialect.name == "postgresql"
+    use_copy = postgres if copy is None else copy
+    rng = random.Random(seed)
+
+    if reset:
+        db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+
+    user_table, post_table = User.__table__, Post.__table__
+    tag_table, post_tag_table = Tag.__table__, PostTag.__table__
+
+    with engine.connect() as conn:
+        first_user, first_tag, first_post = (next_id(conn, t) for t in (user_table, tag_table, post_table))
+
+    def load(table, rows):
+        total = 0
+        for batch in chunks(rows, chunk):
+            with engine.begin() as conn:
+                insert_rows(conn, table, batch, use_copy)
+            total += len(batch)
+            print(f"{table.name}: {total}", file=out)
+
+    load(user_table, generate_users(rng, first_user, users))
+    load(tag_table, generate_tags(first_tag, tags))
+
+    if users:
+        end = end or datetime.datetime.now().replace(microsecond=0)
+        start = end - datetime.timedelta(days=days)
+        rows = generate_posts(rng, first_post, posts, (first_user, users), (first_tag, tags),
+                              start, days, skew, max_tags, tag_skew)
+        written = 0
+        # each post and its post_tags rows go in the same transaction
+        for batch in chunks(rows, chunk):
+            with engine.begin() as conn:
+                insert_rows(conn, post_table, [post for post, _ in batch], use_copy)
+                insert_rows(conn, post_tag_table, [pt for _, pts in batch for pt in pts], use_copy)
+            written += len(batch)
+            print(f"posts: {written}", file=out)
+
+    with engine.begin() as conn:
+        # running app processes pick up the new tags
+        conn.execute(CatalogVersion.bump("tags"))
+        # and stop answering 304 for pages rendered before the load
+        conn.execute(PageVersion.bump(engine.dialect.name), [{"key": PageVersion.ALL}])
+        if postgres:
+            reset_sequences(conn)
+    engine.dispose()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db", default="postgresql:///unit23_db", help="database url (sqlite:///file.db works too)")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--tags", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0, help="same seed, same data")
+    parser.add_argument("--days", type=int, default=365, help="spread created_at over this many days")
+    parser.add_argument("--end", type=datetime.datetime.fromisoformat, default=None,
+                        help="latest created_at, ISO format (default: now)")
+    parser.add_argument("--skew", type=float, default=3.0, help="posts-per-user power law exponent (1 = uniform)")
+    parser.add_argument("--max-tags", type=int, default=4, help="most tags on one post")
+    parser.add_argument("--tag-skew", type=float, default=1.1, help="Zipf exponent for tag popularity")
+    parser.add_argument("--chunk", type=int, default=CHUNK, help="rows per insert batch")
+    parser.add_argument("--reset", action="store_true", help="drop and recreate the tables first")
+    parser.add_argument("--no-copy", dest="copy", action="store_false", default=None,
+                        help="use executemany even on PostgreSQL")
+    args = parser.parse_args(argv)
+
+    generate(args.db, args.users, args.posts, args.tags, seed=args.seed, days=args.days, end=args.end, skew=args.skew,
+             max_tags=args.max_tags, tag_skew=args.tag_skew, chunk=args.chunk, reset=args.reset, copy=args.copy)
+
+
+if __name__ == "__main__":
+    main()
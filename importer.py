@@ -0,0 +1,419 @@
+"""Bulk import of users, posts and tags from JSONL or CSV.
+
+    python importer.py --db postgresql:///unit23_db users users.jsonl
+    python importer.py --db postgresql:///unit23_db posts posts.csv
+    curl -F file=@posts.jsonl http://localhost:5000/import/posts
+
+One object (JSONL) or row (CSV, with a header line) per record, with the same
+fields the /api/v1 exports write:
+
+    users: first_name, last_name, img_url (optional)
+    posts: title, content, user_id, created_at (optional, ISO), tags (list of
+           names; "|"-separated in CSV)
+    tags:  name
+
+Any record may carry an id to keep the id it had in the old blog, so posts can
+point at users imported the same way. Records are checked with the same rules
+as the form routes. Ones that fail, lines that aren't UTF-8 and CSV rows that
+don't parse included, are skipped and reported by line number.
+The rest are written CHUNK at a time, each chunk as a few batched multi-row
+INSERTs in one transaction. Tags named on posts are looked up by name, and created if
+missing, once per chunk. The input is read as it goes, so memory use depends
+on the chunk size, not the file size. An import that wrote anything moves every
+page's ETag on (the "*" page version), from the CLI as from the /import route.
+"""
+
+import argparse
+import csv
+import datetime
+import io
+import itertools
+import json
+import sys
+
+from sqlalchemy import func
+
+import catalog
+from generate import chunks, reset_sequences
+from models import db, User, Post, Tag, PostTag, PageVersion
+
+# records per transaction
+CHUNK = 1000
+# per-row errors kept for the report; later ones are only counted
+MAX_REPORTED_ERRORS = 100
+
+KINDS = ("users", "posts", "tags")
+
+
+class RowError(ValueError):
+    """A record that can't be imported."""
+
+
+class Report:
+    """What an import did: rows written and the rows it had to skip."""
+
+    def __init__(self):
+        self.inserted = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def as_dict(self):
+        return {"inserted": self.inserted, "error_count": self.error_count, "errors": self.errors}
+
+
+################### READING ############################
+
+def utf8(text):
+    """Whether text came from valid UTF-8: import_stream decodes with surrogateescape, leaving bad bytes as surrogates."""
+
+    try:
+        text.encode("utf-8")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def read_jsonl(stream):
+    """(line number, record or RowError) for each non-blank line."""
+
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        if not utf8(line):
+            yield number, RowError("not valid UTF-8")
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as err:
+            yield number, RowError(f"invalid JSON: {err}")
+            continue
+        yield number, record if isinstance(record, dict) else RowError("expected a JSON object")
+
+
+def read_csv(stream):
+    """(line number, record or RowError) for each CSV row after the header."""
+
+    reader = csv.DictReader(stream)
+    while True:
+        try:
+            record = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as err:
+            # the reader has moved past the bad row and carries on from the next; DictReader's
+            # own line_num is only updated for rows it returns
+            yield reader.reader.line_num, RowError(f"invalid CSV: {err}")
+            continue
+        # fields past the header's are listed under None
+        values = [v for value in record.values() for v in (value if isinstance(value, list) else [value])]
+        if not all(utf8(value) for value in values if value):
+            yield reader.line_num, RowError("not valid UTF-8")
+            continue
+        if "tags" in record:
+            record["tags"] = [name for name in (record["tags"] or "").split("|") if name]
+        yield reader.line_num, record
+
+
+def read_records(stream, format):
+    if format == "jsonl":
+        return read_jsonl(stream)
+    if format == "csv":
+        return read_csv(stream)
+    raise ValueError("format must be jsonl or csv")
+
+
+def format_for(filename, default="jsonl"):
+    """Guess the format from a file name."""
+
+    if filename and filename.lower().endswith(".csv"):
+        return "csv"
+    return default
+
+
+################### VALIDATION ############################
+
+def text(record, field, required=True):
+    value = record.get(field)
+    if value is None:
+        value = ""
+    if not isinstance(value, str):
+        raise RowError(f"{field} must be text")
+    # JSON can spell out what the database can't store: a lone surrogate, a NUL
+    if not utf8(value) or "\x00" in value:
+        raise RowError(f"{field} must be valid UTF-8 text")
+    value = value.strip()
+    if required and not value:
+        raise RowError(f"{field} is required")
+    return value
+
+
+def integer(record, field, required=True):
+    value = record.get(field)
+    if value in (None, ""):
+        if required:
+            raise RowError(f"{field} is required")
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise RowError(f"{field} must be an integer")
+
+
+def with_id(record, row):
+    row_id = integer(record, "id", required=False)
+    if row_id is not None:
+        row["id"] = row_id
+    return row
+
+
+def clean_user(record):
+    """Users need a first and last name, like add_user; img_url defaults to the stock avatar."""
+
+    return with_id(record, {
+        "first_name": text(record, "first_name"),
+        "last_name": text(record, "last_name"),
+        "img_url": text(record, "img_url", required=False) or User.url,
+    })
+
+
+def clean_post(record):
+    """Posts need a title, content and an author, like add_post."""
+
+    created_at = text(record, "created_at", required=False)
+    try:
+        created_at = datetime.datetime.fromisoformat(created_at) if created_at else datetime.datetime.now()
+    except ValueError:
+        raise RowError("created_at must be an ISO date and time")
+    tags = record.get("tags") or []
+    if not isinstance(tags, list) or not all(isinstance(name, str) and utf8(name) and "\x00" not in name
+                                             for name in tags):
+        raise RowError("tags must be a list of names")
+
+    row = with_id(record, {
+        "title": text(record, "title"),
+        "content": text(record, "content"),
+        "created_at": created_at,
+        "user_id": integer(record, "user_id"),
+    })
+    # tag names ride along to the post_tags step; they're not a posts column
+    row["tags"] = sorted({name.strip() for name in tags if name.strip()})
+    return row
+
+
+def clean_tag(record):
+    """Tags need a name, like add_tag."""
+
+    return with_id(record, {"name": text(record, "name")})
+
+
+################### WRITING ############################
+
+def insert_rows(table, rows):
+    """Insert rows with executemany, once per distinct set of columns (rows with and without ids).
+
+    psycopg2 turns an executemany into multi-row INSERT ... VALUES pages, and
+    the statement is compiled once rather than once per chunk.
+    """
+
+    def columns(row):
+        return tuple(sorted(row))
+
+    for _, group in itertools.groupby(sorted(rows, key=columns), key=columns):
+        db.session.execute(table.insert(), list(group))
+
+
+def insert_returning_ids(table, rows):
+    """Insert rows in order and return their ids."""
+
+    if db.engine.dialect.insert_executemany_returning:
+        # multi-row VALUES pages with RETURNING, ids coming back in VALUES order
+        result = db.session.execute(table.insert().returning(table.c.id), rows)
+        return [row_id for (row_id,) in result]
+    # no executemany RETURNING here (SQLite): one INSERT per row
+    return [db.session.execute(table.insert(), row).inserted_primary_key[0] for row in rows]
+
+
+def existing_ids(column, ids):
+    ids = set(ids)
+    if not ids:
+        return set()
+    return {row_id for (row_id,) in db.session.query(column).filter(column.in_(ids))}
+
+
+def drop_taken_ids(model, batch, report):
+    """Skip records whose explicit id is already in use (or used twice in the batch).
+
+    An import running at the same time can still take an id after this looks;
+    the chunk writing it second then fails on the primary key (for a
+    partitioned posts table, on migration 0009's id trigger).
+    """
+
+    taken = existing_ids(model.id, [row["id"] for _, row in batch if "id" in row])
+    kept = []
+    for line, row in batch:
+        if "id" in row:
+            if row["id"] in taken:
+                report.error(line, f"id {row['id']} already exists")
+                continue
+            taken.add(row["id"])
+        kept.append((line, row))
+    return kept
+
+
+def resolve_tags(names, tag_ids):
+    """Fill tag_ids (name -> id) for names, creating the tags that don't exist yet.
+
+    Returns True if any tag was created.
+    """
+
+    missing = set(names) - set(tag_ids)
+    if not missing:
+        return False
+
+    def look_up():
+        query = db.session.query(Tag.name, func.min(Tag.id)).filter(Tag.name.in_(missing)).group_by(Tag.name)
+        tag_ids.update(query)
+
+    look_up()
+    missing -= set(tag_ids)
+    if missing:
+        insert_rows(Tag.__table__, [{"name": name} for name in sorted(missing)])
+        look_up()
+    return bool(missing)
+
+
+def write_users(batch, report, tag_ids):
+    batch = drop_taken_ids(User, batch, report)
+    insert_rows(User.__table__, [row for _, row in batch])
+    return len(batch)
+
+
+def write_tags(batch, report, tag_ids):
+    batch = drop_taken_ids(Tag, batch, report)
+    insert_rows(Tag.__table__, [row for _, row in batch])
+    if batch:
+        catalog.bump(db.session)
+    return len(batch)
+
+
+def write_posts(batch, report, tag_ids):
+    authors = existing_ids(User.id, [row["user_id"] for _, row in batch])
+    kept = []
+    for line, row in batch:
+        if row["user_id"] not in authors:
+            report.error(line, f"user {row['user_id']} does not exist")
+        else:
+            kept.append((line, row))
+    batch = drop_taken_ids(Post, kept, report)
+    if not batch:
+        return 0
+
+    if resolve_tags({name for _, row in batch for name in row["tags"]}, tag_ids):
+        catalog.bump(db.session)
+
+    pairs = [(row, row.pop("tags")) for _, row in batch]
+    known = [(row, names) for row, names in pairs if "id" in row]
+    new = [(row, names) for row, names in pairs if "id" not in row]
+    insert_rows(Post.__table__, [row for row, _ in known])
+    post_ids = [row["id"] for row, _ in known]
+    if new:
+        post_ids += insert_returning_ids(Post.__table__, [row for row, _ in new])
+
+    post_tags = [{"post_id": post_id, "tag_id": tag_ids[name]}
+                 for post_id, (_, names) in zip(post_ids, known + new) for name in names]
+    if post_tags:
+        db.session.execute(PostTag.__table__.insert(), post_tags)
+    return len(batch)
+
+
+CLEANERS = {"users": clean_user, "posts": clean_post, "tags": clean_tag}
+WRITERS = {"users": write_users, "posts": write_posts, "tags": write_tags}
+
+
+def import_records(kind, records, chunk=CHUNK):
+    """Validate and write (line number, record) pairs of one kind; return a Report."""
+
+    clean, write = CLEANERS[kind], WRITERS[kind]
+    report = Report()
+    # tag name -> id, kept across chunks; there are few tags
+    tag_ids = {}
+    explicit_ids = False
+
+    for records_chunk in chunks(records, chunk):
+        batch = []
+        for line, record in records_chunk:
+            try:
+                if isinstance(record, RowError):
+                    raise record
+                batch.append((line, clean(record)))
+            except RowError as err:
+                report.error(line, str(err))
+        if not batch:
+            continue
+        explicit_ids = explicit_ids or any("id" in row for _, row in batch)
+        try:
+            report.inserted += write(batch, report, tag_ids)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    # rows imported with their old ids leave the id sequences behind
+    if explicit_ids and db.engine.dialect.name == "postgresql":
+        with db.engine.begin() as conn:
+            reset_sequences(conn)
+    return report
+
+
+def import_stream(kind, stream, format, chunk=CHUNK):
+    """Import from a binary stream (an upload, a file opened "rb", stdin)."""
+
+    # bytes that aren't UTF-8 fail their own row (see utf8), not the whole import
+    text_stream = io.TextIOWrapper(stream, encoding="utf-8-sig", errors="surrogateescape", newline="")
+    try:
+        return import_records(kind, read_records(text_stream, format), chunk)
+    finally:
+        # leave the underlying stream for its owner to close
+        text_stream.detach()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db", default="postgresql:///unit23_db", help="database to import into")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="default: from the file name, else jsonl")
+    parser.add_argument("--chunk", type=int, default=CHUNK, help="records per transaction")
+    parser.add_argument("kind", choices=KINDS)
+    parser.add_argument("file", help="file to import, or - for stdin")
+    args = parser.parse_args(argv)
+
+    from app import app
+    app.config["SQLALCHEMY_DATABASE_URI"] = args.db
+    format = args.format or format_for(args.file)
+
+    with app.app_context():
+        if args.file == "-":
+            report = import_stream(args.kind, sys.stdin.buffer, format, args.chunk)
+        else:
+            with open(args.file, "rb") as f:
+                report = import_stream(args.kind, f, format, args.chunk)
+        if report.inserted:
+            # running app processes stop answering 304 for pages rendered before the import
+            db.session.execute(PageVersion.bump(db.engine.dialect.name), [{"key": PageVersion.ALL}])
+            db.session.commit()
+
+    for error in report.errors:
+        print(f"line {error['line']}: {error['error']}", file=sys.stderr)
+    if report.error_count > len(report.errors):
+        print(f"... and {report.error_count - len(report.errors)} more errors", file=sys.stderr)
+    print(f"imported {report.inserted} {args.kind}, skipped {report.error_count}")
+    if report.error_count:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
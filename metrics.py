@@ -0,0 +1,197 @@
+"""Per-request SQL/template instrumentation exposed in Prometheus text format.
+
+For every request this records, per route: how many queries ran, the time spent
+in the database, rows fetched, time spent rendering templates and the total
+response time. Values go into fixed-bucket histograms (a bisect and a few adds
+per observation) and are served from /metrics. Queries slower than
+SLOW_QUERY_SECONDS are logged to the "blogly.sql" logger.
+
+The numbers are per process; with several workers, scrape each one.
+"""
+
+import bisect
+import logging
+import threading
+import time
+
+from flask import Response, g, has_request_context, request
+from flask import signals
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("blogly.sql")
+
+# histogram buckets: seconds for timings, plain counts for queries and rows
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250, 1000, 10000)
+
+
+class Histogram:
+    """Prometheus-style histogram keyed by a tuple of label values."""
+
+    def __init__(self, name, help, buckets, labels):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.labels = labels
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                # one count per bucket plus +Inf, then the sum
+                series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = sorted((k, list(v)) for k, v in self.series.items())
+        for label_values, series in items:
+            labels = format_labels(self.labels, label_values)
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                total += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{{{labels},{le}}} {total}")
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-1]}")
+            lines.append(f"{self.name}_count{{{labels}}} {total}")
+        return lines
+
+
+class Counter:
+    """Prometheus-style counter keyed by a tuple of label values."""
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, label_values, amount=1):
+        with self.lock:
+            self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = sorted(self.series.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{{{format_labels(self.labels, label_values)}}} {value}")
+        return lines
+
+
+def format_labels(names, values):
+    """Render label pairs, escaping the characters Prometheus cares about."""
+
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+
+
+class Metrics:
+    """Flask extension that instruments the engine and request lifecycle."""
+
+    def __init__(self, app=None):
+        route = ("method", "route")
+        self.requests = Counter("blogly_requests_total", "Requests handled.", route + ("status",))
+        self.response_time = Histogram("blogly_request_seconds", "Response time.", TIME_BUCKETS, route)
+        self.db_time = Histogram("blogly_request_db_seconds", "Time spent in SQL per request.", TIME_BUCKETS, route)
+        self.template_time = Histogram("blogly_request_template_seconds", "Time spent rendering templates per request.",
+                                       TIME_BUCKETS, route)
+        self.queries = Histogram("blogly_request_queries", "SQL statements per request.", COUNT_BUCKETS, route)
+        self.rows = Histogram("blogly_request_rows", "Rows fetched per request.", COUNT_BUCKETS, route)
+        self.slow_queries = Counter("blogly_slow_queries_total", "Queries slower than SLOW_QUERY_SECONDS.", route)
+        self.collectors = [self.requests, self.response_time, self.db_time, self.template_time,
+                           self.queries, self.rows, self.slow_queries]
+        self.slow_query_seconds = 0.25
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("SLOW_QUERY_SECONDS", 0.25)
+        self.slow_query_seconds = app.config["SLOW_QUERY_SECONDS"]
+
+        # listen on the Engine class so every engine the app creates is covered
+        if not event.contains(Engine, "before_cursor_execute", self.before_cursor_execute):
+            event.listen(Engine, "before_cursor_execute", self.before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", self.after_cursor_execute)
+
+        signals.before_render_template.connect(self.before_render, app, weak=False)
+        signals.template_rendered.connect(self.after_render, app, weak=False)
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        app.add_url_rule("/metrics", "metrics", self.render)
+        app.extensions["metrics"] = self
+
+    # ---- engine hooks
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._metrics_start = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._metrics_start
+        if elapsed > self.slow_query_seconds:
+            logger.warning("slow query (%.3fs): %s", elapsed, statement)
+            self.slow_queries.inc(route_labels() if has_request_context() else ("", ""))
+
+        if not has_request_context() or "metrics_start" not in g:
+            return
+        g.metrics_queries += 1
+        g.metrics_db_time += elapsed
+        # rowcount is the number of rows a SELECT returned on a client-side cursor
+        if cursor.description is not None and cursor.rowcount > 0:
+            g.metrics_rows += cursor.rowcount
+
+    # ---- template hooks
+
+    def before_render(self, sender, template, context, **extra):
+        if "metrics_start" in g:
+            g.metrics_render_start = time.perf_counter()
+
+    def after_render(self, sender, template, context, **extra):
+        if "metrics_render_start" in g:
+            g.metrics_template_time += time.perf_counter() - g.pop("metrics_render_start")
+
+    # ---- request hooks
+
+    def start_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_db_time = 0.0
+        g.metrics_rows = 0
+        g.metrics_template_time = 0.0
+
+    def finish_request(self, response):
+        if "metrics_start" not in g or request.endpoint == "metrics":
+            return response
+
+        labels = route_labels()
+        self.requests.inc(labels + (str(response.status_code),))
+        self.response_time.observe(labels, time.perf_counter() - g.metrics_start)
+        self.db_time.observe(labels, g.metrics_db_time)
+        self.template_time.observe(labels, g.metrics_template_time)
+        self.queries.observe(labels, g.metrics_queries)
+        self.rows.observe(labels, g.metrics_rows)
+        return response
+
+    def render(self):
+        """Serve every metric in Prometheus text exposition format."""
+
+        lines = []
+        for collector in self.collectors:
+            lines.extend(collector.render())
+        return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
+def route_labels():
+    """(method, route pattern) for the current request; unmatched urls share one label."""
+
+    rule = request.url_rule.rule if request.url_rule else "<unmatched>"
+    return (request.method, rule)
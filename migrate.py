@@ -0,0 +1,145 @@
+"""Versioned schema migrations for the Blogly database.
+
+    python migrate.py status              # applied and pending migrations
+    python migrate.py upgrade             # apply everything pending
+    python migrate.py upgrade --to 2      # stop after migration 0002
+
+Migrations live in migrations/NNNN_description.py, applied in number order and
+recorded in the schema_version table. Each one has a STATEMENTS list of SQL to
+run (or an upgrade(conn) function for anything fancier) and runs in its own
+transaction unless it sets TRANSACTIONAL = False (e.g. CREATE INDEX CONCURRENTLY).
+
+The statements are PostgreSQL SQL, like the production database. Throwaway
+SQLite files (generate.py, local stand-ins) are built with db.create_all().
+
+Whenever models.py changes the schema, add a migration that makes the same change.
+"""
+
+import argparse
+import importlib.util
+import os
+import re
+import sys
+
+from sqlalchemy import create_engine, text
+
+from models import db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+VERSION_TABLE = """CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now()
+)"""
+
+
+class Migration:
+    """One migrations/NNNN_description.py file."""
+
+    def __init__(self, path):
+        match = re.match(r"(\d+)_(\w+)\.py$", os.path.basename(path))
+        self.version = int(match.group(1))
+        self.name = match.group(2)
+        spec = importlib.util.spec_from_file_location(f"migrations.m{self.version:04d}", path)
+        self.module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(self.module)
+        self.transactional = getattr(self.module, "TRANSACTIONAL", True)
+
+    def upgrade(self, conn):
+        if hasattr(self.module, "upgrade"):
+            self.module.upgrade(conn)
+        else:
+            for statement in self.module.STATEMENTS:
+                conn.execute(text(statement))
+
+    def __repr__(self):
+        return f"<Migration {self.version:04d} {self.name}>"
+
+
+def load_migrations():
+    """Every migration file, in version order."""
+
+    paths = [os.path.join(MIGRATIONS_DIR, f) for f in os.listdir(MIGRATIONS_DIR) if re.match(r"\d+_\w+\.py$", f)]
+    migrations = sorted((Migration(path) for path in paths), key=lambda m: m.version)
+    versions = [m.version for m in migrations]
+    if len(set(versions)) != len(versions):
+        raise RuntimeError(f"duplicate migration numbers in {MIGRATIONS_DIR}")
+    return migrations
+
+
+def applied_versions(engine):
+    with engine.begin() as conn:
+        conn.execute(text(VERSION_TABLE))
+        return {version for (version,) in conn.execute(text("SELECT version FROM schema_version"))}
+
+
+def check_dialect(engine):
+    if engine.dialect.name != "postgresql":
+        raise RuntimeError("migrations are PostgreSQL SQL; build other databases with db.create_all()")
+
+
+def upgrade(engine, target=None, out=sys.stdout):
+    """Apply pending migrations up to target (default: all); return the ones applied."""
+
+    check_dialect(engine)
+    done = applied_versions(engine)
+    applied = []
+    for migration in load_migrations():
+        if migration.version in done or (target is not None and migration.version > target):
+            continue
+        print(f"applying {migration.version:04d} {migration.name}", file=out)
+        record = text("INSERT INTO schema_version (version, name) VALUES (:version, :name)")
+        params = {"version": migration.version, "name": migration.name}
+        if migration.transactional:
+            with engine.begin() as conn:
+                migration.upgrade(conn)
+                conn.execute(record, params)
+        else:
+            with engine.connect() as conn:
+                conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+                migration.upgrade(conn)
+                conn.execute(record, params)
+        applied.append(migration)
+    return applied
+
+
+def status(engine, out=sys.stdout):
+    check_dialect(engine)
+    done = applied_versions(engine)
+    for migration in load_migrations():
+        state = "applied" if migration.version in done else "pending"
+        print(f"{migration.version:04d} {migration.name:<40} {state}", file=out)
+
+
+def reset(engine, out=sys.stdout):
+    """Drop every table and rebuild the schema from the migrations (for seed.py)."""
+
+    check_dialect(engine)
+    db.metadata.drop_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS schema_version"))
+    return upgrade(engine, out=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db", default="postgresql:///unit23_db", help="database url")
+    commands = parser.add_subparsers(dest="command", required=True)
+    up = commands.add_parser("upgrade", help="apply pending migrations")
+    up.add_argument("--to", type=int, default=None, help="last migration number to apply")
+    commands.add_parser("status", help="list applied and pending migrations")
+    args = parser.parse_args(argv)
+
+    engine = create_engine(args.db)
+    if args.command == "upgrade":
+        applied = upgrade(engine, args.to)
+        if not applied:
+            print("already up to date")
+    else:
+        status(engine)
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
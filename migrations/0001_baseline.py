@@ -0,0 +1,29 @@
+"""Baseline: the tables as db.create_all() created them before migrations existed.
+
+Uses IF NOT EXISTS so databases created the old way can simply be upgraded.
+"""
+
+STATEMENTS = [
+    """CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        first_name TEXT NOT NULL,
+        last_name TEXT NOT NULL,
+        img_url TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS posts (
+        id SERIAL PRIMARY KEY,
+        title TEXT NOT NULL,
+        content TEXT NOT NULL,
+        created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        user_id INTEGER NOT NULL REFERENCES users (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS tags (
+        id SERIAL PRIMARY KEY,
+        name TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS post_tags (
+        post_id INTEGER NOT NULL REFERENCES posts (id),
+        tag_id INTEGER NOT NULL REFERENCES tags (id),
+        PRIMARY KEY (post_id, tag_id)
+    )""",
+]
@@ -0,0 +1,12 @@
+"""ON DELETE CASCADE on posts.user_id and both post_tags foreign keys."""
+
+STATEMENTS = [
+    """ALTER TABLE posts
+        DROP CONSTRAINT IF EXISTS posts_user_id_fkey,
+        ADD CONSTRAINT posts_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE""",
+    """ALTER TABLE post_tags
+        DROP CONSTRAINT IF EXISTS post_tags_post_id_fkey,
+        ADD CONSTRAINT post_tags_post_id_fkey FOREIGN KEY (post_id) REFERENCES posts (id) ON DELETE CASCADE,
+        DROP CONSTRAINT IF EXISTS post_tags_tag_id_fkey,
+        ADD CONSTRAINT post_tags_tag_id_fkey FOREIGN KEY (tag_id) REFERENCES tags (id) ON DELETE CASCADE""",
+]
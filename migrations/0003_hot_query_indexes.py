@@ -0,0 +1,19 @@
+"""Indexes for the hot queries (see the __table_args__ in models.py).
+
+Built CONCURRENTLY so a live table isn't locked against writes while they build,
+which can't happen inside a transaction.
+"""
+
+TRANSACTIONAL = False
+
+STATEMENTS = [
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_posts_created_at_id ON posts (created_at, id)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_posts_user_id_created_at_id ON posts (user_id, created_at, id)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_last_name_first_name_id ON users (last_name DESC, first_name, id)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tags_name_id ON tags (name, id)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_post_tags_tag_id_post_id ON post_tags (tag_id, post_id)",
+    "ANALYZE users",
+    "ANALYZE posts",
+    "ANALYZE tags",
+    "ANALYZE post_tags",
+]
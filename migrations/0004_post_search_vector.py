@@ -0,0 +1,14 @@
+"""Stored tsvector over post title and content, and the GIN index full-text search uses (see search.py).
+
+Adding a stored generated column rewrites the posts table under an exclusive
+lock; run it in a quiet period. The index is then built CONCURRENTLY.
+"""
+
+TRANSACTIONAL = False
+
+STATEMENTS = [
+    "ALTER TABLE posts ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS "
+    "(setweight(to_tsvector('english', title), 'A') || setweight(to_tsvector('english', content), 'B')) STORED",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_posts_search ON posts USING gin (search_vector)",
+    "ANALYZE posts",
+]
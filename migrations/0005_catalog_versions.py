@@ -0,0 +1,9 @@
+"""Change counters for the catalogs each process caches, starting with tags (see catalog.py)."""
+
+STATEMENTS = [
+    """CREATE TABLE IF NOT EXISTS catalog_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    )""",
+    "INSERT INTO catalog_versions (name, version) VALUES ('tags', 0) ON CONFLICT (name) DO NOTHING",
+]
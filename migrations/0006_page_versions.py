@@ -0,0 +1,10 @@
+"""Change counters for rendered pages, the ETag/Last-Modified validators of the cached read routes (see cache.py)."""
+
+STATEMENTS = [
+    """CREATE TABLE IF NOT EXISTS page_versions (
+        key TEXT PRIMARY KEY,
+        version INTEGER NOT NULL,
+        changed_at TIMESTAMP WITH TIME ZONE NOT NULL
+    )""",
+    "INSERT INTO page_versions (key, version, changed_at) VALUES ('*', 0, CURRENT_TIMESTAMP) ON CONFLICT (key) DO NOTHING",
+]
@@ -0,0 +1,70 @@
+"""users.post_count and tags.post_count, and the triggers on posts and post_tags that keep them (see models.py).
+
+Adding a NOT NULL column with a constant default is a catalog change, no table
+rewrite. The backfill then counts every user's and tag's posts under the
+migration's transaction, with posts and post_tags locked against writes so no
+insert lands between the count and the triggers; counters.py does the same later.
+"""
+
+STATEMENTS = [
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS post_count INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE tags ADD COLUMN IF NOT EXISTS post_count INTEGER NOT NULL DEFAULT 0",
+    "LOCK TABLE posts, post_tags IN SHARE MODE",
+    """CREATE OR REPLACE FUNCTION count_users_posts() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM 1 FROM users WHERE id IN (SELECT user_id FROM (SELECT user_id, count(*) AS n FROM new_rows GROUP BY user_id) AS changed) ORDER BY id FOR NO KEY UPDATE;
+        UPDATE users SET post_count = users.post_count + changed.n
+        FROM (SELECT user_id, count(*) AS n FROM new_rows GROUP BY user_id) AS changed WHERE users.id = changed.user_id;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM 1 FROM users WHERE id IN (SELECT user_id FROM (SELECT user_id, -count(*) AS n FROM old_rows GROUP BY user_id) AS changed) ORDER BY id FOR NO KEY UPDATE;
+        UPDATE users SET post_count = users.post_count + changed.n
+        FROM (SELECT user_id, -count(*) AS n FROM old_rows GROUP BY user_id) AS changed WHERE users.id = changed.user_id;
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM 1 FROM users WHERE id IN (SELECT user_id FROM (SELECT user_id, sum(n) AS n FROM (SELECT user_id, 1 AS n FROM new_rows UNION ALL SELECT user_id, -1 FROM old_rows) AS moved GROUP BY user_id HAVING sum(n) <> 0) AS changed) ORDER BY id FOR NO KEY UPDATE;
+        UPDATE users SET post_count = users.post_count + changed.n
+        FROM (SELECT user_id, sum(n) AS n FROM (SELECT user_id, 1 AS n FROM new_rows UNION ALL SELECT user_id, -1 FROM old_rows) AS moved GROUP BY user_id HAVING sum(n) <> 0) AS changed WHERE users.id = changed.user_id;
+    END IF;
+    RETURN NULL;
+END
+$$""",
+    "DROP TRIGGER IF EXISTS posts_count_users_insert ON posts",
+    """CREATE TRIGGER posts_count_users_insert AFTER INSERT ON posts
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION count_users_posts()""",
+    "DROP TRIGGER IF EXISTS posts_count_users_delete ON posts",
+    """CREATE TRIGGER posts_count_users_delete AFTER DELETE ON posts
+REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION count_users_posts()""",
+    "DROP TRIGGER IF EXISTS posts_count_users_update ON posts",
+    """CREATE TRIGGER posts_count_users_update AFTER UPDATE ON posts
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION count_users_posts()""",
+    """CREATE OR REPLACE FUNCTION count_tags_posts() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM 1 FROM tags WHERE id IN (SELECT tag_id FROM (SELECT tag_id, count(*) AS n FROM new_rows GROUP BY tag_id) AS changed) ORDER BY id FOR NO KEY UPDATE;
+        UPDATE tags SET post_count = tags.post_count + changed.n
+        FROM (SELECT tag_id, count(*) AS n FROM new_rows GROUP BY tag_id) AS changed WHERE tags.id = changed.tag_id;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM 1 FROM tags WHERE id IN (SELECT tag_id FROM (SELECT tag_id, -count(*) AS n FROM old_rows GROUP BY tag_id) AS changed) ORDER BY id FOR NO KEY UPDATE;
+        UPDATE tags SET post_count = tags.post_count + changed.n
+        FROM (SELECT tag_id, -count(*) AS n FROM old_rows GROUP BY tag_id) AS changed WHERE tags.id = changed.tag_id;
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM 1 FROM tags WHERE id IN (SELECT tag_id FROM (SELECT tag_id, sum(n) AS n FROM (SELECT tag_id, 1 AS n FROM new_rows UNION ALL SELECT tag_id, -1 FROM old_rows) AS moved GROUP BY tag_id HAVING sum(n) <> 0) AS changed) ORDER BY id FOR NO KEY UPDATE;
+        UPDATE tags SET post_count = tags.post_count + changed.n
+        FROM (SELECT tag_id, sum(n) AS n FROM (SELECT tag_id, 1 AS n FROM new_rows UNION ALL SELECT tag_id, -1 FROM old_rows) AS moved GROUP BY tag_id HAVING sum(n) <> 0) AS changed WHERE tags.id = changed.tag_id;
+    END IF;
+    RETURN NULL;
+END
+$$""",
+    "DROP TRIGGER IF EXISTS post_tags_count_tags_insert ON post_tags",
+    """CREATE TRIGGER post_tags_count_tags_insert AFTER INSERT ON post_tags
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION count_tags_posts()""",
+    "DROP TRIGGER IF EXISTS post_tags_count_tags_delete ON post_tags",
+    """CREATE TRIGGER post_tags_count_tags_delete AFTER DELETE ON post_tags
+REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION count_tags_posts()""",
+    "DROP TRIGGER IF EXISTS post_tags_count_tags_update ON post_tags",
+    """CREATE TRIGGER post_tags_count_tags_update AFTER UPDATE ON post_tags
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION count_tags_posts()""",
+    "UPDATE users SET post_count = (SELECT count(*) FROM posts WHERE posts.user_id = users.id)",
+    "UPDATE tags SET post_count = (SELECT count(*) FROM post_tags WHERE post_tags.tag_id = tags.id)",
+    "CREATE INDEX IF NOT EXISTS ix_tags_post_count_id ON tags (post_count DESC, id)",
+]
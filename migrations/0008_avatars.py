@@ -0,0 +1,12 @@
+"""Local avatar store (see avatars.py): the URLs already fetched, and each user's stored image."""
+
+STATEMENTS = [
+    """CREATE TABLE IF NOT EXISTS avatars (
+        url TEXT PRIMARY KEY,
+        hash TEXT NOT NULL,
+        etag TEXT,
+        last_modified TEXT,
+        fetched_at TIMESTAMP WITH TIME ZONE NOT NULL
+    )""",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS avatar_hash TEXT",
+]
@@ -0,0 +1,162 @@
+"""Partition posts by month of created_at (see partitions.py), and replace post_tags' foreign key to it with triggers.
+
+The table is rebuilt under an exclusive lock: the old one is renamed, a
+partitioned one made LIKE it, every row copied over and the old one dropped,
+so run it in a quiet period. There is a partition for each month from the
+oldest post's to three months ahead, posts_earlier below that and posts_later
+above, so no created_at is ever refused; partitions.py maintain keeps months
+ahead of time and archive moves cold ones to compressed storage.
+
+A primary key on a partitioned table has to include the partition key, so it
+becomes (id, created_at); ids still come from the one sequence, and a trigger
+refuses an id already taken (an import keeping old ids, say) with the error the
+old key raised. A foreign key can only point at such a key whole, so post_tags
+loses its one to posts, and triggers check the reference and cascade deletes
+instead, as the key did. Only this migration makes the swap: create_all() builds
+posts whole, with the plain key and post_tags' foreign key. The posts triggers
+that count users' posts are recreated on the new table. A database already
+partitioned only gets the triggers.
+
+The triggers fire once per statement, locking the ids involved first so two
+transactions can't both get past the check. A post looked up by id alone
+probes every partition, so each costs one index probe per partition for each
+post a statement names.
+"""
+
+import datetime
+
+from sqlalchemy import text
+
+MONTHS_AHEAD = 3
+
+CONVERT = [
+    "ALTER TABLE post_tags DROP CONSTRAINT IF EXISTS post_tags_post_id_fkey",
+    "ALTER TABLE posts RENAME TO posts_unpartitioned",
+    # free the names the new table's key, foreign key and indexes take
+    "ALTER TABLE posts_unpartitioned DROP CONSTRAINT posts_pkey, DROP CONSTRAINT IF EXISTS posts_user_id_fkey",
+    "DROP INDEX IF EXISTS ix_posts_created_at_id, ix_posts_user_id_created_at_id, ix_posts_search",
+    """CREATE TABLE posts (
+        LIKE posts_unpartitioned INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE INCLUDING COMPRESSION,
+        PRIMARY KEY (id, created_at),
+        CONSTRAINT posts_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+    ) PARTITION BY RANGE (created_at)""",
+]
+
+COPY = [
+    "INSERT INTO posts (id, title, content, created_at, user_id) "
+    "SELECT id, title, content, created_at, user_id FROM posts_unpartitioned",
+    "DROP TABLE posts_unpartitioned",
+    "CREATE INDEX ix_posts_created_at_id ON posts (created_at, id)",
+    "CREATE INDEX ix_posts_user_id_created_at_id ON posts (user_id, created_at, id)",
+    "CREATE INDEX ix_posts_search ON posts USING gin (search_vector)",
+    """CREATE TRIGGER posts_count_users_insert AFTER INSERT ON posts
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION count_users_posts()""",
+    """CREATE TRIGGER posts_count_users_delete AFTER DELETE ON posts
+REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION count_users_posts()""",
+    """CREATE TRIGGER posts_count_users_update AFTER UPDATE ON posts
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION count_users_posts()""",
+]
+
+REFERENCES = [
+    """CREATE OR REPLACE FUNCTION delete_posts_post_tags() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    DELETE FROM post_tags WHERE post_id IN (SELECT id FROM old_rows);
+    RETURN NULL;
+END
+$$""",
+    """CREATE OR REPLACE FUNCTION check_post_tags_posts() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    missing integer;
+BEGIN
+    PERFORM 1 FROM posts WHERE id IN (SELECT post_id FROM new_rows) ORDER BY id FOR KEY SHARE;
+    SELECT post_id INTO missing FROM new_rows
+    WHERE NOT EXISTS (SELECT 1 FROM posts WHERE posts.id = new_rows.post_id) LIMIT 1;
+    IF FOUND THEN
+        RAISE foreign_key_violation USING MESSAGE =
+            'insert or update on table "post_tags" violates its reference to "posts": post ' || missing || ' does not exist';
+    END IF;
+    RETURN NULL;
+END
+$$""",
+    # held to the end of the transaction, so of two adding the same id the second sees the first's row
+    """CREATE OR REPLACE FUNCTION check_posts_unique_ids() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    taken integer;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('posts.id'), id) FROM (SELECT DISTINCT id FROM new_rows ORDER BY id) AS ids;
+    SELECT posts.id INTO taken FROM posts JOIN new_rows USING (id) GROUP BY posts.id HAVING count(*) > 1 LIMIT 1;
+    IF FOUND THEN
+        RAISE unique_violation USING MESSAGE =
+            'duplicate key value violates unique constraint "posts_pkey": post ' || taken || ' already exists';
+    END IF;
+    RETURN NULL;
+END
+$$""",
+    # edits leave ids alone; a transition table can't go with a column list, so this one's per row
+    """CREATE OR REPLACE FUNCTION check_posts_unique_id() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('posts.id'), NEW.id);
+    IF (SELECT count(*) FROM posts WHERE id = NEW.id) > 1 THEN
+        RAISE unique_violation USING MESSAGE =
+            'duplicate key value violates unique constraint "posts_pkey": post ' || NEW.id || ' already exists';
+    END IF;
+    RETURN NULL;
+END
+$$""",
+    "DROP TRIGGER IF EXISTS posts_check_unique_ids_insert ON posts",
+    """CREATE TRIGGER posts_check_unique_ids_insert AFTER INSERT ON posts
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION check_posts_unique_ids()""",
+    "DROP TRIGGER IF EXISTS posts_check_unique_ids_update ON posts",
+    """CREATE TRIGGER posts_check_unique_ids_update AFTER UPDATE OF id ON posts
+FOR EACH ROW WHEN (OLD.id IS DISTINCT FROM NEW.id) EXECUTE FUNCTION check_posts_unique_id()""",
+    "DROP TRIGGER IF EXISTS posts_delete_post_tags ON posts",
+    """CREATE TRIGGER posts_delete_post_tags AFTER DELETE ON posts
+REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION delete_posts_post_tags()""",
+    "DROP TRIGGER IF EXISTS post_tags_check_posts_insert ON post_tags",
+    """CREATE TRIGGER post_tags_check_posts_insert AFTER INSERT ON post_tags
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION check_post_tags_posts()""",
+    "DROP TRIGGER IF EXISTS post_tags_check_posts_update ON post_tags",
+    """CREATE TRIGGER post_tags_check_posts_update AFTER UPDATE ON post_tags
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION check_post_tags_posts()""",
+    "ANALYZE posts",
+]
+
+
+def add_months(month, n):
+    """The first day of the month n months after month's."""
+
+    index = month.year * 12 + month.month - 1 + n
+    return datetime.datetime(index // 12, index % 12 + 1, 1)
+
+
+def upgrade(conn):
+    conn.execute(text("LOCK TABLE posts, post_tags IN ACCESS EXCLUSIVE MODE"))
+    partitioned = conn.execute(text("SELECT relkind = 'p' FROM pg_class WHERE oid = 'posts'::regclass")).scalar()
+    if not partitioned:
+        now = datetime.datetime.now()
+        oldest = min(conn.execute(text("SELECT min(created_at) FROM posts")).scalar() or now, now)
+        first = add_months(oldest, 0)
+        # partitions through MONTHS_AHEAD months after this one; posts_later starts the month after
+        count = (now.year - first.year) * 12 + now.month - first.month + MONTHS_AHEAD + 1
+        sequence = conn.execute(text("SELECT pg_get_serial_sequence('posts', 'id')")).scalar()
+
+        for statement in CONVERT:
+            conn.execute(text(statement))
+        if sequence:
+            # a sequence is dropped with the column that owns it, so hand it to the new table's
+            conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY posts.id"))
+
+        months = [add_months(first, i) for i in range(count + 1)]
+        conn.execute(text(f"CREATE TABLE posts_earlier PARTITION OF posts "
+                          f"FOR VALUES FROM (MINVALUE) TO ('{months[0]:%Y-%m-%d}')"))
+        for start, end in zip(months, months[1:]):
+            conn.execute(text(f"CREATE TABLE posts_{start:%Y_%m} PARTITION OF posts "
+                              f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"))
+        conn.execute(text(f"CREATE TABLE posts_later PARTITION OF posts "
+                          f"FOR VALUES FROM ('{months[-1]:%Y-%m-%d}') TO (MAXVALUE)"))
+
+        for statement in COPY:
+            conn.execute(text(statement))
+
+    for statement in REFERENCES:
+        conn.execute(text(statement))
@@ -1,13 +1,28 @@
 # import sqlalchemy
-from flask_sqlalchemy import SQLAlchemy
+import os
+import weakref
+from sqlalchemy import DDL, event, literal, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
 import datetime
 
+from pagination import keyset_page, PER_PAGE
+from routing import RoutingSQLAlchemy
+
+# how posts show their created_at
+FRIENDLY_DATE = "%a %b %d  %Y, %I:%M %p"
+
 # intialize a variable for our DB by running SQLAlchemy. db is standard name
-db = SQLAlchemy()
+# (its sessions send GET requests' reads to a replica when READ_REPLICAS names one)
+db = RoutingSQLAlchemy()
 
 class User(db.Model):
     """User Model"""
     __tablename__ = 'users'
+    # serves the user list's ORDER BY last_name DESC, first_name (and its keyset pages)
+    __table_args__ = (
+        db.Index('ix_users_last_name_first_name_id', db.text('last_name DESC'), 'first_name', 'id'),
+    )
 
     # default img_url for inserts / updates
     url = 'https://www.pngkey.com/png/full/115-1150152_default-profile-picture-avatar-png-green.png'
@@ -18,8 +33,14 @@ class User(db.Model):
     first_name = db.Column(db.Text, nullable=False)
     last_name = db.Column(db.Text, nullable=False) 
     img_url = db.Column(db.Text, default=url)
+    # img_url's image in the local avatar store (see avatars.py); None until it has been fetched
+    avatar_hash = db.Column(db.Text)
+    # how many posts the user has; the database keeps it current (see post_count_ddl)
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
-    posts = db.relationship('Post', backref='user', cascade='all, delete-orphan')
+    # passive_deletes: deleting a user leaves its posts (and their post_tags) to the
+    # database's ON DELETE CASCADE instead of loading and deleting them one by one
+    posts = db.relationship('Post', backref='user', cascade='all, delete-orphan', passive_deletes=True)
 
     @property
     def full_name(self):
@@ -27,9 +48,19 @@ class User(db.Model):
         return f"{self.first_name} {self.last_name}"
 
     @classmethod
-    def order_by_last_name(cls):
-        """Orders list results by last_name DESC, then first_name."""
-        return cls.query.order_by(User.last_name.desc(), User.first_name).all()
+    def bulk_delete(cls, ids):
+        """Delete users by id in one statement; the database cascades to their posts and post_tags."""
+
+        return cls.query.filter(cls.id.in_(ids)).delete(synchronize_session=False)
+
+    @classmethod
+    def order_by_last_name(cls, cursor=None, per_page=PER_PAGE, query=None):
+        """Page of users ordered by last_name DESC, then first_name (id breaks ties).
+
+        query selects what to load (User.query if not given; see readmodels.py).
+        """
+        keys = [(User.last_name, "desc"), (User.first_name, "asc"), (User.id, "asc")]
+        return keyset_page(cls.query if query is None else query, keys, cursor, per_page)
 
     def __repr__(self):
         """Show info about user"""
@@ -40,6 +71,15 @@ class User(db.Model):
 class Post(db.Model):
     """Post Model"""
     __tablename__ = 'posts'
+    # On PostgreSQL, migrations/0009_partition_posts.py splits the table into monthly
+    # partitions of created_at (see partitions.py), with (id, created_at) as its primary
+    # key and triggers keeping ids unique and post_tags' reference to it; create_all()
+    # builds it whole, with the plain key, and the model reads and writes either the same way.
+    # newest-first listings: the homepage, and a user's posts on their page
+    __table_args__ = (
+        db.Index('ix_posts_created_at_id', 'created_at', 'id'),
+        db.Index('ix_posts_user_id_created_at_id', 'user_id', 'created_at', 'id'),
+    )
 
     # define the columns of the table / nullable is True by default / default values only work if used by this model
     # if you try to add something to the db direcly using SQL the default is not there
@@ -47,15 +87,59 @@ class Post(db.Model):
     title = db.Column(db.Text, nullable=False)
     content = db.Column(db.Text, nullable=False) 
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+
+    # passive_deletes on both sides: post_tags rows go with ON DELETE CASCADE
+    tags = db.relationship('Tag', secondary='post_tags', passive_deletes=True,
+                           backref=db.backref('posts', passive_deletes=True))
+
+    @classmethod
+    def bulk_delete(cls, ids):
+        """Delete posts by id in one statement; the database cascades to their post_tags."""
 
-    tags = db.relationship('Tag', secondary='post_tags', backref='posts') 
+        return cls.query.filter(cls.id.in_(ids)).delete(synchronize_session=False)
 
     @property
     def friendly_date(self):
         """Return nicely-formatted date."""
 
-        return self.created_at.strftime("%a %b %d  %Y, %I:%M %p")
+        return self.created_at.strftime(FRIENDLY_DATE)
+
+    @classmethod
+    def newest_first(cls, query, cursor=None, per_page=PER_PAGE, stream=False):
+        """Page of posts from query ordered by created_at DESC (id breaks ties)."""
+
+        keys = [(Post.created_at, "desc"), (Post.id, "desc")]
+        return keyset_page(query, keys, cursor, per_page, stream)
+
+    # by_user, by_tag and search_titles take the query to narrow down (Post.query
+    # if not given), so readmodels.py can page through just the columns it needs
+
+    @classmethod
+    def by_user(cls, user_id, cursor=None, per_page=PER_PAGE, query=None, stream=False):
+        """Page of a user's posts, newest first."""
+
+        query = cls.query if query is None else query
+        return cls.newest_first(query.filter(Post.user_id == user_id), cursor, per_page, stream)
+
+    @classmethod
+    def by_tag(cls, tag_id, cursor=None, per_page=PER_PAGE, query=None, stream=False):
+        """Page of posts carrying a tag, newest first."""
+
+        query = cls.query if query is None else query
+        query = query.join(PostTag, PostTag.post_id == Post.id).filter(PostTag.tag_id == tag_id)
+        return cls.newest_first(query, cursor, per_page, stream)
+
+    @classmethod
+    def search_titles(cls, term=None, cursor=None, per_page=PER_PAGE, query=None):
+        """Page of posts whose title contains term (all posts if no term), newest first."""
+
+        query = cls.query if query is None else query
+        if term:
+            # escape LIKE wildcards so the term is matched literally
+            term = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            query = query.filter(Post.title.ilike(f"%{term}%", escape="\\"))
+        return cls.newest_first(query, cursor, per_page)
 
     def __repr__(self):
         """Show info about user"""
@@ -63,12 +147,36 @@ class Post(db.Model):
         p = self
         return f"<User id={p.user_id} title={p.title} created_at={p.created_at}>"
 
+# full-text search over title and content (see search.py): a stored tsvector column
+# kept up to date by PostgreSQL itself, and its GIN index. Both are PostgreSQL-only,
+# so create_all() adds them there and the model leaves the column unmapped
+POST_SEARCH_VECTOR = ("setweight(to_tsvector('english', title), 'A') || "
+                      "setweight(to_tsvector('english', content), 'B')")
+for statement in (
+    f"ALTER TABLE posts ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ({POST_SEARCH_VECTOR}) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_posts_search ON posts USING gin (search_vector)",
+):
+    event.listen(Post.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+
 class Tag(db.Model):
     """Tag Model"""
     __tablename__ = 'tags'
+    # the tag list's ORDER BY name, and ORDER BY post_count DESC when sorted by popularity
+    __table_args__ = (
+        db.Index('ix_tags_name_id', 'name', 'id'),
+        db.Index('ix_tags_post_count_id', db.text('post_count DESC'), 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.Text, nullable=False)
+    # how many posts have the tag; the database keeps it current (see post_count_ddl)
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    @classmethod
+    def bulk_delete(cls, ids):
+        """Delete tags by id in one statement; the database cascades to their post_tags."""
+
+        return cls.query.filter(cls.id.in_(ids)).delete(synchronize_session=False)
 
     @classmethod
     def get_ids(cls):
@@ -76,6 +184,20 @@ class Tag(db.Model):
 
         return cls.query.order_by(Tag.id).all()
 
+    @classmethod
+    def order_by_name(cls, cursor=None, per_page=PER_PAGE, query=None):
+        """Page of tags ordered by name (id breaks ties)."""
+
+        keys = [(Tag.name, "asc"), (Tag.id, "asc")]
+        return keyset_page(cls.query if query is None else query, keys, cursor, per_page)
+
+    @classmethod
+    def by_popularity(cls, cursor=None, per_page=PER_PAGE, query=None):
+        """Page of tags, most posts first (id breaks ties)."""
+
+        keys = [(Tag.post_count, "desc"), (Tag.id, "asc")]
+        return keyset_page(cls.query if query is None else query, keys, cursor, per_page)
+
     def __repr__(self):
         """Show info about tag"""
 
@@ -85,9 +207,65 @@ class Tag(db.Model):
 class PostTag(db.Model):
     """PostTag Model"""
     __tablename__ = 'post_tags'
+    # the primary key covers post -> tags; this covers tag -> posts
+    __table_args__ = (
+        db.Index('ix_post_tags_tag_id_post_id', 'tag_id', 'post_id'),
+    )
+
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'), primary_key=True)
+    tag_id = db.Column(db.Integer, db.ForeignKey('tags.id', ondelete='CASCADE'), primary_key=True)
+
+    # the association methods below work on rows directly: one bulk INSERT and one
+    # bulk DELETE for the difference, without loading Post.tags / Tag.posts
+
+    @classmethod
+    def set_tags_for_post(cls, post_id, tag_ids, validate=True):
+        """Make a post's tags exactly tag_ids (unknown ids are ignored); return (added, removed) tag ids.
 
-    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), primary_key=True)
-    tag_id = db.Column(db.Integer, db.ForeignKey('tags.id'), primary_key=True)
+        Pass validate=False for ids already checked against the tag catalog.
+        The rows are inserted only for tags that still exist either way: the
+        catalog can be a moment behind a tag deleted in another process.
+        """
+
+        wanted = set(tag_ids)
+        if wanted and validate:
+            wanted = {tag_id for (tag_id,) in db.session.query(Tag.id).filter(Tag.id.in_(wanted))}
+        current = {tag_id for (tag_id,) in db.session.query(cls.tag_id).filter(cls.post_id == post_id)}
+        added, removed = wanted - current, current - wanted
+
+        if removed:
+            db.session.execute(cls.__table__.delete().where(cls.post_id == post_id).where(cls.tag_id.in_(removed)))
+        if added:
+            # the key share lock holds off a delete of these tags until this transaction ends
+            existing = select(literal(post_id, db.Integer), Tag.id).where(Tag.id.in_(added)) \
+                .with_for_update(read=True, key_share=True)
+            db.session.execute(cls.__table__.insert().from_select(["post_id", "tag_id"], existing))
+        return added, removed
+
+    @classmethod
+    def change_posts_for_tag(cls, tag_id, add=(), remove=()):
+        """Tag the posts in add and untag those in remove (unknown ids are ignored); return (added, removed) post ids.
+
+        A tag can be on any number of posts, so unlike set_tags_for_post this
+        only looks at the posts named, never the tag's whole membership.
+        """
+
+        remove = set(remove)
+        add = set(add) - remove
+        if not add and not remove:
+            return set(), set()
+
+        tagged = {post_id for (post_id,) in db.session.query(cls.post_id)
+                  .filter(cls.tag_id == tag_id, cls.post_id.in_(add | remove))}
+        added, removed = set(), remove & tagged
+        if add - tagged:
+            added = {post_id for (post_id,) in db.session.query(Post.id).filter(Post.id.in_(add - tagged))}
+
+        if removed:
+            db.session.execute(cls.__table__.delete().where(cls.tag_id == tag_id).where(cls.post_id.in_(removed)))
+        if added:
+            db.session.execute(cls.__table__.insert().values([{"post_id": post_id, "tag_id": tag_id} for post_id in added]))
+        return added, removed
 
     # def __repr__(self):
     #     """Show info about post_tag"""
@@ -95,7 +273,159 @@ class PostTag(db.Model):
     #     t = self
     #     return f"<Tag name={t.name}>"
 
+# users.post_count and tags.post_count, kept by the database: triggers on posts and
+# post_tags add what each statement inserted and subtract what it deleted (an UPDATE
+# that moves a post to another user does both), in the same transaction, so every
+# path counts - the ORM, bulk statements, the importer, and ON DELETE CASCADE when a
+# user, post or tag goes. On PostgreSQL they fire once per statement and update each
+# user or tag once, however many rows it touched. The rows are locked in id order
+# first, and FOR NO KEY UPDATE like the UPDATE itself: inserting a post already
+# holds KEY SHARE on its author for the foreign key, and upgrading that to FOR
+# UPDATE would deadlock two concurrent posts by the same user. TRUNCATE fires no
+# triggers: run counters.py after one.
+POST_COUNT_CHANGES = {
+    "INSERT": "SELECT {key}, count(*) AS n FROM new_rows GROUP BY {key}",
+    "DELETE": "SELECT {key}, -count(*) AS n FROM old_rows GROUP BY {key}",
+    "UPDATE": "SELECT {key}, sum(n) AS n FROM (SELECT {key}, 1 AS n FROM new_rows "
+              "UNION ALL SELECT {key}, -1 FROM old_rows) AS moved GROUP BY {key} HAVING sum(n) <> 0",
+}
+POST_COUNT_BRANCH = """
+    {keyword} TG_OP = '{op}' THEN
+        PERFORM 1 FROM {table} WHERE id IN (SELECT {key} FROM ({changes}) AS changed) ORDER BY id FOR NO KEY UPDATE;
+        UPDATE {table} SET post_count = {table}.post_count + changed.n
+        FROM ({changes}) AS changed WHERE {table}.id = changed.{key};"""
+POST_COUNT_FUNCTION = """
+CREATE OR REPLACE FUNCTION count_{table}_posts() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN{branches}
+    END IF;
+    RETURN NULL;
+END
+$$"""
+POST_COUNT_TRIGGER = """
+CREATE TRIGGER {source}_count_{table}_{name} AFTER {op} ON {source}
+REFERENCING {transitions} FOR EACH STATEMENT EXECUTE FUNCTION count_{table}_posts()"""
+TRANSITION_TABLES = {
+    "INSERT": "NEW TABLE AS new_rows",
+    "DELETE": "OLD TABLE AS old_rows",
+    "UPDATE": "OLD TABLE AS old_rows NEW TABLE AS new_rows",
+}
+# SQLite (generate.py and bench.py can use it) has only row-level triggers
+SQLITE_POST_COUNT_TRIGGER = """
+CREATE TRIGGER {source}_count_{table}_{name} AFTER {op} ON {source} BEGIN {changes} END"""
+SQLITE_POST_COUNT_CHANGES = {
+    "INSERT": "UPDATE {table} SET post_count = post_count + 1 WHERE id = NEW.{key};",
+    "DELETE": "UPDATE {table} SET post_count = post_count - 1 WHERE id = OLD.{key};",
+    "UPDATE": "UPDATE {table} SET post_count = post_count - 1 WHERE id = OLD.{key}; "
+              "UPDATE {table} SET post_count = post_count + 1 WHERE id = NEW.{key};",
+}
+
+def post_count_ddl(source, table, key):
+    """Statements creating the triggers that count source's rows into table.post_count, by source.key.
+
+    Yields (dialect, sql) pairs; migrations/0007_post_counts.py runs the PostgreSQL ones.
+    """
+
+    branches = "".join(
+        POST_COUNT_BRANCH.format(keyword="IF" if i == 0 else "ELSIF", op=op, table=table, key=key,
+                                 changes=changes.format(key=key))
+        for i, (op, changes) in enumerate(POST_COUNT_CHANGES.items()))
+    yield "postgresql", POST_COUNT_FUNCTION.format(table=table, branches=branches)
+    for op, transitions in TRANSITION_TABLES.items():
+        yield "postgresql", POST_COUNT_TRIGGER.format(source=source, table=table, name=op.lower(), op=op,
+                                                      transitions=transitions)
+    for op, changes in SQLITE_POST_COUNT_CHANGES.items():
+        yield "sqlite", SQLITE_POST_COUNT_TRIGGER.format(source=source, table=table, name=op.lower(),
+                                                         op=f"UPDATE OF {key}" if op == "UPDATE" else op,
+                                                         changes=changes.format(table=table, key=key))
+
+POST_COUNTS = [(Post.__table__, User.__table__, "user_id"), (PostTag.__table__, Tag.__table__, "tag_id")]
+for source, table, key in POST_COUNTS:
+    for dialect, statement in post_count_ddl(source.name, table.name, key):
+        event.listen(source, "after_create", DDL(statement).execute_if(dialect=dialect))
+
+class Avatar(db.Model):
+    """An image URL already fetched into the avatar store, and the validators to check it for changes."""
+    __tablename__ = 'avatars'
+
+    url = db.Column(db.Text, primary_key=True)
+    hash = db.Column(db.Text, nullable=False)
+    etag = db.Column(db.Text)
+    last_modified = db.Column(db.Text)
+    fetched_at = db.Column(db.DateTime(timezone=True), nullable=False, default=db.func.now())
+
+class CatalogVersion(db.Model):
+    """Change counter for a small table every process keeps a copy of (see catalog.py)."""
+    __tablename__ = 'catalog_versions'
+
+    name = db.Column(db.Text, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def bump(cls, name):
+        """UPDATE statement moving a catalog to its next version."""
+
+        return cls.__table__.update().where(cls.name == name).values(version=cls.version + 1)
+
+# the tag catalog's counter row exists from the start, so bumping it is a plain UPDATE
+event.listen(CatalogVersion.__table__, "after_create",
+             DDL("INSERT INTO catalog_versions (name, version) VALUES ('tags', 0)"))
+
+class PageVersion(db.Model):
+    """Change counter for a rendered page ("home", "post:3", ...), the validator for its ETag (see cache.py).
+
+    The "*" row counts changes to every page at once.
+    """
+    __tablename__ = 'page_versions'
+
+    ALL = '*'
+
+    key = db.Column(db.Text, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    changed_at = db.Column(db.DateTime(timezone=True), nullable=False)
+
+    @classmethod
+    def bump(cls, dialect_name):
+        """INSERT ... ON CONFLICT statement moving the page under :key to its next version.
+
+        Run it with one {"key": ...} per page, as an executemany.
+        """
+
+        insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+        statement = insert(cls.__table__).values(key=db.bindparam("key"), version=1, changed_at=db.func.now())
+        return statement.on_conflict_do_update(
+            index_elements=[cls.key],
+            set_={"version": cls.version + 1, "changed_at": statement.excluded.changed_at})
+
+# the all-pages row exists from the start, so every page has a version
+event.listen(PageVersion.__table__, "after_create",
+             DDL("INSERT INTO page_versions (key, version, changed_at) VALUES ('*', 0, CURRENT_TIMESTAMP)"))
+
+# SQLite only enforces foreign keys (and so ON DELETE CASCADE) when asked to, per connection
+@event.listens_for(Engine, "connect")
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    if type(dbapi_connection).__module__ == "sqlite3":
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+# apps connected in this process; weak, so one the process is done with isn't kept alive for forks
+connected_apps = weakref.WeakSet()
+
 # associate Flask app and connect with our DB
 def connect_db(app):
     db.app = app
-    db.init_app(app)
\ No newline at end of file
+    db.init_app(app)
+    connected_apps.add(app)
+
+def dispose_engines(app):
+    """Start this (forked) process with empty pools, leaving the parent's connections open for the parent."""
+
+    for bind in [None, *(app.config.get("SQLALCHEMY_BINDS") or ())]:
+        db.get_engine(app, bind).dispose(close=False)
+
+def dispose_connected_engines():
+    for app in list(connected_apps):
+        dispose_engines(app)
+
+# a preforking server copies the parent's pools into every worker; registered once, as it can't be undone
+os.register_at_fork(after_in_child=dispose_connected_engines)
\ No newline at end of file
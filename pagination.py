@@ -0,0 +1,174 @@
+"""Keyset (cursor) pagination.
+
+A page is fetched with "WHERE (sort keys) come after the last row seen" instead
+of OFFSET, so every page costs the same no matter how deep into the list it is.
+The cursor handed to the client is the last row's sort key values, base64 encoded.
+
+keyset_page(..., stream=True) gives a StreamedPage instead, which reads its rows
+off a server-side cursor as a streamed template iterates it, so a long page is
+never held in memory. Given a select() rather than a Query, it runs nothing and
+gives a PendingPage, for the async read path (asgi.py) to execute itself.
+"""
+
+import base64
+import datetime
+import json
+
+from sqlalchemy import and_, or_, BigInteger
+from sqlalchemy.sql import Select
+
+# default number of rows on a page
+PER_PAGE = 50
+# rows a StreamedPage fetches from the server-side cursor at a time
+STREAM_CHUNK = 100
+
+
+class Page:
+    """One page of results plus the cursor for the page after it."""
+
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __repr__(self):
+        return f"<Page items={len(self.items)} next_cursor={self.next_cursor}>"
+
+
+class StreamedPage:
+    """A page whose rows are read off a server-side cursor while it is iterated.
+
+    It can be iterated once, and next_cursor is only known after that; templates
+    check it below their loop. map() sets a function applied to each row as it
+    is read.
+    """
+
+    def __init__(self, query, keys, per_page):
+        self.query = query
+        self.keys = keys
+        self.per_page = per_page
+        self.next_cursor = None
+        self.wrap = None
+
+    def map(self, function):
+        self.wrap = function
+        return self
+
+    def __iter__(self):
+        # the query asks for one row past the page, like keyset_page, to learn whether there is a next page
+        last = None
+        for n, row in enumerate(self.query.yield_per(STREAM_CHUNK)):
+            if n == self.per_page:
+                self.next_cursor = encode_cursor([getattr(last, col.key) for col, _ in self.keys])
+                break
+            last = row
+            yield self.wrap(row) if self.wrap else row
+
+    def __repr__(self):
+        return f"<StreamedPage per_page={self.per_page} next_cursor={self.next_cursor}>"
+
+
+class PendingPage:
+    """A page's select() statement, not run yet; page(rows) turns its result rows into the Page."""
+
+    def __init__(self, statement, keys, per_page):
+        self.statement = statement
+        self.keys = keys
+        self.per_page = per_page
+
+    def page(self, rows):
+        return page_of(rows, self.keys, self.per_page)
+
+
+def encode_cursor(values):
+    """Turn a row's sort key values into an opaque url-safe string."""
+
+    values = [v.isoformat() if isinstance(v, datetime.datetime) else v for v in values]
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, keys):
+    """Turn a cursor back into sort key values, or None if it's missing or garbled."""
+
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(keys):
+            return None
+        return [decode_value(col, v) for (col, _), v in zip(keys, values)]
+    except (ValueError, TypeError):
+        return None
+
+
+def decode_value(col, value):
+    """A sort key value from a cursor as col's Python type; ValueError/TypeError if it can't be one."""
+
+    expected = col.type.python_type
+    if expected is datetime.datetime:
+        return datetime.datetime.fromisoformat(value)
+    if expected is float and type(value) is int:
+        return float(value)
+    # type(), not isinstance(): JSON true/false are bools, which are ints too
+    if type(value) is not expected:
+        raise TypeError(f"{col.key} cursor value must be {expected.__name__}")
+    if expected is int:
+        bits = 64 if isinstance(col.type, BigInteger) else 32
+        if not -2 ** (bits - 1) <= value < 2 ** (bits - 1):
+            raise ValueError(f"{col.key} cursor value out of range")
+    if expected is str and "\x00" in value:
+        # PostgreSQL text can't hold NUL
+        raise ValueError(f"{col.key} cursor value has a NUL")
+    return value
+
+
+def after(keys, values):
+    """Build the WHERE clause for rows that sort after values.
+
+    keys is a list of (column, "asc"|"desc"). Mixed directions are expanded to
+    (a > x) OR (a = x AND b > y) OR ..., which a composite index can still serve.
+    """
+
+    clauses = []
+    for i, (col, direction) in enumerate(keys):
+        past = col < values[i] if direction == "desc" else col > values[i]
+        equal = [k == v for (k, _), v in zip(keys[:i], values[:i])]
+        clauses.append(and_(*equal, past))
+    return or_(*clauses)
+
+
+def keyset_page(query, keys, cursor=None, per_page=PER_PAGE, stream=False):
+    """Fetch the page of query that comes after cursor, ordered by keys (stream: a StreamedPage of it).
+
+    query can also be a select(), which gives back a PendingPage instead.
+    """
+
+    values = decode_cursor(cursor, keys)
+    if values is not None:
+        query = query.filter(after(keys, values))
+    order = [col.desc() if direction == "desc" else col.asc() for col, direction in keys]
+    # fetch one extra row to learn whether there is a next page
+    query = query.order_by(*order).limit(per_page + 1)
+    if isinstance(query, Select):
+        return PendingPage(query, keys, per_page)
+    if stream:
+        return StreamedPage(query, keys, per_page)
+    return page_of(query.all(), keys, per_page)
+
+
+def page_of(rows, keys, per_page):
+    """The Page for rows fetched by keyset_page, one past per_page if there is a next page."""
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, col.key) for col, _ in keys])
+    return Page(rows, next_cursor)
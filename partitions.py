@@ -0,0 +1,186 @@
+"""Keep the posts table's monthly partitions ahead of time, and archive the cold ones.
+
+    python partitions.py status                                  # every partition: range, rows, size, tablespace
+    python partitions.py maintain                                # partitions for the next MONTHS_AHEAD months
+    python partitions.py archive --tablespace blogly_archive     # move partitions over a year old
+
+On PostgreSQL posts is partitioned by month of created_at (migrations/
+0009_partition_posts.py): posts_YYYY_MM for each month, posts_earlier below the
+first and posts_later from the month after the last one up, so an insert never
+misses. Run maintain daily (cron): it adds months so posts_later stays empty,
+moving any post that landed there into its new month.
+
+The hot queries only read the newest partitions: the homepage's ORDER BY
+created_at DESC LIMIT n and the first page of a user's or tag's posts scan the
+partitions newest first and stop when the page is full, and a keyset cursor
+(?after=) prunes every partition newer than it at plan time. A post looked up
+by id alone (its page, the post_tags reference check) probes each partition's
+primary key instead, one index probe per partition.
+
+archive moves partitions older than --older-than months into --tablespace, a
+tablespace on compressed storage the DBA has set up, e.g. a ZFS dataset with
+compression=zstd:
+
+    CREATE TABLESPACE blogly_archive LOCATION '/archive/postgresql';
+
+PostgreSQL itself only compresses values too big to store inline, which posts
+rarely are. Each partition is frozen and analyzed first, so vacuum has nothing
+left to do there, then moved with its indexes. Archived posts stay in the table:
+reads, edits and deletes work as before, only from slower storage. The move
+locks that partition, and queries that scan it (the homepage included) wait
+for it, so each one runs in its own transaction and gives up after
+--lock-timeout; run archive in a quiet period and again to retry.
+"""
+
+import argparse
+import datetime
+import re
+from collections import namedtuple
+
+from sqlalchemy import create_engine, text
+
+# partitions to keep beyond the current month
+MONTHS_AHEAD = 3
+# partitions whose months all ended this many months ago are archived
+ARCHIVE_AFTER_MONTHS = 12
+
+COLUMNS = "id, title, content, created_at, user_id"
+
+PARTITIONS = """
+SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), coalesce(t.spcname, 'pg_default'),
+       c.reltuples, pg_total_relation_size(c.oid)
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+LEFT JOIN pg_tablespace t ON t.oid = c.reltablespace
+WHERE i.inhparent = 'posts'::regclass
+"""
+BOUND = re.compile(r"FROM \((.+)\) TO \((.+)\)")
+
+
+class Partition(namedtuple("Partition", "name lower upper tablespace rows bytes")):
+    """A partition of posts: created_at from lower (None: unbounded) up to upper (None: unbounded)."""
+
+    __slots__ = ()
+
+    def __str__(self):
+        lower = f"{self.lower:%Y-%m-%d}" if self.lower else "..."
+        upper = f"{self.upper:%Y-%m-%d}" if self.upper else "..."
+        rows = "?" if self.rows < 0 else f"{self.rows:.0f}"
+        return f"{self.name:<16} {lower:>10} - {upper:<10} {rows:>10} rows {self.bytes / 2**20:9.1f} MiB  {self.tablespace}"
+
+
+def bound(value):
+    if value in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.datetime.fromisoformat(value.strip("'"))
+
+
+def month_of(moment):
+    return datetime.datetime(moment.year, moment.month, 1)
+
+
+def add_months(month, n):
+    """The first day of the month n months after month's."""
+
+    index = month.year * 12 + month.month - 1 + n
+    return datetime.datetime(index // 12, index % 12 + 1, 1)
+
+
+def partitions(conn):
+    """posts' partitions, oldest first."""
+
+    found = []
+    for name, partition_bound, tablespace, rows, size in conn.execute(text(PARTITIONS)):
+        lower, upper = BOUND.search(partition_bound).groups()
+        found.append(Partition(name, bound(lower), bound(upper), tablespace, rows, size))
+    return sorted(found, key=lambda p: (p.lower is not None, p.lower or datetime.datetime.min))
+
+
+def maintain(conn, months_ahead=MONTHS_AHEAD, now=None, lock_timeout="5s"):
+    """Give each month through months_ahead after now's its partition; return the names created.
+
+    posts_later is detached while it happens, and any posts in it that belong
+    to the new months are moved into them (straight into the partitions, so
+    the triggers on posts don't count them as new).
+    """
+
+    later = partitions(conn)[-1]
+    if later.upper is not None or later.lower is None:
+        raise RuntimeError(f"expected posts_later, FROM (a month) TO (MAXVALUE), last; found {later.name}")
+    end = add_months(month_of(now or datetime.datetime.now()), months_ahead + 1)
+    if later.lower >= end:
+        return []
+
+    conn.execute(text(f"SET LOCAL lock_timeout = '{lock_timeout}'"))
+    conn.execute(text(f"ALTER TABLE posts DETACH PARTITION {later.name}"))
+    created = []
+    month = later.lower
+    while month < end:
+        name, following = f"posts_{month:%Y_%m}", add_months(month, 1)
+        conn.execute(text(f"CREATE TABLE {name} PARTITION OF posts "
+                          f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{following:%Y-%m-%d}')"))
+        conn.execute(text(f"INSERT INTO {name} ({COLUMNS}) SELECT {COLUMNS} FROM {later.name} "
+                          f"WHERE created_at >= :start AND created_at < :end"), {"start": month, "end": following})
+        created.append(name)
+        month = following
+    conn.execute(text(f"DELETE FROM {later.name} WHERE created_at < :end"), {"end": end})
+    conn.execute(text(f"ALTER TABLE posts ATTACH PARTITION {later.name} "
+                      f"FOR VALUES FROM ('{end:%Y-%m-%d}') TO (MAXVALUE)"))
+    return created
+
+
+def archive(engine, tablespace, older_than=ARCHIVE_AFTER_MONTHS, now=None, lock_timeout="5s"):
+    """Freeze and move partitions whose months all ended older_than months ago into tablespace; return their names."""
+
+    before = add_months(month_of(now or datetime.datetime.now()), -older_than)
+    with engine.connect() as conn:
+        cold = [p for p in partitions(conn)
+                if p.upper is not None and p.upper <= before and p.tablespace != tablespace]
+
+    archived = []
+    for partition in cold:
+        # VACUUM can't run in a transaction block
+        with engine.connect() as conn:
+            conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+            conn.execute(text(f"VACUUM (FREEZE, ANALYZE) {partition.name}"))
+        with engine.begin() as conn:
+            conn.execute(text(f"SET LOCAL lock_timeout = '{lock_timeout}'"))
+            conn.execute(text(f"ALTER TABLE {partition.name} SET TABLESPACE {tablespace}"))
+            indexes = conn.execute(text("SELECT indexrelid::regclass::text FROM pg_index "
+                                        "WHERE indrelid = CAST(:name AS regclass)"), {"name": partition.name})
+            for (index,) in indexes.fetchall():
+                conn.execute(text(f"ALTER INDEX {index} SET TABLESPACE {tablespace}"))
+        archived.append(partition.name)
+    return archived
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db", default="postgresql:///unit23_db", help="database url")
+    parser.add_argument("--lock-timeout", default="5s", help="give up on a partition's lock after this long")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="list the partitions")
+    ahead = commands.add_parser("maintain", help="create the coming months' partitions")
+    ahead.add_argument("--months-ahead", type=int, default=MONTHS_AHEAD)
+    cold = commands.add_parser("archive", help="move cold partitions to the archive tablespace")
+    cold.add_argument("--tablespace", required=True, help="tablespace on compressed storage")
+    cold.add_argument("--older-than", type=int, default=ARCHIVE_AFTER_MONTHS, help="months")
+    args = parser.parse_args(argv)
+
+    engine = create_engine(args.db)
+    if args.command == "status":
+        with engine.connect() as conn:
+            for partition in partitions(conn):
+                print(partition)
+    elif args.command == "maintain":
+        with engine.begin() as conn:
+            created = maintain(conn, args.months_ahead, lock_timeout=args.lock_timeout)
+        print("created " + ", ".join(created) if created else "partitions already in place")
+    else:
+        archived = archive(engine, args.tablespace, args.older_than, lock_timeout=args.lock_timeout)
+        print("archived " + ", ".join(archived) if archived else "nothing to archive")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""On-demand sampling profiler for slow routes, safe to switch on in production.
+
+    curl -X POST -H "Authorization: Bearer $PROFILER_TOKEN" \\
+        "localhost:5000/_profiler/start?route=/users/*&percent=10&seconds=120"
+    curl -H "Authorization: Bearer $PROFILER_TOKEN" localhost:5000/_profiler/collapsed > users.folded
+    curl -H "Authorization: Bearer $PROFILER_TOKEN" localhost:5000/_profiler/speedscope.json > users.speedscope.json
+
+While a capture runs, requests whose path or route pattern matches ?route= (a
+shell-style pattern, "*" for every route) are picked with ?percent= chance.
+A background thread looks at the picked requests' threads every
+PROFILER_INTERVAL seconds and counts the stack it finds, so nothing is added
+to each function call and requests that aren't picked pay one dict lookup
+per query and template. A capture stops by itself after ?seconds=.
+
+Each stack is filed under its route and the phase the request was in:
+
+    db        executing a statement (the engine's cursor-execute hooks)
+    orm       in SQLAlchemy's ORM: building queries, hydrating User/Post objects, flushing
+    template  rendering a template (Flask's template signals), outside the two above
+    app       anything else: the views, Werkzeug, Flask
+
+/_profiler/collapsed serves the counts as collapsed stacks (one
+"route;[phase];outer;...;inner count" line each), the input of flamegraph.pl
+and speedscope; /_profiler/speedscope.json serves a speedscope sampled profile.
+Both come first by route and phase, then by call stack.
+
+The endpoints answer 404 unless PROFILER_TOKEN is set, and need it as a bearer
+token. Captures are per process: with several workers, start and collect on
+each (or set PROFILER_ROUTE to have every worker capture for its first
+MAX_SECONDS from startup).
+"""
+
+import fnmatch
+import hmac
+import math
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import Response, abort, current_app, jsonify, request
+from flask import signals
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+ORM_DIR = os.path.join("sqlalchemy", "orm", "")
+# a capture never runs longer than this, whatever ?seconds= says
+MAX_SECONDS = 3600
+
+
+class Capture:
+    """What a running capture profiles, and until when."""
+
+    def __init__(self, route="*", percent=100.0, seconds=60.0, interval=0.005):
+        self.route = route
+        self.percent = percent
+        self.interval = interval
+        self.seconds = seconds
+        self.started = time.time()
+        self.deadline = time.monotonic() + seconds
+
+    def matches(self):
+        rule = request.url_rule.rule if request.url_rule else None
+        if not (fnmatch.fnmatchcase(request.path, self.route) or (rule and fnmatch.fnmatchcase(rule, self.route))):
+            return False
+        return random.random() * 100 < self.percent
+
+    def expired(self):
+        return time.monotonic() > self.deadline
+
+
+class RequestState:
+    """A picked request: its route label and how deep it is in statements and templates."""
+
+    __slots__ = ("route", "db", "templates")
+
+    def __init__(self, route):
+        self.route = route
+        self.db = 0
+        self.templates = 0
+
+
+class Profiler:
+    """Flask extension sampling the stacks of picked requests."""
+
+    def __init__(self, app=None):
+        self.capture = None
+        # thread id -> RequestState for the requests being sampled right now
+        self.profiled = {}
+        # (route, phase, frame, ...) -> samples; frames are (name, file, line), outermost first
+        self.stacks = Counter()
+        self.requests = 0
+        self.lock = threading.Lock()
+        # held while checking for and starting the sampler thread, so concurrent requests start one
+        self.thread_lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+        self.labels = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # bearer token for the /_profiler endpoints; unset, they don't exist
+        app.config.setdefault("PROFILER_TOKEN", None)
+        app.config.setdefault("PROFILER_INTERVAL", 0.005)
+        # distinct stacks kept per capture; later new ones are counted under "[other]"
+        app.config.setdefault("PROFILER_MAX_STACKS", 20000)
+        # capture from startup in every worker, e.g. PROFILER_ROUTE=/tags/* (with PROFILER_PERCENT)
+        app.config.setdefault("PROFILER_ROUTE", None)
+        app.config.setdefault("PROFILER_PERCENT", 100.0)
+        self.max_stacks = app.config["PROFILER_MAX_STACKS"]
+        if app.config["PROFILER_ROUTE"]:
+            self.start(Capture(app.config["PROFILER_ROUTE"], app.config["PROFILER_PERCENT"], MAX_SECONDS,
+                               app.config["PROFILER_INTERVAL"]))
+
+        # on the Engine class, like metrics.py, so every engine the app creates is covered
+        if not event.contains(Engine, "before_cursor_execute", self.before_cursor_execute):
+            event.listen(Engine, "before_cursor_execute", self.before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", self.after_cursor_execute)
+            event.listen(Engine, "handle_error", self.after_cursor_execute)
+        signals.before_render_template.connect(self.before_render, app, weak=False)
+        signals.template_rendered.connect(self.after_render, app, weak=False)
+        app.before_request(self.start_request)
+        app.teardown_request(self.finish_request)
+
+        app.add_url_rule("/_profiler", "profiler", self.status)
+        app.add_url_rule("/_profiler/start", "profiler_start", self.start_view, methods=["POST"])
+        app.add_url_rule("/_profiler/stop", "profiler_stop", self.stop_view, methods=["POST"])
+        app.add_url_rule("/_profiler/collapsed", "profiler_collapsed", self.collapsed_view)
+        app.add_url_rule("/_profiler/speedscope.json", "profiler_speedscope", self.speedscope_view)
+        app.extensions["profiler"] = self
+
+    # ---- capturing
+
+    def start(self, capture):
+        """Begin a new capture, dropping the last one's samples."""
+
+        with self.lock:
+            self.stacks = Counter()
+            self.requests = 0
+            self.capture = capture
+
+    def stop(self):
+        """End the capture; its samples stay until the next one starts."""
+
+        self.capture = None
+        self.profiled.clear()
+
+    def ensure_sampler(self):
+        # the thread doesn't survive a fork (gunicorn --preload), so each worker starts its own
+        with self.thread_lock:
+            if self.thread is None or self.pid != os.getpid() or not self.thread.is_alive():
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self.run, name="blogly-profiler", daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            capture = self.capture
+            if capture is None:
+                return
+            if capture.expired():
+                self.stop()
+                return
+            time.sleep(capture.interval)
+            if self.profiled:
+                self.sample()
+
+    def sample(self):
+        """Count the current stack of every picked request."""
+
+        frames = sys._current_frames()
+        with self.lock:
+            for ident, state in list(self.profiled.items()):
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack, in_orm = [], False
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(self.label(code))
+                    in_orm = in_orm or ORM_DIR in code.co_filename
+                    frame = frame.f_back
+                phase = "db" if state.db else "orm" if in_orm else "template" if state.templates else "app"
+                key = (state.route, f"[{phase}]", *reversed(stack))
+                if key not in self.stacks and len(self.stacks) >= self.max_stacks:
+                    key = (state.route, f"[{phase}]", "[other]")
+                self.stacks[key] += 1
+
+    def label(self, code):
+        """(function, file, first line) for a code object, the file relative to the app or site-packages."""
+
+        label = self.labels.get(code)
+        if label is None:
+            filename = code.co_filename
+            if filename.startswith(APP_DIR):
+                filename = os.path.relpath(filename, APP_DIR)
+            elif "site-packages" + os.sep in filename:
+                filename = filename.split("site-packages" + os.sep, 1)[1]
+            label = self.labels[code] = (code.co_name, filename, code.co_firstlineno)
+        return label
+
+    # ---- request, engine and template hooks
+
+    def start_request(self):
+        capture = self.capture
+        if capture is None or (request.endpoint or "").startswith("profiler"):
+            return
+        if capture.expired():
+            self.stop()
+            return
+        if capture.matches():
+            self.ensure_sampler()
+            route = request.url_rule.rule if request.url_rule else "<unmatched>"
+            self.profiled[threading.get_ident()] = RequestState(f"{request.method} {route}")
+
+    def finish_request(self, exc):
+        if self.profiled.pop(threading.get_ident(), None) is not None:
+            self.requests += 1
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        state = self.profiled.get(threading.get_ident())
+        if state is not None:
+            state.db += 1
+
+    def after_cursor_execute(self, *args):
+        state = self.profiled.get(threading.get_ident())
+        if state is not None and state.db:
+            state.db -= 1
+
+    def before_render(self, sender, template, context, **extra):
+        state = self.profiled.get(threading.get_ident())
+        if state is not None:
+            state.templates += 1
+
+    def after_render(self, sender, template, context, **extra):
+        state = self.profiled.get(threading.get_ident())
+        if state is not None and state.templates:
+            state.templates -= 1
+
+    # ---- output
+
+    def collapsed(self):
+        """The samples as collapsed stacks, one "frame;frame;... count" line per distinct stack."""
+
+        with self.lock:
+            items = sorted(self.stacks.items())
+        lines = [";".join(frame_name(frame) for frame in key) + f" {count}" for key, count in items]
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def speedscope(self):
+        """The samples as a speedscope file (https://www.speedscope.app/file-format-schema.json)."""
+
+        with self.lock:
+            items = sorted(self.stacks.items())
+            capture = self.capture
+        interval = capture.interval if capture else current_app.config["PROFILER_INTERVAL"]
+        frames, index, samples, weights = [], {}, [], []
+        for key, count in items:
+            sample = []
+            for frame in key:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    if isinstance(frame, str):
+                        frames.append({"name": frame})
+                    else:
+                        name, filename, line = frame
+                        frames.append({"name": name, "file": filename, "line": line})
+                sample.append(index[frame])
+            samples.append(sample)
+            weights.append(round(count * interval * 1000, 3))
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": "blogly",
+            "exporter": "blogly profiler.py",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled", "name": "blogly", "unit": "milliseconds",
+                "startValue": 0, "endValue": round(sum(weights), 3),
+                "samples": samples, "weights": weights,
+            }],
+        }
+
+    # ---- endpoints
+
+    def authorize(self):
+        token = current_app.config["PROFILER_TOKEN"]
+        if not token:
+            abort(404)
+        given = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(given.encode(), f"Bearer {token}".encode()):
+            abort(403)
+
+    def status(self):
+        """Whether a capture is running, what it profiles, and how much it has collected."""
+
+        self.authorize()
+        capture = self.capture
+        return jsonify({
+            "running": capture is not None,
+            "capture": capture and {"route": capture.route, "percent": capture.percent,
+                                    "seconds": capture.seconds, "interval": capture.interval,
+                                    "started": capture.started},
+            "requests": self.requests,
+            "samples": sum(self.stacks.values()),
+            "stacks": len(self.stacks),
+        })
+
+    def start_view(self):
+        self.authorize()
+        args = request.values
+        try:
+            percent = float(args.get("percent", 100))
+            seconds = float(args.get("seconds", 60))
+            interval_ms = float(args.get("interval_ms", current_app.config["PROFILER_INTERVAL"] * 1000))
+        except ValueError:
+            abort(400, "percent, seconds and interval_ms must be numbers")
+        # float() takes "nan" and "inf": a nan deadline never passes, and the sampler can't sleep for nan
+        if not all(math.isfinite(value) for value in (percent, seconds, interval_ms)):
+            abort(400, "percent, seconds and interval_ms must be finite numbers")
+        if interval_ms < 1:
+            abort(400, "interval_ms must be at least 1")
+        capture = Capture(route=args.get("route", "*"), percent=min(max(percent, 0.0), 100.0),
+                          seconds=min(seconds, MAX_SECONDS), interval=interval_ms / 1000)
+        self.start(capture)
+        return self.status()
+
+    def stop_view(self):
+        self.authorize()
+        self.stop()
+        return self.status()
+
+    def collapsed_view(self):
+        self.authorize()
+        return Response(self.collapsed(), mimetype="text/plain")
+
+    def speedscope_view(self):
+        self.authorize()
+        response = jsonify(self.speedscope())
+        response.headers["Content-Disposition"] = "attachment; filename=blogly.speedscope.json"
+        return response
+
+
+def frame_name(frame):
+    """A frame as collapsed-stack text; ";" separates frames there, so it can't appear in one."""
+
+    if isinstance(frame, str):
+        return frame
+    name, filename, line = frame
+    return f"{name} ({filename}:{line})".replace(";", ":")
@@ -0,0 +1,52 @@
+"""Query layer for the read routes.
+
+Each function loads everything its page's template needs up front, so a page
+runs in a fixed number of queries no matter how many posts or tags it shows.
+"""
+
+from flask import current_app
+from sqlalchemy.orm import joinedload, selectinload, raiseload
+
+from models import User, Post, Tag
+
+
+def guard(query):
+    """Make lazy loads raise instead of silently querying, when enabled.
+
+    Turned on with app.config["RAISE_ON_LAZY_LOAD"] (the tests set it), so a
+    template that reaches for a relationship the route didn't load fails loudly.
+    """
+
+    if current_app.config.get("RAISE_ON_LAZY_LOAD"):
+        return query.options(raiseload("*"))
+    return query
+
+
+def with_author_and_tags(query):
+    """Load the posts' authors (joined) and tags (select-in) along with them."""
+
+    return guard(query.options(joinedload(Post.user), selectinload(Post.tags)))
+
+
+def recent_posts(limit=5):
+    """Most recent posts with their author and tags."""
+
+    return with_author_and_tags(Post.query).order_by(Post.created_at.desc()).limit(limit).all()
+
+
+def post_details(post_id):
+    """Single post with its author and tags, or 404."""
+
+    return with_author_and_tags(Post.query).filter(Post.id == post_id).first_or_404()
+
+
+def user_details(user_id):
+    """Single user, or 404."""
+
+    return guard(User.query).filter(User.id == user_id).first_or_404()
+
+
+def tag_details(tag_id):
+    """Single tag, or 404. Its posts are paged separately with Post.by_tag."""
+
+    return guard(Tag.query).filter(Tag.id == tag_id).first_or_404()
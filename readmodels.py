@@ -0,0 +1,106 @@
+"""Read models for the list pages and post pickers.
+
+The user list only shows names and the post lists and pickers only show titles
+and dates, yet loading them as User and Post entities reads every column
+(img_url, a post's whole content), puts each row in the session's identity
+map and sets up unit-of-work state for it. These load just the columns a list
+needs as plain tuples and wrap each in a small read-only namedtuple that has
+the properties the templates use (full_name, friendly_date).
+
+They are for display only: there is nothing to lazy load and nothing to save.
+The async read path (asgi.py) selects the same columns into the same summaries.
+"""
+
+from collections import namedtuple
+
+from models import db, User, Post, Tag, FRIENDLY_DATE
+from pagination import Page, StreamedPage, PER_PAGE
+
+
+class UserSummary(namedtuple("UserSummary", "id first_name last_name post_count avatar_hash")):
+    """A user in a list: id, name, number of posts and stored avatar."""
+
+    __slots__ = ()
+
+    @property
+    def full_name(self):
+        return f"{self.first_name} {self.last_name}"
+
+
+class PostSummary(namedtuple("PostSummary", "id title created_at")):
+    """A post in a list or picker: id, title and date."""
+
+    __slots__ = ()
+
+    @property
+    def friendly_date(self):
+        return self.created_at.strftime(FRIENDLY_DATE)
+
+
+class TagSummary(namedtuple("TagSummary", "id name post_count")):
+    """A tag in a list: id, name and number of posts."""
+
+    __slots__ = ()
+
+
+def summaries(model, page):
+    """The page with each row turned into a model (as it is read, for a StreamedPage)."""
+
+    if isinstance(page, StreamedPage):
+        return page.map(model._make)
+    return Page([model._make(row) for row in page], page.next_cursor)
+
+
+# the columns behind each summary, in its field order
+USER_COLUMNS = (User.id, User.first_name, User.last_name, User.post_count, User.avatar_hash)
+TAG_COLUMNS = (Tag.id, Tag.name, Tag.post_count)
+POST_COLUMNS = (Post.id, Post.title, Post.created_at)
+
+
+def user_query():
+    return db.session.query(*USER_COLUMNS)
+
+
+def tag_query():
+    return db.session.query(*TAG_COLUMNS)
+
+
+def post_query():
+    return db.session.query(*POST_COLUMNS)
+
+
+def users_by_last_name(cursor=None, per_page=PER_PAGE):
+    """Page of UserSummary, as User.order_by_last_name."""
+
+    return summaries(UserSummary, User.order_by_last_name(cursor, per_page, query=user_query()))
+
+
+def posts_by_user(user_id, cursor=None, per_page=PER_PAGE, stream=False):
+    """Page of PostSummary, as Post.by_user."""
+
+    return summaries(PostSummary, Post.by_user(user_id, cursor, per_page, query=post_query(), stream=stream))
+
+
+def posts_by_tag(tag_id, cursor=None, per_page=PER_PAGE, stream=False):
+    """Page of PostSummary, as Post.by_tag."""
+
+    return summaries(PostSummary, Post.by_tag(tag_id, cursor, per_page, query=post_query(), stream=stream))
+
+
+def post_titles(term=None, cursor=None, per_page=PER_PAGE):
+    """Page of PostSummary, as Post.search_titles."""
+
+    return summaries(PostSummary, Post.search_titles(term, cursor, per_page, query=post_query()))
+
+
+def tags_by_popularity(cursor=None, per_page=PER_PAGE):
+    """Page of TagSummary, as Tag.by_popularity."""
+
+    return summaries(TagSummary, Tag.by_popularity(cursor, per_page, query=tag_query()))
+
+
+def with_post_counts(tags):
+    """A page of catalog tags as TagSummary: the names are in memory, so read just the counts, by id."""
+
+    counts = dict(db.session.query(Tag.id, Tag.post_count).filter(Tag.id.in_([tag.id for tag in tags])))
+    return Page([TagSummary(tag.id, tag.name, counts.get(tag.id, 0)) for tag in tags], tags.next_cursor)
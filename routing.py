@@ -0,0 +1,103 @@
+"""Send reads to read replicas and writes to the primary database.
+
+Replicas are ordinary Flask-SQLAlchemy binds, named in READ_REPLICAS:
+
+    SQLALCHEMY_BINDS = {"replica": "postgresql:///unit23_replica"}
+    READ_REPLICAS = ["replica"]
+
+While a GET or HEAD request is handled, the session reads from one of the
+replicas, picked per request. Everything else uses the primary
+(SQLALCHEMY_DATABASE_URI): POST handlers, scripts and CLI commands run outside a
+request, and everything in a request after its first write (a flush, or an
+insert/update/delete statement).
+
+Replicas lag behind the primary. So that whoever just wrote sees their change on
+the page they are redirected to, a POST or a write starts a read-your-writes
+window: for READ_YOUR_WRITES_SECONDS that visitor's requests (tracked in their
+session cookie) read from the primary too.
+
+With no READ_REPLICAS (the default) every query goes to the primary.
+"""
+
+import random
+import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+
+# methods whose handlers only read
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+# engine options (from config.engine_options) that only a server database's pool takes
+SERVER_ONLY_OPTIONS = ("pool_size", "max_overflow", "connect_args")
+# session cookie key: time (epoch seconds) until which this visitor reads from the primary
+PRIMARY_UNTIL = "db_primary_until"
+
+
+class RoutingSession(SignallingSession):
+    """Session that reads from the request's replica until something is written."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if has_request_context() and bind_key(mapper) is None:
+            if self._flushing or getattr(clause, "is_dml", False):
+                wrote()
+            elif g.get("db_replica") is not None:
+                return get_state(self.app).db.get_engine(self.app, bind=g.db_replica)
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy whose sessions are RoutingSessions."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        # generate.py and bench.py can point the app at a SQLite file, which has no pool to size
+        if sa_url.get_backend_name() == "sqlite":
+            engine_opts = {k: v for k, v in engine_opts.items() if k not in SERVER_ONLY_OPTIONS}
+        return super().create_engine(sa_url, engine_opts)
+
+
+def bind_key(mapper):
+    """The __bind_key__ of a mapped class, which pins it to that bind."""
+
+    if mapper is None:
+        return None
+    return mapper.persist_selectable.info.get("bind_key")
+
+
+def wrote():
+    """Send the rest of this request to the primary."""
+
+    g.db_replica = None
+    g.db_wrote = True
+
+
+class DatabaseRouter:
+    """Flask extension picking each request's database."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # bind keys (in SQLALCHEMY_BINDS) of the replicas GET requests read from
+        app.config.setdefault("READ_REPLICAS", [])
+        # how long after a write that visitor keeps reading from the primary
+        app.config.setdefault("READ_YOUR_WRITES_SECONDS", 5.0)
+
+        app.before_request(self.route_request)
+        app.after_request(self.remember_write)
+        app.extensions["db_router"] = self
+
+    def route_request(self):
+        g.db_replica = None
+        replicas = current_app.config["READ_REPLICAS"]
+        if replicas and request.method in READ_METHODS and session.get(PRIMARY_UNTIL, 0) < time.time():
+            g.db_replica = random.choice(replicas)
+
+    def remember_write(self, response):
+        if current_app.config["READ_REPLICAS"] and (request.method not in READ_METHODS or g.get("db_wrote")):
+            session[PRIMARY_UNTIL] = time.time() + current_app.config["READ_YOUR_WRITES_SECONDS"]
+        return response
@@ -0,0 +1,333 @@
+"""Full-text search over post titles and content.
+
+On PostgreSQL, posts are matched with websearch_to_tsquery() against
+posts.search_vector, a stored tsvector of title (weight A) and content (weight
+B) that the database keeps current. Its GIN index, ix_posts_search, means a
+search reads only the posts that match. Results are ranked with ts_rank_cd on
+the stored vector, and only the returned page is highlighted with ts_headline.
+
+Anywhere else (a local SQLite file, say), an InvertedIndex is kept in process.
+It is built from the posts table on the first search, then updated by the
+write handlers in app.py, so a search there also reads only the postings for
+its terms. It matches whole words, ignores the usual stopwords, does no
+stemming, and is per process.
+
+Either way, results come back as keyset pages ordered by rank, then id.
+"""
+
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+from markupsafe import Markup, escape
+from sqlalchemy import Float, cast, func, literal_column
+from sqlalchemy.orm import selectinload
+
+import queries
+from models import db, Post, PostTag
+from pagination import Page, after, decode_cursor, encode_cursor, PER_PAGE
+
+# text search configuration; must match POST_SEARCH_VECTOR in models.py
+CONFIG = "english"
+
+# ts_headline wraps matches in these; they're swapped for <mark> after escaping
+START, STOP = "\x01", "\x02"
+HEADLINE_OPTIONS = f"StartSel={START}, StopSel={STOP}, MaxWords=35, MinWords=15, ShortWord=2"
+
+# relative weight of a term in the title versus the content (tsvector A and B weights)
+TITLE_WEIGHT = 1.0
+CONTENT_WEIGHT = 0.4
+# words in a fallback snippet
+SNIPPET_WORDS = 30
+
+# (score, post id), for decoding the fallback's cursors
+MEMORY_KEYS = [(literal_column("rank", Float), "desc"), (Post.id, "desc")]
+
+TOKEN = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from had has have he her his i if in into is it its me my no not of on "
+    "or our she so such that the their them then there these they this to was we were what when which who "
+    "will with you your".split())
+
+
+class Hit:
+    """One search result: the post (author and tags loaded), its rank and highlighted text."""
+
+    def __init__(self, post, rank, title, snippet):
+        self.post = post
+        self.rank = rank
+        self.title = title
+        self.snippet = snippet
+
+    def __repr__(self):
+        return f"<Hit post={self.post.id} rank={self.rank:.4f}>"
+
+
+def marked(text):
+    """Escape a ts_headline result, then turn its match markers into <mark> tags."""
+
+    return Markup(str(escape(text)).replace(START, "<mark>").replace(STOP, "</mark>"))
+
+
+def tokens(text):
+    """Lowercased words of text, stopwords included, in order."""
+
+    return TOKEN.findall(text.lower())
+
+
+def terms(text):
+    """The searchable words of text."""
+
+    return [word for word in tokens(text) if word not in STOPWORDS]
+
+
+def highlight(text, wanted):
+    """Escape text and wrap the words in wanted in <mark>."""
+
+    parts = []
+    last = 0
+    for match in TOKEN.finditer(text):
+        if match.group().lower() in wanted:
+            parts.append(escape(text[last:match.start()]))
+            parts.append(Markup("<mark>%s</mark>") % match.group())
+            last = match.end()
+    parts.append(escape(text[last:]))
+    return Markup("").join(parts)
+
+
+def snippet(text, wanted):
+    """A highlighted run of SNIPPET_WORDS words around the first match in text."""
+
+    words = text.split()
+    start = 0
+    for i, word in enumerate(words):
+        if any(token in wanted for token in tokens(word)):
+            start = max(i - SNIPPET_WORDS // 3, 0)
+            break
+    window = " ".join(words[start:start + SNIPPET_WORDS])
+    prefix = "... " if start else ""
+    suffix = " ..." if start + SNIPPET_WORDS < len(words) else ""
+    return prefix + highlight(window, wanted) + suffix
+
+
+class InvertedIndex:
+    """In-process inverted index of post titles and content."""
+
+    def __init__(self):
+        # term -> {post id: weighted term frequency}
+        self.postings = defaultdict(dict)
+        # post id -> (user id, set of tag ids, set of terms)
+        self.docs = {}
+        self.by_user = defaultdict(set)
+        self.by_tag = defaultdict(set)
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, post_id, user_id, title, content, tag_ids=()):
+        """Index a post, replacing whatever was indexed for it before."""
+
+        weights = Counter()
+        for term in terms(title):
+            weights[term] += TITLE_WEIGHT
+        for term in terms(content):
+            weights[term] += CONTENT_WEIGHT
+        # longer posts shouldn't win just by repeating words
+        norm = 1 + math.log(1 + sum(weights.values()))
+
+        with self.lock:
+            self.discard(post_id)
+            for term, weight in weights.items():
+                self.postings[term][post_id] = weight / norm
+            self.docs[post_id] = (user_id, set(tag_ids), set(weights))
+            self.by_user[user_id].add(post_id)
+            for tag_id in tag_ids:
+                self.by_tag[tag_id].add(post_id)
+
+    def discard(self, post_id):
+        """Drop a post from the index, if it's there."""
+
+        with self.lock:
+            doc = self.docs.pop(post_id, None)
+            if doc is None:
+                return
+            user_id, tag_ids, doc_terms = doc
+            for term in doc_terms:
+                postings = self.postings[term]
+                postings.pop(post_id, None)
+                if not postings:
+                    del self.postings[term]
+            self.by_user[user_id].discard(post_id)
+            for tag_id in tag_ids:
+                self.by_tag[tag_id].discard(post_id)
+
+    def discard_user(self, user_id):
+        """Drop every post by a user (deleting a user cascades to their posts)."""
+
+        with self.lock:
+            for post_id in list(self.by_user.pop(user_id, ())):
+                self.discard(post_id)
+
+    def discard_tag(self, tag_id):
+        """Forget a deleted tag."""
+
+        with self.lock:
+            for post_id in self.by_tag.pop(tag_id, ()):
+                self.docs[post_id][1].discard(tag_id)
+
+    def search(self, text, user_id=None, tag_id=None):
+        """[(score, post id), ...] for posts containing every term of text, best first."""
+
+        wanted = set(terms(text))
+        if not wanted:
+            return []
+        with self.lock:
+            candidates = [self.postings.get(term, {}) for term in wanted]
+            if user_id is not None:
+                candidates.append(self.by_user.get(user_id, set()))
+            if tag_id is not None:
+                candidates.append(self.by_tag.get(tag_id, set()))
+            # walk the shortest list and probe the others, so the cost follows the matches
+            candidates.sort(key=len)
+            total = len(self.docs)
+            idf = {term: math.log(1 + total / len(self.postings[term])) for term in wanted if term in self.postings}
+            hits = []
+            for post_id in candidates[0]:
+                if all(post_id in other for other in candidates[1:]):
+                    score = sum(self.postings[term][post_id] * idf[term] for term in wanted)
+                    hits.append((score, post_id))
+        hits.sort(reverse=True)
+        return hits
+
+
+class Search:
+    """Flask extension choosing the search backend and keeping the fallback index current."""
+
+    def __init__(self, app=None):
+        self.index = None
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # None picks by dialect: "postgresql" on PostgreSQL, "memory" elsewhere
+        app.config.setdefault("SEARCH_BACKEND", None)
+        self.backend = app.config["SEARCH_BACKEND"]
+        app.extensions["search"] = self
+
+    @property
+    def uses_postgres(self):
+        if self.backend is None:
+            return db.engine.dialect.name == "postgresql"
+        return self.backend == "postgresql"
+
+    # ---- queries
+
+    def posts(self, text, user_id=None, tag_id=None, cursor=None, per_page=PER_PAGE):
+        """Page of Hits for posts matching text, best match first."""
+
+        if not text or not text.strip():
+            return Page([], None)
+        if self.uses_postgres:
+            return self.search_postgres(text, user_id, tag_id, cursor, per_page)
+        return self.search_memory(text, user_id, tag_id, cursor, per_page)
+
+    def search_postgres(self, text, user_id, tag_id, cursor, per_page):
+        config = literal_column(f"'{CONFIG}'")
+        # created on PostgreSQL only, so not mapped on Post
+        vector = literal_column("posts.search_vector")
+        tsquery = func.websearch_to_tsquery(config, text)
+        # float8, so the rank survives the round trip through the cursor exactly
+        rank = cast(func.ts_rank_cd(vector, tsquery), Float).label("rank")
+        title = func.ts_headline(config, Post.title, tsquery, f"{HEADLINE_OPTIONS}, HighlightAll=true")
+        snippet = func.ts_headline(config, Post.content, tsquery, HEADLINE_OPTIONS)
+
+        # authors select-in after the LIMIT rather than joined to every match before it
+        query = db.session.query(Post, rank, title, snippet)
+        query = queries.guard(query.options(selectinload(Post.user), selectinload(Post.tags)))
+        query = query.filter(vector.op("@@")(tsquery))
+        if user_id is not None:
+            query = query.filter(Post.user_id == user_id)
+        if tag_id is not None:
+            query = query.join(PostTag, PostTag.post_id == Post.id).filter(PostTag.tag_id == tag_id)
+
+        keys = [(rank, "desc"), (Post.id, "desc")]
+        values = decode_cursor(cursor, keys)
+        if values is not None:
+            query = query.filter(after(keys, values))
+        rows = query.order_by(rank.desc(), Post.id.desc()).limit(per_page + 1).all()
+
+        next_cursor = None
+        if len(rows) > per_page:
+            rows = rows[:per_page]
+            next_cursor = encode_cursor([rows[-1][1], rows[-1][0].id])
+        return Page([Hit(post, score, marked(t), marked(s)) for post, score, t, s in rows], next_cursor)
+
+    def search_memory(self, text, user_id, tag_id, cursor, per_page):
+        hits = self.memory_index().search(text, user_id, tag_id)
+        values = decode_cursor(cursor, MEMORY_KEYS)
+        if values is not None:
+            hits = [hit for hit in hits if hit < tuple(values)]
+        page = hits[:per_page]
+        next_cursor = encode_cursor(list(page[-1])) if len(hits) > per_page else None
+
+        posts = {}
+        if page:
+            query = queries.with_author_and_tags(Post.query).filter(Post.id.in_([post_id for _, post_id in page]))
+            posts = {post.id: post for post in query}
+        wanted = set(terms(text))
+        items = [Hit(posts[post_id], score, highlight(posts[post_id].title, wanted),
+                     snippet(posts[post_id].content, wanted))
+                 for score, post_id in page if post_id in posts]
+        return Page(items, next_cursor)
+
+    # ---- keeping the in-process index current
+
+    def memory_index(self):
+        """The fallback index, built from the posts table the first time it's needed."""
+
+        with self.lock:
+            if self.index is None:
+                index = InvertedIndex()
+                tags = defaultdict(list)
+                for post_id, tag_id in db.session.query(PostTag.post_id, PostTag.tag_id).yield_per(10000):
+                    tags[post_id].append(tag_id)
+                rows = db.session.query(Post.id, Post.user_id, Post.title, Post.content).yield_per(1000)
+                for post_id, user_id, title, content in rows:
+                    index.add(post_id, user_id, title, content, tags.get(post_id, ()))
+                self.index = index
+            return self.index
+
+    def posts_changed(self, post_ids):
+        """Re-read posts (text, author and tags) after a commit; ids no longer there are dropped."""
+
+        if self.index is None or not post_ids:
+            return
+        post_ids = set(post_ids)
+        tags = defaultdict(list)
+        rows = db.session.query(PostTag.post_id, PostTag.tag_id).filter(PostTag.post_id.in_(post_ids))
+        for post_id, tag_id in rows:
+            tags[post_id].append(tag_id)
+        rows = db.session.query(Post.id, Post.user_id, Post.title, Post.content).filter(Post.id.in_(post_ids))
+        found = set()
+        for post_id, user_id, title, content in rows:
+            self.index.add(post_id, user_id, title, content, tags.get(post_id, ()))
+            found.add(post_id)
+        for post_id in post_ids - found:
+            self.index.discard(post_id)
+
+    def user_deleted(self, user_id):
+        if self.index is not None:
+            self.index.discard_user(user_id)
+
+    def tag_deleted(self, tag_id):
+        if self.index is not None:
+            self.index.discard_tag(tag_id)
+
+    def reset(self):
+        """Forget the in-process index; the next search rebuilds it."""
+
+        with self.lock:
+            self.index = None
@@ -1,11 +1,14 @@
-"""Seed file to make sample data for users db."""
+"""Seed file to make sample data for users db.
+
+For a production-sized dataset to load test against, use generate.py.
+"""
 
 from models import User, Post, Tag, PostTag, db
 from app import app
+from migrate import reset
 
-# Create all tables
-db.drop_all()
-db.create_all()
+# Drop all tables and rebuild them from the migrations
+reset(db.engine)
 
 # If table isn't empty, empty it
 User.query.delete()
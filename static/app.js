@@ -0,0 +1,58 @@
+// Searchable post pickers: options are fetched a page at a time from the
+// select's data-picker-url instead of rendering every post into the page.
+document.querySelectorAll("select[data-picker-url]").forEach(function (select) {
+    var url = select.dataset.pickerUrl;
+    var next = select.dataset.pickerNext;
+    var term = "";
+    var more = document.querySelector('[data-picker-more="' + select.id + '"]');
+    var timer = null;
+
+    function refresh() {
+        if (window.jQuery && jQuery.fn.selectpicker) {
+            jQuery(select).selectpicker("refresh");
+        }
+        if (more) {
+            more.hidden = !next;
+        }
+    }
+
+    function load(replace) {
+        var params = new URLSearchParams();
+        if (term) params.set("q", term);
+        if (!replace && next) params.set("after", next);
+
+        fetch(url + "?" + params.toString())
+            .then(function (resp) { return resp.json(); })
+            .then(function (data) {
+                // keep whatever the user already picked when the list is replaced
+                if (replace) {
+                    Array.from(select.options).forEach(function (option) {
+                        if (!option.selected) option.remove();
+                    });
+                }
+                data.posts.forEach(function (post) {
+                    if (document.getElementById("post_" + post.id)) return;
+                    var option = new Option(post.title, post.id);
+                    option.id = "post_" + post.id;
+                    select.add(option);
+                });
+                next = data.next;
+                refresh();
+            });
+    }
+
+    if (more) {
+        more.addEventListener("click", function () { load(false); });
+    }
+
+    // bootstrap-select renders its own search box; search on the server as the user types
+    document.addEventListener("input", function (evt) {
+        var box = evt.target.closest(".bootstrap-select");
+        if (!box || !box.contains(evt.target) || box.querySelector("select") !== select) return;
+        clearTimeout(timer);
+        timer = setTimeout(function () {
+            term = evt.target.value;
+            load(true);
+        }, 250);
+    });
+});
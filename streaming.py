@@ -0,0 +1,187 @@
+"""Streamed page rendering and on-the-fly response compression.
+
+render_template builds the whole page as one string before the first byte goes
+out. With STREAM_TEMPLATES on, stream_template renders the user and tag pages
+chunk by chunk instead: the head and heading are sent while the post list is
+still being read off a server-side cursor (readmodels' stream=True pages), so
+the browser starts on the page (and its CSS) straight away, and a list of
+STREAM_PER_PAGE posts costs no more memory than a short one.
+
+The Compressor middleware gzips or brotli-compresses (when the brotli package is
+installed) text responses for browsers that accept it, a chunk at a time and
+flushing after each, so streamed pages and the API exports still arrive as they
+are written. Responses that are already encoded (the precompressed assets) or
+too small to gain anything are left alone.
+
+A streamed page's headers go out before it is rendered, so render time and
+errors in the template body don't show up in the response's status or in the
+per-request template metrics.
+"""
+
+import zlib
+
+from flask import Response, current_app, get_flashed_messages, signals, stream_with_context
+from werkzeug.http import parse_accept_header
+
+
+class Streaming:
+    """Flask extension for streamed templates; compresses every response the app sends."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # render the user/tag pages with stream_template, listing up to STREAM_PER_PAGE posts
+        app.config.setdefault("STREAM_TEMPLATES", False)
+        app.config.setdefault("STREAM_PER_PAGE", 500)
+        # template output is sent once this much has built up
+        app.config.setdefault("STREAM_CHUNK_BYTES", 8192)
+
+        app.config.setdefault("COMPRESS_ENABLED", True)
+        app.config.setdefault("COMPRESS_MIN_BYTES", 500)
+        app.config.setdefault("COMPRESS_MIMETYPES", ["text/html", "text/css", "text/plain", "text/csv",
+                                                     "application/javascript", "application/json",
+                                                     "application/x-ndjson"])
+        # levels that keep up with rendering; the static assets are precompressed at the highest ones instead
+        app.config.setdefault("COMPRESS_GZIP_LEVEL", 6)
+        app.config.setdefault("COMPRESS_BROTLI_QUALITY", 4)
+
+        app.wsgi_app = Compressor(app.wsgi_app, app.config)
+        app.extensions["streaming"] = self
+
+    def stream_template(self, template_name, **context):
+        """A response rendering template_name as it is sent, like render_template otherwise."""
+
+        app = current_app._get_current_object()
+        template = app.jinja_env.get_or_select_template(template_name)
+        app.update_template_context(context)
+        # base.html takes the flashed messages out of the session, which is saved before the body
+        # is rendered; take them now so the cookie goes out without them
+        get_flashed_messages(with_categories=True)
+
+        def generate():
+            signals.before_render_template.send(app, template=template, context=context)
+            yield from buffered(template.generate(context), app.config["STREAM_CHUNK_BYTES"])
+            signals.template_rendered.send(app, template=template, context=context)
+
+        return Response(stream_with_context(generate()), mimetype="text/html")
+
+
+def buffered(pieces, size):
+    """Join the small pieces a template generates into chunks of about size characters."""
+
+    buffer, length = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield "".join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def encoders(config):
+    """Content-Encoding -> function making a fresh (compress, flush, finish) triple; br first, as it is preferred."""
+
+    found = {}
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        def brotli_encoder():
+            compressor = brotli.Compressor(quality=config["COMPRESS_BROTLI_QUALITY"])
+            return compressor.process, compressor.flush, compressor.finish
+        found["br"] = brotli_encoder
+
+    def gzip_encoder():
+        # wbits 31: deflate with a gzip header and trailer
+        compressor = zlib.compressobj(config["COMPRESS_GZIP_LEVEL"], zlib.DEFLATED, 31)
+        return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+    found["gzip"] = gzip_encoder
+    return found
+
+
+class Compressor:
+    """WSGI middleware compressing text responses with the encoding the client prefers."""
+
+    def __init__(self, wsgi_app, config):
+        self.wsgi_app = wsgi_app
+        self.config = config
+        self.encoders = encoders(config)
+
+    def negotiate(self, environ):
+        """The encoding to use for this request, or None."""
+
+        if not self.config["COMPRESS_ENABLED"] or environ["REQUEST_METHOD"] == "HEAD":
+            return None
+        accepted = parse_accept_header(environ.get("HTTP_ACCEPT_ENCODING"))
+        # max keeps the first of equally weighted encodings, so br wins ties
+        best = max(self.encoders, key=lambda encoding: accepted[encoding])
+        return best if accepted[best] > 0 else None
+
+    def compressible(self, status, headers):
+        code = int(status.split(" ", 1)[0])
+        mimetype = headers.get("Content-Type", "").split(";")[0].strip()
+        length = headers.get("Content-Length")
+        return (200 <= code < 300 and code not in (204, 206)
+                and mimetype in self.config["COMPRESS_MIMETYPES"]
+                and "Content-Encoding" not in headers
+                and "no-transform" not in headers.get("Cache-Control", "")
+                and (length is None or int(length) >= self.config["COMPRESS_MIN_BYTES"]))
+
+    def __call__(self, environ, start_response):
+        encoding = self.negotiate(environ)
+        if encoding is None:
+            return self.wsgi_app(environ, start_response)
+
+        # whether the app has started the response, and the compressor's functions if it is compressed
+        started, chosen = [], []
+
+        def start_compressed(status, headers, exc_info=None):
+            started.append(True)
+            lookup = {name.title(): value for name, value in headers}
+            if not self.compressible(status, lookup):
+                return start_response(status, headers, exc_info)
+
+            compress, flush, finish = self.encoders[encoding]()
+            chosen.append((compress, flush, finish))
+            vary = [value.strip() for value in lookup.get("Vary", "").split(",") if value.strip()]
+            headers = [(name, value) for name, value in headers if name.title() not in ("Content-Length", "Vary")]
+            # the compressed bytes differ from the page's, so its validator can only be a weak one
+            headers = [(name, f"W/{value}" if name.title() == "Etag" and not value.startswith("W/") else value)
+                       for name, value in headers]
+            headers += [("Vary", ", ".join(vary + ["Accept-Encoding"])), ("Content-Encoding", encoding)]
+            write = start_response(status, headers, exc_info)
+            return lambda data: write(compress(data) + flush())
+
+        body = self.wsgi_app(environ, start_compressed)
+        if started and not chosen:
+            # Flask starts the response before handing back its body: anything not compressed passes
+            # through untouched, and file responses keep their wsgi.file_wrapper
+            return body
+        return self.compressed(body, chosen)
+
+    @staticmethod
+    def compressed(body, chosen):
+        """body, compressed chunk by chunk if start_response chose an encoding for it."""
+
+        try:
+            for chunk in body:
+                if not chosen:
+                    yield chunk
+                    continue
+                if not chunk:
+                    continue
+                compress, flush, _ = chosen[0]
+                # flushing after every chunk sends what has been rendered so far, not just full blocks
+                data = compress(chunk) + flush()
+                if data:
+                    yield data
+            if chosen:
+                yield chosen[0][2]()
+        finally:
+            if hasattr(body, "close"):
+                body.close()
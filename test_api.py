@@ -0,0 +1,134 @@
+import csv
+import io
+import json
+from unittest import TestCase
+
+from app import app
+from models import db, User, Post, Tag, PostTag
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///test_db'
+app.config['SQLALCHEMY_ECHO'] = False
+
+# Make Flask errors be real errors, rather than HTML pages with error info
+app.config['TESTING'] = True
+
+# Fail the request if a template lazy loads a relationship
+app.config['RAISE_ON_LAZY_LOAD'] = True
+
+# Render every page fresh; test_cache.py turns the page cache on for its own tests
+app.config['PAGE_CACHE_ENABLED'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class ApiTestCase(TestCase):
+    """Tests for the /api/v1 read API and its exports."""
+
+    def setUp(self):
+        """Add two users, a few posts and tags."""
+
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+
+        april = User(first_name='April', last_name='Ludgate')
+        andy = User(first_name='Andy', last_name='Dwyer')
+        tags = [Tag(name='music'), Tag(name='dogs')]
+        db.session.add_all([april, andy, *tags])
+        db.session.commit()
+        posts = [Post(title=f'Post {i}', content='Content', user_id=april.id, tags=tags[:i % 3]) for i in range(7)]
+        posts.append(Post(title='Mouse Rat', content='Songs, "live"', user_id=andy.id, tags=[tags[0]]))
+        db.session.add_all(posts)
+        db.session.commit()
+
+        self.april_id = april.id
+        self.andy_id = andy.id
+        self.tag_ids = [tag.id for tag in tags]
+
+    def tearDown(self):
+        """Clean up this test's rows."""
+
+        db.session.rollback()
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def all_pages(self, client, url, key):
+        items, after = [], ""
+        while True:
+            resp = client.get(f"{url}&after={after}")
+            self.assertEqual(resp.status_code, 200)
+            items += resp.json[key]
+            after = resp.json["next"]
+            if not after:
+                return items
+
+    def test_list_posts_pages_through_everything(self):
+        with app.test_client() as client:
+            posts = self.all_pages(client, "/api/v1/posts?limit=3", "posts")
+
+            self.assertEqual(len(posts), 8)
+            self.assertEqual(len({post["id"] for post in posts}), 8)
+            mouse_rat = next(post for post in posts if post["title"] == "Mouse Rat")
+            self.assertEqual(mouse_rat["tags"], ["music"])
+
+    def test_list_posts_filters(self):
+        with app.test_client() as client:
+            by_andy = client.get(f"/api/v1/posts?user={self.andy_id}").json["posts"]
+            music = client.get(f"/api/v1/posts?tag={self.tag_ids[0]}").json["posts"]
+
+            self.assertEqual([post["title"] for post in by_andy], ["Mouse Rat"])
+            self.assertEqual(len(music), 5)
+
+    def test_users_and_tags(self):
+        with app.test_client() as client:
+            users = self.all_pages(client, "/api/v1/users?limit=1", "users")
+            tag = client.get(f"/api/v1/tags/{self.tag_ids[1]}").json
+
+            self.assertEqual([user["first_name"] for user in users], ["April", "Andy"])
+            self.assertEqual(tag, {"id": self.tag_ids[1], "name": "dogs"})
+
+    def test_missing_is_json_404(self):
+        with app.test_client() as client:
+            resp = client.get("/api/v1/posts/0")
+
+            self.assertEqual(resp.status_code, 404)
+            self.assertEqual(resp.json, {"error": "not found"})
+
+    def test_ndjson_export(self):
+        with app.test_client() as client:
+            resp = client.get("/api/v1/posts/export")
+            rows = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+
+            self.assertEqual(resp.mimetype, "application/x-ndjson")
+            self.assertEqual(len(rows), 8)
+            self.assertEqual([row["id"] for row in rows], sorted(row["id"] for row in rows))
+            by_title = {row["title"]: row for row in rows}
+            self.assertEqual(sorted(by_title["Post 2"]["tags"]), ["dogs", "music"])
+            self.assertEqual(by_title["Post 0"]["tags"], [])
+
+    def test_csv_export(self):
+        with app.test_client() as client:
+            resp = client.get("/api/v1/posts/export?format=csv")
+            rows = list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+
+            self.assertEqual(resp.mimetype, "text/csv")
+            self.assertEqual(len(rows), 8)
+            by_title = {row["title"]: row for row in rows}
+            self.assertEqual(by_title["Mouse Rat"]["content"], 'Songs, "live"')
+            self.assertEqual(by_title["Mouse Rat"]["tags"], "music")
+            self.assertIn(by_title["Post 2"]["tags"], ["music|dogs", "dogs|music"])
+
+    def test_bad_export_format(self):
+        with app.test_client() as client:
+            resp = client.get("/api/v1/users/export?format=xml")
+
+            self.assertEqual(resp.status_code, 400)
@@ -0,0 +1,191 @@
+import asyncio
+import gzip
+import threading
+from unittest import TestCase
+
+from flask import template_rendered
+from sqlalchemy import event
+
+from app import app, page_cache
+from asgi import AsyncReads
+from models import db, User, Post, Tag, PostTag
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///test_db'
+app.config['SQLALCHEMY_ECHO'] = False
+
+# Make Flask errors be real errors, rather than HTML pages with error info
+app.config['TESTING'] = True
+
+# Fail loudly if a template reaches for something its async view didn't load
+app.config['RAISE_ON_LAZY_LOAD'] = True
+
+# Render every page fresh; the ETag test turns the page cache on for itself
+app.config['PAGE_CACHE_ENABLED'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class AsyncReadsTestCase(TestCase):
+    """Tests for the async read path, against the pages the sync views render."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.loop = asyncio.new_event_loop()
+        cls.reads = AsyncReads(app)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loop.run_until_complete(cls.reads.engine.dispose())
+        cls.loop.close()
+
+    def setUp(self):
+        """A user with tagged posts, and a second user."""
+
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+
+        user, other, tag = User(first_name='Ann', last_name='Perkins'), User(first_name='Chris', last_name='Traeger'), \
+            Tag(name='pawnee')
+        db.session.add_all([user, other, tag])
+        db.session.commit()
+        db.session.add_all([Post(title=f"Note {i}", content="Literally", user_id=user.id, tags=[tag]) for i in range(60)])
+        db.session.commit()
+        self.user_id, self.tag_id = user.id, tag.id
+        self.post_id = Post.query.filter_by(title="Note 7").one().id
+
+    def tearDown(self):
+        """Page cache back off, and clean up this test's rows."""
+
+        app.config['PAGE_CACHE_ENABLED'] = False
+        db.session.rollback()
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def request(self, url, method="GET", headers=(), body=b""):
+        """(status, headers, body) of url as served by the ASGI app."""
+
+        path, _, query = url.partition("?")
+        scope = {"type": "http", "http_version": "1.1", "method": method, "scheme": "http",
+                 "path": path, "root_path": "", "query_string": query.encode(),
+                 "headers": [(name.lower().encode(), value.encode()) for name, value in headers],
+                 "server": ("localhost", 80), "client": ("127.0.0.1", 5000)}
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        self.loop.run_until_complete(self.reads(scope, receive, send))
+        start = messages[0]
+        response_headers = {name.decode().title(): value.decode() for name, value in start["headers"]}
+        return start["status"], response_headers, b"".join(m.get("body", b"") for m in messages[1:])
+
+    def test_pages_match_sync_views(self):
+        urls = ["/", "/users", f"/users/{self.user_id}", f"/posts/{self.post_id}", "/tags", "/tags?sort=popular",
+                f"/tags/{self.tag_id}"]
+        with app.test_client() as client:
+            for url in urls:
+                status, _, body = self.request(url)
+                self.assertEqual(status, 200, url)
+                self.assertEqual(body, client.get(url).data, url)
+
+    def test_pages_follow_cursor(self):
+        _, _, first = self.request(f"/users/{self.user_id}")
+        cursor = first.decode().split(f'/users/{self.user_id}?after=')[1].split('"')[0]
+        _, _, second = self.request(f"/users/{self.user_id}?after={cursor}")
+
+        self.assertEqual(first.count(b'href="/posts/'), 50)
+        self.assertEqual(second.count(b'href="/posts/'), 10)
+        with app.test_client() as client:
+            self.assertEqual(second, client.get(f"/users/{self.user_id}?after={cursor}").data)
+
+    def test_other_requests_go_to_flask(self):
+        missing = self.request("/users/0")
+        api = self.request(f"/api/v1/users/{self.user_id}")
+        export = self.request("/api/v1/posts/export?format=ndjson")
+        added = self.request("/users/new", "POST", [("Content-Type", "application/x-www-form-urlencoded")],
+                             b"first_name=Ron&last_name=Swanson&img_url=")
+
+        self.assertEqual(missing[0], 404)
+        self.assertEqual(api[0], 200)
+        self.assertIn(b'"first_name":"Ann"', api[2].replace(b" ", b""))
+        # streamed from the thread it runs in, a line per post
+        self.assertEqual(export[2].count(b"\n"), 60)
+        self.assertEqual(added[0], 302)
+        self.assertEqual(User.query.filter_by(last_name="Swanson").count(), 1)
+
+    def test_missing_rows_are_404s(self):
+        statements = []
+        record = lambda *args: statements.append(args[2])
+        with app.test_client() as client:
+            for url in [f"/posts/{self.post_id + 1000}", "/users/0", "/tags/0"]:
+                # answered here, not looked up again by the Flask app
+                event.listen(db.engine, "before_cursor_execute", record)
+                try:
+                    status, _, body = self.request(url)
+                finally:
+                    event.remove(db.engine, "before_cursor_execute", record)
+                self.assertEqual(status, 404, url)
+                self.assertEqual(body, client.get(url).data, url)
+        self.assertEqual(statements, [])
+
+    def test_templates_render_off_the_event_loop(self):
+        threads = []
+        record = lambda sender, template, context, **extra: threads.append(threading.get_ident())
+        template_rendered.connect(record, app)
+        try:
+            for url in ["/", "/users", f"/users/{self.user_id}", f"/posts/{self.post_id}", "/tags",
+                        f"/tags/{self.tag_id}"]:
+                self.assertEqual(self.request(url)[0], 200, url)
+        finally:
+            template_rendered.disconnect(record, app)
+
+        self.assertTrue(threads)
+        self.assertNotIn(threading.get_ident(), threads)
+
+    def test_independent_reads_run_at_once(self):
+        in_use, most = [0], [0]
+
+        def checkout(*args):
+            in_use[0] += 1
+            most[0] = max(most[0], in_use[0])
+
+        def checkin(*args):
+            in_use[0] -= 1
+
+        pool = self.reads.engine.sync_engine.pool
+        event.listen(pool, "checkout", checkout)
+        event.listen(pool, "checkin", checkin)
+        try:
+            self.request(f"/users/{self.user_id}")
+        finally:
+            event.remove(pool, "checkout", checkout)
+            event.remove(pool, "checkin", checkin)
+
+        # the user and their posts are read on two connections at the same time
+        self.assertGreaterEqual(most[0], 2)
+
+    def test_etag_and_compression(self):
+        app.config['PAGE_CACHE_ENABLED'] = True
+        page_cache.clear()
+        url = f"/tags/{self.tag_id}"
+        status, headers, body = self.request(url)
+        unchanged = self.request(url, headers=[("If-None-Match", headers["Etag"])])
+        gzipped = self.request(url, headers=[("Accept-Encoding", "gzip")])
+
+        self.assertEqual(status, 200)
+        self.assertEqual(unchanged[0], 304)
+        self.assertEqual(gzipped[1]["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(gzipped[2]), body)
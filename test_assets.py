@@ -0,0 +1,120 @@
+import gzip
+import io
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import brotli
+
+from app import app, assets
+from assets import AssetError, build, MANIFEST, vendor
+from models import db
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///test_db'
+app.config['SQLALCHEMY_ECHO'] = False
+
+# Make Flask errors be real errors, rather than HTML pages with error info
+app.config['TESTING'] = True
+
+# Render every page fresh; test_cache.py turns the page cache on for its own tests
+app.config['PAGE_CACHE_ENABLED'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+CSS = b".profile-pic {\n\theight: 125px;\n}\n" * 20
+
+
+class AssetsTestCase(TestCase):
+    """Tests for the fingerprinted, precompressed assets."""
+
+    def setUp(self):
+        """A static/ with two assets, built into a temporary dist/."""
+
+        self.static = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.static, "vendor"))
+        with open(os.path.join(self.static, "app.css"), "wb") as f:
+            f.write(CSS)
+        with open(os.path.join(self.static, "vendor", "lib.js"), "wb") as f:
+            f.write(b"x")
+        self.dist = os.path.join(self.static, "dist")
+        self.manifest = build(self.static, names=["app.css", "vendor/lib.js", "vendor/absent.js"], out=io.StringIO())
+
+        app.config['ASSETS_DIR'] = self.dist
+        assets.load(os.path.join(self.dist, MANIFEST))
+
+    def tearDown(self):
+        """Back to linking static/ itself, as the dev profile does."""
+
+        app.config['ASSETS_DIR'] = os.path.join(app.static_folder, "dist")
+        assets.manifest = {}
+        shutil.rmtree(self.static)
+
+    def test_build_fingerprints_and_compresses(self):
+        built = self.manifest["app.css"]
+        self.assertRegex(built, r"^app\.[0-9a-f]{12}\.css$")
+        self.assertNotIn("vendor/absent.js", self.manifest)
+
+        with open(os.path.join(self.dist, built + ".gz"), "rb") as f:
+            self.assertEqual(gzip.decompress(f.read()), CSS)
+        with open(os.path.join(self.dist, built + ".br"), "rb") as f:
+            self.assertEqual(brotli.decompress(f.read()), CSS)
+        # one byte doesn't get smaller, so it has no variants
+        self.assertFalse(os.path.exists(os.path.join(self.dist, self.manifest["vendor/lib.js"] + ".gz")))
+
+        with open(os.path.join(self.static, "app.css"), "ab") as f:
+            f.write(b"/* changed */")
+        rebuilt = build(self.static, names=["app.css"], out=io.StringIO())
+        self.assertNotEqual(rebuilt["app.css"], built)
+        # the old build stays for pages that still link it
+        self.assertTrue(os.path.exists(os.path.join(self.dist, built)))
+
+    def test_served_with_accepted_encoding(self):
+        url = f"/assets/{self.manifest['app.css']}"
+        with app.test_client() as client:
+            br = client.get(url, headers={"Accept-Encoding": "gzip, deflate, br"})
+            gz = client.get(url, headers={"Accept-Encoding": "gzip"})
+            plain = client.get(url, headers={"Accept-Encoding": "br;q=0"})
+
+        self.assertEqual(br.headers["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(br.data), CSS)
+        self.assertEqual(gz.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(gz.data), CSS)
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertEqual(plain.data, CSS)
+        for resp in (br, gz, plain):
+            self.assertEqual(resp.mimetype, "text/css")
+            self.assertIn("immutable", resp.headers["Cache-Control"])
+            self.assertIn("max-age=31536000", resp.headers["Cache-Control"])
+            self.assertIn("Accept-Encoding", resp.headers["Vary"])
+
+    def test_only_built_files_served(self):
+        with app.test_client() as client:
+            for path in [MANIFEST, self.manifest["app.css"] + ".gz", "app.css", "../app.css"]:
+                self.assertEqual(client.get(f"/assets/{path}").status_code, 404, path)
+
+    def test_pages_link_built_files(self):
+        with app.test_client() as client:
+            html = client.get("/users").get_data(as_text=True)
+
+        self.assertIn(f'href="/assets/{self.manifest["app.css"]}"', html)
+        self.assertNotIn("/static/app.css", html)
+
+    def test_without_manifest_links_sources(self):
+        assets.load(os.path.join(self.static, "missing.json"))
+        with app.test_request_context():
+            self.assertEqual(assets.url("app.css"), "/static/app.css")
+            self.assertTrue(assets.url("vendor/bootstrap.min.js").startswith(("https://", "/static/vendor/")))
+
+    def test_vendor_refuses_unpinned_files(self):
+        entries = {"vendor/lib.js": ("https://cdn.example.com/lib.js", "sha384-x"),
+                   "vendor/other.js": ("https://cdn.example.com/other.js", None)}
+        with self.assertRaisesRegex(AssetError, "vendor/other.js: no integrity hash"):
+            vendor(self.static, entries, out=io.StringIO())
+        with open(os.path.join(self.static, "vendor", "lib.js"), "rb") as f:
+            self.assertEqual(f.read(), b"x")
@@ -0,0 +1,241 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+
+from PIL import Image
+
+import avatars as avatar_store
+from app import app, avatars
+from avatars import AvatarError, SIZES, backfill
+from models import db, User, Post, Tag, PostTag, Avatar
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///test_db'
+app.config['SQLALCHEMY_ECHO'] = False
+
+# Make Flask errors be real errors, rather than HTML pages with error info
+app.config['TESTING'] = True
+
+# Render every page fresh; test_cache.py turns the page cache on for its own tests
+app.config['PAGE_CACHE_ENABLED'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+def png(color, size=(400, 300)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class ImageHost(BaseHTTPRequestHandler):
+    """Stand-in for a remote image host: serves files by path, with ETags, and counts downloads."""
+
+    files = {}
+    downloads = []
+
+    def do_GET(self):
+        if self.path == "/moved":
+            self.send_response(302)
+            self.send_header("Location", "/leslie.png")
+            self.end_headers()
+            return
+        if self.path not in self.files:
+            self.send_error(404)
+            return
+        body = self.files[self.path]
+        etag = f'"{hash(body)}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.downloads.append(self.path)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class AvatarTestCase(TestCase):
+    """Tests for the local avatar store."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), ImageHost)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        """An empty store in a temporary directory, and the local host allowed."""
+
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+        Avatar.query.delete()
+        db.session.commit()
+
+        self.dir = tempfile.mkdtemp()
+        app.config['AVATAR_DIR'] = self.dir
+        app.config['AVATAR_ALLOW_PRIVATE_HOSTS'] = True
+        ImageHost.files = {"/leslie.png": png("green"), "/notes.txt": b"not an image"}
+        ImageHost.downloads = []
+
+    def tearDown(self):
+        """Back to the defaults, and clean up this test's rows and files."""
+
+        app.config['AVATAR_DIR'] = os.path.join(app.instance_path, "avatars")
+        app.config['AVATAR_ALLOW_PRIVATE_HOSTS'] = False
+        db.session.rollback()
+        User.query.delete()
+        Avatar.query.delete()
+        db.session.commit()
+        shutil.rmtree(self.dir)
+
+    def add_user(self, client, **data):
+        data = {"first_name": "Leslie", "last_name": "Knope", "img_url": "", **data}
+        client.post("/users/new", data=data, content_type="multipart/form-data")
+        return User.query.filter_by(last_name="Knope").order_by(User.id.desc()).first()
+
+    def test_url_fetched_once_and_served_resized(self):
+        with app.test_client() as client:
+            user = self.add_user(client, img_url=self.base + "/leslie.png")
+            self.add_user(client, img_url=self.base + "/leslie.png")
+
+            self.assertEqual(ImageHost.downloads, ["/leslie.png"])
+            html = client.get(f"/users/{user.id}").get_data(as_text=True)
+            self.assertIn(f'src="/avatars/{user.avatar_hash}-{SIZES["profile"]}.webp"', html)
+
+            resp = client.get(f"/avatars/{user.avatar_hash}-{SIZES['thumb']}.webp")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.mimetype, "image/webp")
+            self.assertIn("immutable", resp.headers["Cache-Control"])
+            self.assertIn("max-age=31536000", resp.headers["Cache-Control"])
+            self.assertEqual(Image.open(io.BytesIO(resp.data)).size, (SIZES['thumb'], SIZES['thumb']))
+
+            self.assertEqual(client.get(f"/avatars/{user.avatar_hash}-999.webp").status_code, 404)
+            self.assertEqual(client.get(f"/avatars/{'../' * 3}-48.webp").status_code, 404)
+
+    def test_upload(self):
+        with app.test_client() as client:
+            upload = (io.BytesIO(png("red")), "me.png")
+            user = self.add_user(client, img_file=upload)
+
+            self.assertIsNotNone(user.avatar_hash)
+            self.assertEqual(ImageHost.downloads, [])
+            resp = client.get(f"/avatars/{user.avatar_hash}-{SIZES['profile']}.webp")
+            red, green, blue = Image.open(io.BytesIO(resp.data)).convert("RGB").getpixel((10, 10))
+            self.assertGreater(red, 200)
+            self.assertLess(green + blue, 50)
+
+    def test_default_avatar_is_local(self):
+        with app.test_client() as client:
+            user = self.add_user(client)
+
+            self.assertEqual(user.img_url, User.url)
+            self.assertIsNotNone(user.avatar_hash)
+            html = client.get("/users").get_data(as_text=True)
+            self.assertIn(f'/avatars/{user.avatar_hash}-{SIZES["thumb"]}.webp', html)
+
+    def test_bad_images_fall_back_to_the_url(self):
+        with app.test_client() as client:
+            url = self.base + "/notes.txt"
+            user = self.add_user(client, img_url=url)
+
+            self.assertIsNone(user.avatar_hash)
+            html = client.get(f"/users/{user.id}").get_data(as_text=True)
+            self.assertIn(f'src="{url}"', html)
+
+    def test_edit_keeps_avatar_unless_image_changes(self):
+        with app.test_client() as client:
+            user = self.add_user(client, img_url=self.base + "/leslie.png")
+            user_id, stored = user.id, user.avatar_hash
+            Avatar.query.delete()
+            db.session.commit()
+
+            def edit(**data):
+                data = {"first_name": "Leslie", "last_name": "Knope", **data}
+                client.post(f"/users/{user_id}/edit", data=data, content_type="multipart/form-data")
+                return User.query.get(user_id)
+
+            # an unchanged img_url isn't fetched again
+            self.assertEqual(edit(img_url=self.base + "/leslie.png").avatar_hash, stored)
+            self.assertEqual(ImageHost.downloads, ["/leslie.png"])
+
+            # an image that can't be stored, or a host that is refused, leaves the stored one
+            self.assertEqual(edit(img_url=self.base + "/notes.txt").avatar_hash, stored)
+            app.config['AVATAR_ALLOW_PRIVATE_HOSTS'] = False
+            self.assertEqual(edit(img_url=self.base + "/other.png").avatar_hash, stored)
+
+            user = edit(img_url=self.base + "/notes.txt", img_file=(io.BytesIO(png("red")), "me.png"))
+            self.assertNotEqual(user.avatar_hash, stored)
+            self.assertIsNotNone(user.avatar_hash)
+
+    def test_refresh_downloads_only_changed_images(self):
+        with app.app_context():
+            url = self.base + "/leslie.png"
+            first = avatars.ingest_url(url)
+            db.session.commit()
+            avatar = Avatar.query.get(url)
+
+            self.assertEqual(avatars.refresh(avatar), first)
+            ImageHost.files["/leslie.png"] = png("blue")
+            second = avatars.refresh(avatar)
+
+        self.assertNotEqual(second, first)
+        self.assertEqual(ImageHost.downloads, ["/leslie.png", "/leslie.png"])
+
+    def test_redirects_and_hosts_checked(self):
+        with app.app_context():
+            self.assertEqual(avatars.ingest_url(self.base + "/moved"), avatars.ingest_url(self.base + "/leslie.png"))
+
+            app.config['AVATAR_ALLOW_PRIVATE_HOSTS'] = False
+            with self.assertRaises(AvatarError):
+                avatars.ingest_url(self.base + "/other.png")
+            with self.assertRaises(AvatarError):
+                avatars.ingest_url("file:///etc/passwd")
+            db.session.rollback()
+
+    def test_address_checked_again_on_connect(self):
+        # a host that resolved to a public address for the check, and to this one for the fetch
+        public_host, avatar_store.public_host = avatar_store.public_host, lambda hostname: True
+        try:
+            app.config['AVATAR_ALLOW_PRIVATE_HOSTS'] = False
+            with app.app_context():
+                with self.assertRaisesRegex(AvatarError, "won't fetch images from 127.0.0.1"):
+                    avatars.ingest_url(self.base + "/leslie.png")
+                db.session.rollback()
+        finally:
+            avatar_store.public_host = public_host
+        self.assertEqual(ImageHost.downloads, [])
+
+    def test_backfill_fetches_each_url_once(self):
+        url = self.base + "/leslie.png"
+        db.session.add_all([User(first_name=name, last_name="Knope", img_url=url) for name in ["Leslie", "Marlene"]])
+        db.session.add(User(first_name="Ann", last_name="Perkins", img_url=self.base + "/missing.png"))
+        db.session.commit()
+        with app.app_context():
+            updated, failed = backfill(avatars)
+
+        self.assertEqual(updated, 2)
+        self.assertEqual([url for url, _ in failed], [self.base + "/missing.png"])
+        self.assertEqual(ImageHost.downloads, ["/leslie.png"])
+        self.assertEqual(User.query.filter(User.avatar_hash.isnot(None)).count(), 2)
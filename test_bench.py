@@ -0,0 +1,105 @@
+import io
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from app import app
+from models import db, User, Post, Tag, PostTag
+from bench import benchmark, percentile, regressions
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///test_db'
+app.config['SQLALCHEMY_ECHO'] = False
+
+# Make Flask errors be real errors, rather than HTML pages with error info
+app.config['TESTING'] = True
+
+# Render every page fresh; test_cache.py turns the page cache on for its own tests
+app.config['PAGE_CACHE_ENABLED'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class RegressionTestCase(TestCase):
+    """Tests for the baseline comparison."""
+
+    def result(self, p95, queries=2):
+        return {"p50_ms": p95, "p95_ms": p95, "p99_ms": p95, "rps": 1, "requests": 1, "queries_per_request": queries}
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([], 95), 0.0)
+
+    def test_slowdown_beyond_threshold(self):
+        baseline = {"routes": {"root": self.result(10), "show_post": self.result(10)}}
+        current = {"routes": {"root": self.result(11.9), "show_post": self.result(12.1)}}
+
+        found = regressions(baseline, current, threshold=20)
+        self.assertEqual(len(found), 1)
+        self.assertTrue(found[0].startswith("show_post"))
+
+    def test_more_queries_is_a_regression(self):
+        baseline = {"routes": {"root": self.result(10, queries=2)}}
+        current = {"routes": {"root": self.result(10, queries=7)}}
+
+        self.assertEqual(len(regressions(baseline, current, threshold=20)), 1)
+
+
+class BenchmarkTestCase(TestCase):
+    """Smoke test: drive a few routes in-process."""
+
+    def setUp(self):
+        """Add a user with a tagged post."""
+
+        user = User(first_name='Tom', last_name="Haverford")
+        tag = Tag(name='treat yo self')
+        db.session.add_all([user, tag])
+        db.session.commit()
+        db.session.add(Post(title='Treat', content='Yo self', user_id=user.id, tags=[tag]))
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up any fouled transaction and this test's rows."""
+
+        db.session.rollback()
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def test_routes_report_latency_and_queries(self):
+        results = benchmark(app, requests=5, warmup=1, routes=["root", "show_post", "delete_tag"], out=io.StringIO())
+
+        self.assertEqual(set(results), {"root", "show_post", "delete_tag"})
+        self.assertEqual(results["show_post"]["requests"], 5)
+        # posts with authors, their tags, and the page's validator (see cache.py)
+        self.assertEqual(results["root"]["queries_per_request"], 3)
+        self.assertLessEqual(results["root"]["p50_ms"], results["root"]["p99_ms"])
+
+    def test_later_routes_and_skips(self):
+        app.config['AVATAR_DIR'] = avatar_dir = tempfile.mkdtemp()
+        # as if no assets were built
+        assets = app.extensions['assets']
+        manifest, assets.manifest = assets.manifest, {}
+        try:
+            out = io.StringIO()
+            results = benchmark(app, requests=3, warmup=1, out=out,
+                                routes=["api_post", "export_posts", "import_tags", "avatar", "asset"])
+        finally:
+            app.config['AVATAR_DIR'] = os.path.join(app.instance_path, "avatars")
+            shutil.rmtree(avatar_dir)
+            assets.manifest = manifest
+
+        self.assertEqual(set(results), {"api_post", "export_posts", "import_tags", "avatar"})
+        self.assertIn("asset                skipped", out.getvalue())
+        self.assertEqual(results["import_tags"]["requests"], 3)
+        self.assertEqual(Tag.query.filter_by(name="bench").count(), 4)
@@ -0,0 +1,250 @@
+from unittest import TestCase
+
+from flask import template_rendered
+from sqlalchemy import event
+
+from app import app, page_cache
+from models import db, User, Post, Tag, PostTag
+from cache import PageCache, MemoryBackend, SharedBackend, LocalClient, keys_for_post
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///test_db'
+app.config['SQLALCHEMY_ECHO'] = False
+
+# Make Flask errors be real errors, rather than HTML pages with error info
+app.config['TESTING'] = True
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class BackendTestCase(TestCase):
+    """Tests for the cache backends."""
+
+    def test_lru_evicts_least_recently_used(self):
+        backend = MemoryBackend(max_entries=2, ttl=60)
+        backend.set("a", "1")
+        backend.set("b", "2")
+        backend.get("a")
+        backend.set("c", "3")
+
+        self.assertEqual(backend.get("a"), "1")
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.get("c"), "3")
+
+    def test_expired_entries_are_misses(self):
+        backend = MemoryBackend(max_entries=2, ttl=-1)
+        backend.set("a", "1")
+
+        self.assertIsNone(backend.get("a"))
+
+    def test_shared_backend_on_local_client(self):
+        client = LocalClient()
+        first, second = SharedBackend(client), SharedBackend(client)
+        first.set("home", "<h1>hi</h1>")
+
+        self.assertEqual(second.get("home"), "<h1>hi</h1>")
+        second.delete_many(["home"])
+        self.assertIsNone(first.get("home"))
+
+
+class PageCacheTestCase(TestCase):
+    """Cached pages are served until a write handler invalidates them."""
+
+    def setUp(self):
+        """Add a user with a tagged post and turn the cache on."""
+
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+
+        user = User(first_name='Ron', last_name="Swanson")
+        tag = Tag(name='meat')
+        db.session.add_all([user, tag])
+        db.session.commit()
+        post = Post(title='Bacon', content='Eggs', user_id=user.id, tags=[tag])
+        db.session.add(post)
+        db.session.commit()
+
+        self.user_id = user.id
+        self.tag_id = tag.id
+        self.post_id = post.id
+
+        app.config['PAGE_CACHE_ENABLED'] = True
+        page_cache.clear()
+
+    def tearDown(self):
+        """Clean up this test's rows and turn the cache back off."""
+
+        db.session.rollback()
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+        db.session.commit()
+        app.config['PAGE_CACHE_ENABLED'] = False
+
+    def test_page_served_from_cache(self):
+        with app.test_client() as client:
+            client.get(f"/posts/{self.post_id}")
+            # changed behind the app's back, so the cached copy is still served
+            Post.query.filter_by(id=self.post_id).update({"title": "Tofu"})
+            db.session.commit()
+            html = client.get(f"/posts/{self.post_id}").get_data(as_text=True)
+
+            self.assertIn("Bacon", html)
+
+    def test_edit_post_invalidates_pages(self):
+        with app.test_client() as client:
+            for url in ["/", f"/posts/{self.post_id}", f"/tags/{self.tag_id}", f"/users/{self.user_id}"]:
+                client.get(url)
+
+            d = {"title": "Tofu", "content": "Eggs", "tag_group": []}
+            client.post(f"/posts/{self.post_id}/edit", data=d)
+            # consume the flash message so the pages are cacheable again
+            client.get(f"/users/{self.user_id}")
+
+            self.assertIn("Tofu", client.get("/").get_data(as_text=True))
+            self.assertIn("Tofu", client.get(f"/posts/{self.post_id}").get_data(as_text=True))
+            self.assertNotIn("Bacon", client.get(f"/tags/{self.tag_id}").get_data(as_text=True))
+
+    def test_write_in_another_worker_invalidates_page(self):
+        # a second worker: its own in-process cache, the same page_versions
+        other = PageCache()
+        other.backend = MemoryBackend()
+        with app.test_client() as client:
+            before = client.get(f"/posts/{self.post_id}")
+            Post.query.filter_by(id=self.post_id).update({"title": "Tofu"})
+            db.session.commit()
+            other.invalidate(keys_for_post(self.post_id, self.user_id))
+
+            after = client.get(f"/posts/{self.post_id}")
+            revalidated = client.get(f"/posts/{self.post_id}", headers={"If-None-Match": after.headers["ETag"]})
+            stale = client.get(f"/posts/{self.post_id}", headers={"If-None-Match": before.headers["ETag"]})
+
+            self.assertNotEqual(after.headers["ETag"], before.headers["ETag"])
+            self.assertIn("Tofu", after.get_data(as_text=True))
+            self.assertEqual(revalidated.status_code, 304)
+            self.assertEqual(stale.status_code, 200)
+
+    def test_edit_tag_invalidates_post_page(self):
+        with app.test_client() as client:
+            client.get(f"/posts/{self.post_id}")
+            client.post(f"/tags/{self.tag_id}/edit", data={"name": "bacon"})
+            client.get("/tags")
+
+            self.assertIn("bacon", client.get(f"/posts/{self.post_id}").get_data(as_text=True))
+
+
+class ConditionalGetTestCase(TestCase):
+    """The cached routes answer a request for an unchanged page with 304."""
+
+    def setUp(self):
+        """Add a user with a tagged post; the page cache stays off."""
+
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+
+        user = User(first_name='Leslie', last_name="Knope")
+        tag = Tag(name='waffles')
+        db.session.add_all([user, tag])
+        db.session.commit()
+        post = Post(title="JJ's", content='Diner', user_id=user.id, tags=[tag])
+        db.session.add(post)
+        db.session.commit()
+
+        self.user_id = user.id
+        self.tag_id = tag.id
+        self.post_id = post.id
+
+    def tearDown(self):
+        """Clean up this test's rows."""
+
+        db.session.rollback()
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def test_unchanged_page_is_not_rendered(self):
+        with app.test_client() as client:
+            first = client.get(f"/posts/{self.post_id}")
+            self.assertIsNotNone(first.headers.get("ETag"))
+            self.assertIsNotNone(first.last_modified)
+            self.assertIn("no-cache", first.headers["Cache-Control"])
+
+            statements, rendered = [], []
+
+            def count_statement(*args):
+                statements.append(args)
+
+            def count_render(*args, **kwargs):
+                rendered.append(args)
+
+            event.listen(db.engine, "before_cursor_execute", count_statement)
+            template_rendered.connect(count_render, app)
+            try:
+                again = client.get(f"/posts/{self.post_id}", headers={"If-None-Match": first.headers["ETag"]})
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count_statement)
+                template_rendered.disconnect(count_render, app)
+
+            self.assertEqual(again.status_code, 304)
+            self.assertEqual(again.get_data(), b"")
+            self.assertEqual(len(statements), 1)
+            self.assertEqual(rendered, [])
+
+    def test_if_modified_since(self):
+        with app.test_client() as client:
+            first = client.get(f"/users/{self.user_id}")
+            again = client.get(f"/users/{self.user_id}", headers={"If-Modified-Since": first.headers["Last-Modified"]})
+
+            self.assertEqual(again.status_code, 304)
+
+    def test_writes_change_the_validators(self):
+        with app.test_client() as client:
+            urls = ["/", f"/posts/{self.post_id}", f"/tags/{self.tag_id}", f"/users/{self.user_id}"]
+            etags = {url: client.get(url).headers["ETag"] for url in urls}
+
+            d = {"title": "Waffles", "content": "Diner", "tag_group": [str(self.tag_id)]}
+            client.post(f"/posts/{self.post_id}/edit", data=d)
+            # consume the flash message
+            client.get("/users")
+
+            for url in urls:
+                resp = client.get(url, headers={"If-None-Match": etags[url]})
+                self.assertEqual(resp.status_code, 200, url)
+                self.assertNotEqual(resp.headers["ETag"], etags[url])
+
+    def test_other_pages_keep_their_validators(self):
+        other = Tag(name='unused')
+        db.session.add(other)
+        db.session.commit()
+        with app.test_client() as client:
+            etag = client.get(f"/tags/{other.id}").headers["ETag"]
+            client.post(f"/posts/{self.post_id}/edit", data={"title": "Waffles", "content": "Diner", "tag_group": []})
+            client.get("/users")
+
+            self.assertEqual(client.get(f"/tags/{other.id}", headers={"If-None-Match": etag}).status_code, 304)
+
+    def test_clear_changes_every_validator(self):
+        with app.test_client() as client:
+            etag = client.get("/").headers["ETag"]
+            page_cache.clear()
+
+            self.assertEqual(client.get("/", headers={"If-None-Match": etag}).status_code, 200)
+
+    def test_flash_pages_have_no_validator(self):
+        with app.test_client() as client:
+            client.post(f"/users/{self.user_id}/edit", data={"first_name": "", "last_name": "", "img_url": ""})
+            resp = client.get(f"/users/{self.user_id}")
+
+            self.assertIn("Must have first and last name", resp.get_data(as_text=True))
+            self.assertIsNone(resp.headers.get("ETag"))
@@ -0,0 +1,164 @@
+from unittest import TestCase
+
+from sqlalchemy import create_engine, event, text
+
+from app import app, tag_catalog
+from catalog import TagCatalog
+from models import db, User, Post, Tag, PostTag, CatalogVersion
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///test_db'
+app.config['SQLALCHEMY_ECHO'] = False
+
+# Make Flask errors be real errors, rather than HTML pages with error info
+app.config['TESTING'] = True
+
+# Render every page fresh; test_cache.py turns the page cache on for its own tests
+app.config['PAGE_CACHE_ENABLED'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class StatementLog:
+    """Collect the SQL statements sent to the database inside a with block."""
+
+    def __enter__(self):
+        self.statements = []
+        event.listen(db.engine, "before_cursor_execute", self.callback)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(db.engine, "before_cursor_execute", self.callback)
+
+    def callback(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def reading(self, table):
+        return [s for s in self.statements if s.startswith("SELECT") and f"FROM {table}" in s]
+
+
+class TagCatalogTestCase(TestCase):
+    """Tests for the process-local tag catalog."""
+
+    def setUp(self):
+        """Add a user and a few tags."""
+
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+
+        user = User(first_name='Ann', last_name='Perkins')
+        tags = [Tag(name=name) for name in ['nursing', 'pawnee', 'eagleton', 'chris']]
+        db.session.add_all([user, *tags])
+        db.session.commit()
+
+        self.user_id = user.id
+        self.tag_ids = {tag.name: tag.id for tag in tags}
+
+    def tearDown(self):
+        """Clean up this test's rows."""
+
+        db.session.rollback()
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def version(self):
+        return db.session.query(CatalogVersion.version).filter_by(name="tags").scalar()
+
+    def test_tag_writes_bump_version(self):
+        before = self.version()
+        tag = Tag.query.get(self.tag_ids['chris'])
+        tag.name = 'traeger'
+        db.session.commit()
+        self.assertEqual(self.version(), before + 1)
+
+        Tag.query.filter_by(id=self.tag_ids['eagleton']).delete()
+        db.session.commit()
+        self.assertEqual(self.version(), before + 2)
+
+    def test_tagging_a_post_does_not_bump_version(self):
+        before = self.version()
+        db.session.add(Post(title='Hi', content='There', user_id=self.user_id,
+                            tags=[Tag.query.get(self.tag_ids['pawnee'])]))
+        db.session.commit()
+        self.assertEqual(self.version(), before)
+
+    def test_pages_follow_name_order(self):
+        with app.test_request_context():
+            first = tag_catalog.page(per_page=3)
+            second = tag_catalog.page(first.next_cursor, per_page=3)
+        self.assertEqual([t.name for t in first], ['chris', 'eagleton', 'nursing'])
+        self.assertEqual([t.name for t in second], ['pawnee'])
+        self.assertIsNone(second.next_cursor)
+
+    def test_local_writes_show_at_once(self):
+        with app.test_client() as client:
+            client.get("/tags")
+            client.post(f"/tags/{self.tag_ids['chris']}/edit", data={"name": "traeger"})
+            html = client.get("/tags").get_data(as_text=True)
+
+            self.assertIn("traeger", html)
+
+    def test_other_workers_changes_show_after_check_interval(self):
+        catalog = TagCatalog()
+        catalog.check_seconds = 3600
+        with app.test_request_context():
+            self.assertIn('chris', [t.name for t in catalog.all()])
+
+        # another worker renames a tag through its own connection
+        engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE tags SET name = 'traeger' WHERE id = :id"), {"id": self.tag_ids['chris']})
+            conn.execute(CatalogVersion.bump("tags"))
+        engine.dispose()
+
+        with app.test_request_context():
+            self.assertIn('chris', [t.name for t in catalog.all()])
+            catalog.check_seconds = 0
+            self.assertIn('traeger', [t.name for t in catalog.all()])
+
+    def test_post_forms_and_writes_skip_tags_table(self):
+        with app.test_client() as client:
+            client.get("/tags")
+            with StatementLog() as log:
+                client.get(f"/users/{self.user_id}/posts/new")
+                d = {"title": "Hi", "content": "There", "tag_group": [str(self.tag_ids['pawnee']), "999999"]}
+                client.post(f"/users/{self.user_id}/posts/new", data=d)
+                client.get("/tags")
+
+            # the tag list still reads each tag's post_count, but never the names
+            self.assertEqual([s for s in log.reading("tags") if "tags.name" in s], [])
+        post = Post.query.filter_by(title="Hi").one()
+        self.assertEqual([tag.name for tag in post.tags], ['pawnee'])
+
+    def test_tag_deleted_by_another_worker_is_skipped(self):
+        check_seconds, tag_catalog.check_seconds = tag_catalog.check_seconds, 3600
+        try:
+            with app.test_client() as client:
+                client.get("/tags")
+                # deleted through another worker's connection, before this one's catalog has checked
+                engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+                with engine.begin() as conn:
+                    conn.execute(text("DELETE FROM tags WHERE id = :id"), {"id": self.tag_ids['chris']})
+                    conn.execute(CatalogVersion.bump("tags"))
+                engine.dispose()
+
+                tag_group = [str(self.tag_ids['chris']), str(self.tag_ids['pawnee'])]
+                added = client.post(f"/users/{self.user_id}/posts/new",
+                                    data={"title": "Hi", "content": "There", "tag_group": tag_group})
+                post = Post.query.filter_by(title="Hi").one()
+                edited = client.post(f"/posts/{post.id}/edit",
+                                     data={"title": "Hi", "content": "Again", "tag_group": tag_group[:1]})
+        finally:
+            tag_catalog.check_seconds = check_seconds
+
+        self.assertEqual((added.status_code, edited.status_code), (302, 302))
+        self.assertEqual(PostTag.query.filter_by(post_id=post.id).count(), 0)
@@ -0,0 +1,163 @@
+import io
+import json
+from unittest import TestCase
+
+from sqlalchemy import create_engine, text
+
+from app import app
+from counters import reconcile
+from importer import import_stream
+from models import db, User, Post, Tag, PostTag
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///test_db'
+app.config['SQLALCHEMY_ECHO'] = False
+
+# Make Flask errors be real errors, rather than HTML pages with error info
+app.config['TESTING'] = True
+
+# Render every page fresh; test_cache.py turns the page cache on for its own tests
+app.config['PAGE_CACHE_ENABLED'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class PostCountersTestCase(TestCase):
+    """Tests for users.post_count and tags.post_count."""
+
+    def setUp(self):
+        """Two users and three tags, no posts."""
+
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+
+        users = [User(first_name='Leslie', last_name='Knope'), User(first_name='Ben', last_name='Wyatt')]
+        tags = [Tag(name=name) for name in ['waffles', 'parks', 'calzones']]
+        db.session.add_all([*users, *tags])
+        db.session.commit()
+        self.user_ids = {user.first_name: user.id for user in users}
+        self.tag_ids = {tag.name: tag.id for tag in tags}
+
+    def tearDown(self):
+        """Clean up this test's rows."""
+
+        db.session.rollback()
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def counts(self):
+        db.session.expire_all()
+        users = {u.first_name: u.post_count for u in User.query}
+        tags = {t.name: t.post_count for t in Tag.query}
+        return users, tags
+
+    def add_post(self, client, user, title, *tags):
+        data = {"title": title, "content": "Content", "tag_group": [str(self.tag_ids[t]) for t in tags]}
+        client.post(f"/users/{self.user_ids[user]}/posts/new", data=data)
+        return Post.query.filter_by(title=title).one().id
+
+    def test_post_routes(self):
+        with app.test_client() as client:
+            first = self.add_post(client, 'Leslie', 'JJs', 'waffles', 'parks')
+            self.add_post(client, 'Leslie', 'Lot 48', 'parks')
+            self.assertEqual(self.counts(), ({'Leslie': 2, 'Ben': 0}, {'waffles': 1, 'parks': 2, 'calzones': 0}))
+
+            d = {"title": "JJs", "content": "Content", "tag_group": [str(self.tag_ids['calzones'])]}
+            client.post(f"/posts/{first}/edit", data=d)
+            self.assertEqual(self.counts(), ({'Leslie': 2, 'Ben': 0}, {'waffles': 0, 'parks': 1, 'calzones': 1}))
+
+            client.post(f"/posts/{first}/delete")
+            self.assertEqual(self.counts(), ({'Leslie': 1, 'Ben': 0}, {'waffles': 0, 'parks': 1, 'calzones': 0}))
+
+    def test_cascades_count(self):
+        with app.test_client() as client:
+            self.add_post(client, 'Ben', 'Low Cal Calzone Zone', 'calzones', 'parks')
+            self.add_post(client, 'Leslie', 'Harvest Festival', 'parks')
+
+            client.post(f"/users/{self.user_ids['Ben']}/delete")
+            self.assertEqual(self.counts(), ({'Leslie': 1}, {'waffles': 0, 'parks': 1, 'calzones': 0}))
+
+            client.post(f"/tags/{self.tag_ids['parks']}/delete")
+            self.assertEqual(self.counts(), ({'Leslie': 1}, {'waffles': 0, 'calzones': 0}))
+
+    def test_tag_routes(self):
+        with app.test_client() as client:
+            posts = [self.add_post(client, 'Leslie', title) for title in ['One', 'Two', 'Three']]
+            client.post("/tags/new", data={"name": "pawnee", "post_group": [str(p) for p in posts]})
+            tag_id = Tag.query.filter_by(name='pawnee').one().id
+            self.assertEqual(self.counts()[1]['pawnee'], 3)
+
+            client.post(f"/tags/{tag_id}/edit", data={"name": "pawnee", "post_group": [str(posts[0])],
+                                                      "remove_post": [str(posts[1]), str(posts[2])]})
+            self.assertEqual(self.counts()[1]['pawnee'], 1)
+
+    def test_moving_a_post_moves_the_count(self):
+        with app.test_client() as client:
+            self.add_post(client, 'Leslie', 'Swap', 'waffles')
+        db.session.execute(text("UPDATE posts SET user_id = :id"), {"id": self.user_ids['Ben']})
+        db.session.commit()
+
+        self.assertEqual(self.counts()[0], {'Leslie': 0, 'Ben': 1})
+
+    def test_import_counts(self):
+        records = [{"title": f"Report {i}", "content": "Yes", "user_id": self.user_ids['Ben'],
+                    "tags": ["parks", "budget"]} for i in range(5)]
+        with app.app_context():
+            import_stream("posts", io.BytesIO("\n".join(map(json.dumps, records)).encode()), "jsonl", chunk=2)
+
+        users, tags = self.counts()
+        self.assertEqual(users['Ben'], 5)
+        self.assertEqual((tags['parks'], tags['budget']), (5, 5))
+
+    def test_reconcile_repairs_drift(self):
+        with app.test_client() as client:
+            self.add_post(client, 'Leslie', 'JJs', 'waffles')
+        db.session.execute(text("UPDATE users SET post_count = 7"))
+        db.session.execute(text("UPDATE tags SET post_count = 0"))
+        db.session.commit()
+
+        with db.engine.begin() as conn:
+            self.assertEqual(reconcile(conn, check=True), {"users": 2, "tags": 1})
+        self.assertEqual(self.counts()[0], {'Leslie': 7, 'Ben': 7})
+        with db.engine.begin() as conn:
+            self.assertEqual(reconcile(conn), {"users": 2, "tags": 1})
+            self.assertEqual(reconcile(conn, check=True), {"users": 0, "tags": 0})
+        self.assertEqual(self.counts(), ({'Leslie': 1, 'Ben': 0}, {'waffles': 1, 'parks': 0, 'calzones': 0}))
+
+    def test_list_pages(self):
+        with app.test_client() as client:
+            self.add_post(client, 'Leslie', 'JJs', 'parks')
+            self.add_post(client, 'Leslie', 'Lot 48', 'parks', 'calzones')
+
+            self.assertIn("2 posts", client.get("/users").get_data(as_text=True))
+            html = client.get("/tags?sort=popular").get_data(as_text=True)
+            self.assertLess(html.index("parks"), html.index("calzones"))
+            self.assertLess(html.index("calzones"), html.index("waffles"))
+            html = client.get("/tags").get_data(as_text=True)
+            self.assertLess(html.index("calzones"), html.index("parks"))
+            self.assertIn("1 posts", html)
+
+    def test_sqlite_triggers(self):
+        engine = create_engine("sqlite://")
+        db.Model.metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(text("INSERT INTO users (id, first_name, last_name) VALUES (1, 'a', 'b'), (2, 'c', 'd')"))
+            conn.execute(text("INSERT INTO tags (id, name) VALUES (1, 't')"))
+            conn.execute(text("INSERT INTO posts (id, title, content, user_id, created_at) "
+                              "VALUES (1, 'x', 'y', 1, '2020-01-01'), (2, 'x', 'y', 1, '2020-01-01')"))
+            conn.execute(text("INSERT INTO post_tags (post_id, tag_id) VALUES (1, 1), (2, 1)"))
+            conn.execute(text("UPDATE posts SET user_id = 2 WHERE id = 2"))
+            conn.execute(text("DELETE FROM posts WHERE id = 1"))
+
+            self.assertEqual(conn.execute(text("SELECT post_count FROM users ORDER BY id")).scalars().all(), [0, 1])
+            self.assertEqual(conn.execute(text("SELECT post_count FROM tags")).scalar(), 1)
+        engine.dispose()
@@ -0,0 +1,102 @@
+import json
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+# create_app re-binds db and the shared extensions to the app it builds, so each
+# test builds its apps in a fresh interpreter and reports back as JSON
+ENV = {"DATABASE_URL": "postgresql:///test_db", "PYTHONWARNINGS": "ignore"}
+
+
+def run(script, **env):
+    out = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True,
+                         env={**os.environ, **ENV, **env}, check=True).stdout
+    return json.loads(out)
+
+
+class CreateAppTestCase(TestCase):
+    """Tests for create_app and its config profiles."""
+
+    def test_import_builds_nothing(self):
+        result = run("""
+import json, sys
+import app
+print(json.dumps({"built": "app" in vars(app), "toolbar": "flask_debugtoolbar" in sys.modules,
+                  "importer": "importer" in sys.modules}))
+""")
+        self.assertEqual(result, {"built": False, "toolbar": False, "importer": False})
+
+    def test_prod_profile(self):
+        result = run("""
+import json, sys
+from sqlalchemy import text
+from app import create_app
+from models import db
+app = create_app("prod")
+with app.app_context():
+    timeout = db.session.execute(text("SHOW statement_timeout")).scalar()
+    pool = db.engine.pool
+print(json.dumps({"toolbar": "flask_debugtoolbar" in sys.modules, "timeout": timeout, "size": pool.size(),
+                  "overflow": pool._max_overflow, "pre_ping": pool._pre_ping, "echo": bool(db.engine.echo)}))
+""", DB_POOL_SIZE="3")
+        self.assertEqual(result, {"toolbar": False, "timeout": "30s", "size": 3, "overflow": 20,
+                                  "pre_ping": True, "echo": False})
+
+    def test_dev_profile_loads_toolbar(self):
+        result = run("""
+import json, sys
+from app import app
+print(json.dumps({"toolbar": "flask_debugtoolbar" in sys.modules, "routes": len(list(app.url_map.iter_rules()))}))
+""")
+        self.assertTrue(result["toolbar"])
+        self.assertGreater(result["routes"], 20)
+
+    def test_sqlite_skips_pool_settings(self):
+        result = run("""
+import json
+from sqlalchemy import text
+from app import create_app
+from models import db
+app = create_app("prod")
+app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+with app.app_context():
+    print(json.dumps(db.session.execute(text("SELECT 1")).scalar()))
+""")
+        self.assertEqual(result, 1)
+
+    def test_forked_worker_gets_its_own_connections(self):
+        result = run("""
+import json, os
+from sqlalchemy import text
+from app import create_app
+from models import db
+app = create_app("prod")
+
+def backend_pid():
+    with app.app_context():
+        return db.session.execute(text("SELECT pg_backend_pid()")).scalar()
+
+before = backend_pid()
+read, write = os.pipe()
+child = os.fork()
+if child == 0:
+    os.write(write, str(backend_pid()).encode())
+    os._exit(0)
+os.waitpid(child, 0)
+print(json.dumps({"parent": [before, backend_pid()], "child": int(os.read(read, 100))}))
+""")
+        parent_before, parent_after = result["parent"]
+        self.assertEqual(parent_before, parent_after)
+        self.assertNotEqual(result["child"], parent_before)
+
+    def test_apps_not_kept_alive_for_forks(self):
+        result = run("""
+import gc, json, weakref
+from app import create_app
+first = weakref.ref(create_app("prod"))
+second = create_app("prod")
+gc.collect()
+print(json.dumps(first() is None))
+""")
+        self.assertTrue(result)
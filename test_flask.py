@@ -1,7 +1,7 @@
 from unittest import TestCase
 
 from app import app
-from models import db, User, Post
+from models import db, User, Post, Tag, PostTag
 
 # Use test database and don't clutter tests with SQL
 app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///test_db'
@@ -10,6 +10,12 @@ app.config['SQLALCHEMY_ECHO'] = False
 # Make Flask errors be real errors, rather than HTML pages with error info
 app.config['TESTING'] = True
 
+# Fail the request if a template lazy loads a relationship
+app.config['RAISE_ON_LAZY_LOAD'] = True
+
+# Render every page fresh; test_cache.py turns the page cache on for its own tests
+app.config['PAGE_CACHE_ENABLED'] = False
+
 # This is a bit of hack, but don't use Flask DebugToolbar
 app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
 
@@ -181,4 +187,50 @@ class UserViewsTestCase(TestCase):
     #         html = resp.get_data(as_text=True)
 
     #         self.assertEqual(resp.status_code, 200)
-    #         self.assertIn("Must fill out all fields. Changes not saved.", html)
\ No newline at end of file
+    #         self.assertIn("Must fill out all fields. Changes not saved.", html)
+
+class TagViewsTestCase(TestCase):
+    """Tests for editing tag membership from the tag side."""
+
+    def setUp(self):
+        """Add a user, a tag and two posts, one of them tagged."""
+
+        user = User(first_name='April', last_name="Ludgate")
+        tag = Tag(name='janet snakehole')
+        db.session.add_all([user, tag])
+        db.session.commit()
+        tagged = Post(title='Tagged', content='Ugh', user_id=user.id, tags=[tag])
+        untagged = Post(title='Untagged', content='Whatever', user_id=user.id)
+        db.session.add_all([tagged, untagged])
+        db.session.commit()
+
+        self.tag_id = tag.id
+        self.tagged_id = tagged.id
+        self.untagged_id = untagged.id
+
+    def tearDown(self):
+        """Clean up any fouled transaction and this test's rows."""
+
+        db.session.rollback()
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def test_edit_tag_adds_and_removes_posts(self):
+        with app.test_client() as client:
+            d = {"name": "janet snakehole", "post_group": [self.untagged_id], "remove_post": [self.tagged_id]}
+            resp = client.post(f"/tags/{self.tag_id}/edit", data=d, follow_redirects=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Tag edited successfully.", resp.get_data(as_text=True))
+            self.assertEqual([pt.post_id for pt in PostTag.query.filter_by(tag_id=self.tag_id)], [self.untagged_id])
+
+    def test_edit_post_replaces_tags(self):
+        with app.test_client() as client:
+            d = {"title": "Tagged", "content": "Ugh", "tag_group": []}
+            resp = client.post(f"/posts/{self.tagged_id}/edit", data=d, follow_redirects=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(PostTag.query.filter_by(post_id=self.tagged_id).count(), 0)
@@ -0,0 +1,64 @@
+import datetime
+import io
+import os
+import tempfile
+from collections import Counter
+from unittest import TestCase
+
+from sqlalchemy import create_engine, select
+
+from generate import generate
+from models import Post, PostTag, User, Tag
+
+END = datetime.datetime(2020, 6, 1)
+
+
+class GenerateTestCase(TestCase):
+    """Tests for the synthetic data generator, run against a local SQLite file."""
+
+    def setUp(self):
+        """Generate a small dataset into a fresh file."""
+
+        handle, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        self.url = f"sqlite:///{self.path}"
+        generate(self.url, users=50, posts=2000, tags=10, seed=7, end=END, chunk=300, out=io.StringIO())
+        self.engine = create_engine(self.url)
+
+    def tearDown(self):
+        """Remove the database file."""
+
+        self.engine.dispose()
+        os.remove(self.path)
+
+    def rows(self, table):
+        with self.engine.connect() as conn:
+            return conn.execute(select(table).order_by(*table.primary_key.columns)).fetchall()
+
+    def test_row_counts(self):
+        self.assertEqual(len(self.rows(User.__table__)), 50)
+        self.assertEqual(len(self.rows(Tag.__table__)), 10)
+        self.assertEqual(len(self.rows(Post.__table__)), 2000)
+
+    def test_same_seed_same_data(self):
+        posts = self.rows(Post.__table__)
+        post_tags = self.rows(PostTag.__table__)
+        generate(self.url, users=50, posts=2000, tags=10, seed=7, end=END, reset=True, out=io.StringIO())
+
+        self.assertEqual(self.rows(Post.__table__), posts)
+        self.assertEqual(self.rows(PostTag.__table__), post_tags)
+
+    def test_skewed_authors_and_tags(self):
+        authors = Counter(post.user_id for post in self.rows(Post.__table__)).most_common()
+        tags = Counter(pt.tag_id for pt in self.rows(PostTag.__table__)).most_common()
+
+        # the busiest author and tag dwarf the typical ones
+        self.assertGreater(authors[0][1], 5 * authors[len(authors) // 2][1])
+        self.assertGreater(tags[0][1], 3 * tags[-1][1])
+
+    def test_dates_within_spread(self):
+        dates = [post.created_at for post in self.rows(Post.__table__)]
+
+        self.assertEqual(dates, sorted(dates))
+        self.assertGreaterEqual(min(dates), END - datetime.timedelta(days=365))
+        self.assertLessEqual(max(dates), END)
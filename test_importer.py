@@ -0,0 +1,164 @@
+import contextlib
+import io
+import json
+import tempfile
+from unittest import TestCase
+
+from app import app
+from importer import import_stream, main, MAX_REPORTED_ERRORS
+from models import db, User, Post, Tag, PostTag
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///test_db'
+app.config['SQLALCHEMY_ECHO'] = False
+
+# Make Flask errors be real errors, rather than HTML pages with error info
+app.config['TESTING'] = True
+
+# Render every page fresh; test_cache.py turns the page cache on for its own tests
+app.config['PAGE_CACHE_ENABLED'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+def jsonl(*records):
+    return io.BytesIO("\n".join(json.dumps(r) for r in records).encode())
+
+
+class ImporterTestCase(TestCase):
+    """Tests for bulk import of users, posts and tags."""
+
+    def setUp(self):
+        """Start from empty tables, plus one user to hang posts on."""
+
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+
+        user = User(first_name='Tom', last_name='Haverford')
+        db.session.add_all([user, Tag(name='swag')])
+        db.session.commit()
+        self.user_id = user.id
+
+    def tearDown(self):
+        """Clean up this test's rows."""
+
+        db.session.rollback()
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def test_users_validated_like_the_form(self):
+        with app.app_context():
+            report = import_stream("users", jsonl(
+                {"first_name": "Donna", "last_name": "Meagle"},
+                {"first_name": "", "last_name": "Nobody"},
+                {"first_name": "Jean-Ralphio"},
+                {"first_name": "Mona-Lisa", "last_name": "Saperstein", "img_url": ""},
+            ), "jsonl", chunk=2)
+
+        self.assertEqual(report.inserted, 2)
+        self.assertEqual([e["line"] for e in report.errors], [2, 3])
+        self.assertEqual(report.errors[1]["error"], "last_name is required")
+        mona = User.query.filter_by(first_name="Mona-Lisa").one()
+        self.assertEqual(mona.img_url, User.url)
+
+    def test_posts_with_tags_in_chunks(self):
+        records = [{"title": f"Treat {i}", "content": "Yo self", "user_id": self.user_id,
+                    "tags": ["swag", f"treat-{i % 2}"]} for i in range(5)]
+        with app.app_context():
+            report = import_stream("posts", jsonl(*records), "jsonl", chunk=2)
+
+        self.assertEqual(report.inserted, 5)
+        self.assertEqual(sorted(tag.name for tag in Tag.query), ["swag", "treat-0", "treat-1"])
+        post = Post.query.filter_by(title="Treat 3").one()
+        self.assertEqual(sorted(tag.name for tag in post.tags), ["swag", "treat-1"])
+
+    def test_posts_with_bad_rows(self):
+        with app.app_context():
+            report = import_stream("posts", io.BytesIO(
+                b'title,content,user_id,tags\n'
+                b'Entertainment 720,"Cash, money",' + str(self.user_id).encode() + b',swag|business\n'
+                b'No content,,1,\n'
+                b'Ghost,Boo,0,\n'
+                b'Bad author,Hm,tom,\n'
+            ), "csv")
+
+        self.assertEqual(report.inserted, 1)
+        self.assertEqual(sorted((e["line"], e["error"]) for e in report.errors), [
+            (3, "content is required"), (4, "user 0 does not exist"), (5, "user_id must be an integer")])
+        post = Post.query.one()
+        self.assertEqual(post.content, "Cash, money")
+        self.assertEqual(sorted(tag.name for tag in post.tags), ["business", "swag"])
+
+    def test_explicit_ids_carry_over(self):
+        with app.app_context():
+            import_stream("users", jsonl({"id": 7000, "first_name": "Ben", "last_name": "Wyatt"}), "jsonl")
+            report = import_stream("posts", jsonl(
+                {"id": 9000, "title": "Cones of Dunshire", "content": "A game", "user_id": 7000},
+                {"id": 9000, "title": "Again", "content": "Twice", "user_id": 7000},
+            ), "jsonl")
+
+        self.assertEqual(report.inserted, 1)
+        self.assertEqual(report.errors, [{"line": 2, "error": "id 9000 already exists"}])
+        self.assertEqual(Post.query.get(9000).user.first_name, "Ben")
+        # the id sequence moved past the imported ids
+        user = User(first_name='Chris', last_name='Traeger')
+        db.session.add(user)
+        db.session.commit()
+        self.assertGreater(user.id, 7000)
+
+    def test_reported_errors_are_capped(self):
+        with app.app_context():
+            report = import_stream("tags", jsonl(*[{"name": ""}] * (MAX_REPORTED_ERRORS + 5)), "jsonl")
+
+        self.assertEqual(report.error_count, MAX_REPORTED_ERRORS + 5)
+        self.assertEqual(len(report.errors), MAX_REPORTED_ERRORS)
+
+    def test_upload_endpoint(self):
+        with app.test_client() as client:
+            data = {"file": (io.BytesIO(b"name\nbusiness\n\n"), "tags.csv")}
+            resp = client.post("/import/tags", data=data)
+            body = client.post("/import/tags?format=jsonl", data=b'{"name": "money"}\nnot json\n')
+
+            self.assertEqual(resp.json, {"inserted": 1, "error_count": 0, "errors": []})
+            self.assertEqual(body.json["inserted"], 1)
+            self.assertTrue(body.json["errors"][0]["error"].startswith("invalid JSON"))
+            self.assertIn("money", client.get("/tags").get_data(as_text=True))
+
+    def test_cli_import_changes_validators(self):
+        with app.test_client() as client:
+            etag = client.get("/").headers["ETag"]
+            with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as f:
+                f.write('{"name": "business"}\n')
+                f.flush()
+                with contextlib.redirect_stdout(io.StringIO()) as out:
+                    main(["--db", app.config['SQLALCHEMY_DATABASE_URI'], "tags", f.name])
+
+            self.assertEqual(out.getvalue(), "imported 1 tags, skipped 0\n")
+            self.assertEqual(client.get("/", headers={"If-None-Match": etag}).status_code, 200)
+
+    def test_undecodable_and_malformed_rows(self):
+        with app.app_context():
+            jsonl_report = import_stream("tags", io.BytesIO(
+                b'{"name": "wine"}\n{"name": "caf\xe9"}\n{"name": "\\ud800"}\n{"name": "rent"}\n'), "jsonl")
+            csv_report = import_stream("tags", io.BytesIO(
+                b'name\nsneakers\ncaf\xe9\n"' + b"x" * 200000 + b'"\nbusiness\n'), "csv")
+
+        self.assertEqual(jsonl_report.as_dict(), {"inserted": 2, "error_count": 2, "errors": [
+            {"line": 2, "error": "not valid UTF-8"}, {"line": 3, "error": "name must be valid UTF-8 text"}]})
+        self.assertEqual(csv_report.inserted, 2)
+        self.assertEqual([error["line"] for error in csv_report.errors], [3, 4])
+        self.assertTrue(csv_report.errors[1]["error"].startswith("invalid CSV"))
+
+        with app.test_client() as client:
+            resp = client.post("/import/tags", data={"file": (io.BytesIO(b"name\n\xff\xfe\n"), "tags.csv")})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json["errors"], [{"line": 2, "error": "not valid UTF-8"}])
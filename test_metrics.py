@@ -0,0 +1,69 @@
+from unittest import TestCase
+
+from app import app, metrics
+from models import db, User
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///test_db'
+app.config['SQLALCHEMY_ECHO'] = False
+
+# Make Flask errors be real errors, rather than HTML pages with error info
+app.config['TESTING'] = True
+
+# Render every page fresh; test_cache.py turns the page cache on for its own tests
+app.config['PAGE_CACHE_ENABLED'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class MetricsTestCase(TestCase):
+    """Tests for the per-request instrumentation and /metrics."""
+
+    def setUp(self):
+        """Add sample user."""
+
+        user = User(first_name='Ann', last_name="Perkins")
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+    def tearDown(self):
+        """Clean up any fouled transaction and this test's rows."""
+
+        db.session.rollback()
+        User.query.delete()
+        db.session.commit()
+        metrics.slow_query_seconds = app.config['SLOW_QUERY_SECONDS']
+
+    def test_route_metrics_exposed(self):
+        with app.test_client() as client:
+            client.get(f"/users/{self.user_id}")
+            resp = client.get("/metrics")
+            text = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("text/plain", resp.content_type)
+            self.assertIn('blogly_requests_total{method="GET",route="/users/<int:user_id>",status="200"}', text)
+            self.assertIn('blogly_request_queries_count{method="GET",route="/users/<int:user_id>"}', text)
+            self.assertIn('blogly_request_template_seconds_sum{method="GET",route="/users/<int:user_id>"}', text)
+
+    def test_query_count_recorded(self):
+        before = metrics.queries.series.get(("GET", "/users/<int:user_id>/edit"), [0] * 14)[:-1]
+        with app.test_client() as client:
+            client.get(f"/users/{self.user_id}/edit")
+        after = metrics.queries.series[("GET", "/users/<int:user_id>/edit")][:-1]
+
+        # the edit form runs exactly one query, which lands in the "<= 1" bucket
+        self.assertEqual(after[1] - before[1], 1)
+
+    def test_slow_queries_logged(self):
+        metrics.slow_query_seconds = 0
+        with self.assertLogs("blogly.sql", level="WARNING") as logs:
+            with app.test_client() as client:
+                client.get(f"/users/{self.user_id}/edit")
+
+        self.assertIn("slow query", logs.output[0])
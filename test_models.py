@@ -1,7 +1,9 @@
 from unittest import TestCase
 
+from sqlalchemy import event
+
 from app import app
-from models import db, User, Post
+from models import db, User, Post, Tag, PostTag
 
 # Use test database and don't clutter tests with SQL
 app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///test_db'
@@ -33,3 +35,80 @@ class UserModelTestCase(TestCase):
     def full_name(self):
         doug = User(first_name='Doug', last_name="Hooker")
         self.assertEquals(user.full_name, "Doug Hooker")
+
+
+class PostTagModelTestCase(TestCase):
+    """Tests for the set-diff post_tags updaters."""
+
+    def setUp(self):
+        """Add a user, three tags and two posts."""
+
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+
+        user = User(first_name='Andy', last_name="Dwyer")
+        self.tags = [Tag(name='mouse rat'), Tag(name='burt macklin'), Tag(name='johnny karate')]
+        db.session.add(user)
+        db.session.add_all(self.tags)
+        db.session.commit()
+        self.posts = [Post(title='Song', content='5000 candles', user_id=user.id),
+                      Post(title='FBI', content='Macklin', user_id=user.id)]
+        db.session.add_all(self.posts)
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up any fouled transaction and this test's rows."""
+
+        db.session.rollback()
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def tag_ids(self, post):
+        return {pt.tag_id for pt in PostTag.query.filter_by(post_id=post.id)}
+
+    def test_set_tags_for_post_diff(self):
+        post = self.posts[0]
+        a, b, c = (tag.id for tag in self.tags)
+        PostTag.set_tags_for_post(post.id, [a, b])
+        added, removed = PostTag.set_tags_for_post(post.id, [b, c, 999999])
+        db.session.commit()
+
+        self.assertEqual(added, {c})
+        self.assertEqual(removed, {a})
+        self.assertEqual(self.tag_ids(post), {b, c})
+
+    def test_set_tags_for_post_one_insert_one_delete(self):
+        post = self.posts[0]
+        a, b, c = (tag.id for tag in self.tags)
+        PostTag.set_tags_for_post(post.id, [a])
+        db.session.commit()
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        PostTag.set_tags_for_post(post.id, [b, c])
+        db.session.commit()
+        event.remove(db.engine, "before_cursor_execute", record)
+
+        self.assertEqual(sum(s.startswith("INSERT") for s in statements), 1)
+        self.assertEqual(sum(s.startswith("DELETE") for s in statements), 1)
+
+    def test_change_posts_for_tag(self):
+        tag = self.tags[0]
+        first, second = self.posts
+        PostTag.change_posts_for_tag(tag.id, add=[first.id])
+        added, removed = PostTag.change_posts_for_tag(tag.id, add=[first.id, second.id], remove=[first.id, 999999])
+        db.session.commit()
+
+        self.assertEqual(added, {second.id})
+        self.assertEqual(removed, {first.id})
+        self.assertEqual(self.tag_ids(first), set())
+        self.assertEqual(self.tag_ids(second), {tag.id})
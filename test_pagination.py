@@ -0,0 +1,126 @@
+import datetime
+from unittest import TestCase
+
+from app import app
+from models import db, User, Post, Tag, PostTag
+from pagination import encode_cursor, decode_cursor
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///test_db'
+app.config['SQLALCHEMY_ECHO'] = False
+
+# Make Flask errors be real errors, rather than HTML pages with error info
+app.config['TESTING'] = True
+
+# Render every page fresh; test_cache.py turns the page cache on for its own tests
+app.config['PAGE_CACHE_ENABLED'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+def walk(fetch):
+    """Follow cursors from the first page to the last and return every item."""
+
+    items, cursor = [], None
+    while True:
+        page = fetch(cursor)
+        items.extend(page.items)
+        cursor = page.next_cursor
+        if cursor is None:
+            return items
+
+
+class KeysetPaginationTestCase(TestCase):
+    """Tests for cursor pagination on the model classmethods and routes."""
+
+    def setUp(self):
+        """Add users sharing last names so ties are broken by first name and id."""
+
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+
+        names = [('Ann', 'Perkins'), ('Ben', 'Wyatt'), ('Ann', 'Wyatt'), ('Ann', 'Wyatt'),
+                 ('Ron', 'Swanson'), ('Tammy', 'Swanson'), ('April', 'Ludgate')]
+        users = [User(first_name=first, last_name=last) for first, last in names]
+        db.session.add_all(users)
+        db.session.commit()
+
+        tag = Tag(name='pawnee')
+        posts = [Post(title=f'Post {i}', content='Content', user_id=users[0].id, tags=[tag]) for i in range(7)]
+        db.session.add_all(posts)
+        db.session.commit()
+
+        self.user_id = users[0].id
+        self.tag_id = tag.id
+
+    def tearDown(self):
+        """Clean up any fouled transaction and the rows this test added."""
+
+        db.session.rollback()
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def test_users_pages_match_full_ordering(self):
+        expected = User.query.order_by(User.last_name.desc(), User.first_name, User.id).all()
+        walked = walk(lambda cursor: User.order_by_last_name(cursor, per_page=2))
+
+        self.assertEqual([u.id for u in walked], [u.id for u in expected])
+
+    def test_posts_by_tag_newest_first(self):
+        expected = Post.query.order_by(Post.created_at.desc(), Post.id.desc()).all()
+        walked = walk(lambda cursor: Post.by_tag(self.tag_id, cursor, per_page=3))
+
+        self.assertEqual([p.id for p in walked], [p.id for p in expected])
+
+    def test_last_page_has_no_cursor(self):
+        page = Tag.order_by_name(per_page=10)
+
+        self.assertEqual(len(page), 1)
+        self.assertIsNone(page.next_cursor)
+
+    def test_bad_cursor_starts_over(self):
+        self.assertIsNone(decode_cursor("not-a-cursor", [(User.id, "asc")]))
+        self.assertEqual(decode_cursor(encode_cursor([5]), [(User.id, "asc")]), [5])
+
+    def test_cursor_values_must_fit_their_columns(self):
+        keys = [(Post.created_at, "desc"), (Post.id, "desc")]
+        good = decode_cursor(encode_cursor(["2026-10-18T09:30:00", 5]), keys)
+        self.assertEqual(good, [datetime.datetime(2026, 10, 18, 9, 30), 5])
+        for values in (["2026-10-18T09:30:00", [5]], [{"a": 1}, 5], [5, 5], ["2026-10-18T09:30:00", "5"],
+                       ["2026-10-18T09:30:00", True], ["2026-10-18T09:30:00", 2 ** 40], {"a": 1, "b": 2}):
+            self.assertIsNone(decode_cursor(encode_cursor(values), keys), values)
+        self.assertIsNone(decode_cursor(encode_cursor(["a\x00", 5]), [(Tag.name, "asc"), (Tag.id, "asc")]))
+
+        with app.test_client() as client:
+            for cursor in (encode_cursor([["Perkins"], "Ann", 1]), encode_cursor([1, 2, 3])):
+                self.assertEqual(client.get(f"/users?after={cursor}").status_code, 200)
+            self.assertEqual(client.get(f"/tags?after={encode_cursor([{'a': 1}, 1])}").status_code, 200)
+
+    def test_list_users_after_cursor(self):
+        with app.test_client() as client:
+            cursor = User.order_by_last_name(per_page=6).next_cursor
+            resp = client.get(f"/users?after={cursor}")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("April Ludgate", html)
+            self.assertNotIn("Ben Wyatt", html)
+            self.assertNotIn("Next page", html)
+
+    def test_post_picker_search(self):
+        with app.test_client() as client:
+            resp = client.get("/posts/picker?q=post 3")
+            data = resp.get_json()
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual([p["title"] for p in data["posts"]], ["Post 3"])
+            self.assertIsNone(data["next"])
@@ -0,0 +1,225 @@
+import datetime
+import threading
+from unittest import TestCase
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from app import app
+from counters import reconcile
+from migrate import load_migrations
+from models import db, User, Post, Tag, PostTag
+from partitions import add_months, archive, maintain, month_of, partitions
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///test_db'
+app.config['SQLALCHEMY_ECHO'] = False
+
+# Make Flask errors be real errors, rather than HTML pages with error info
+app.config['TESTING'] = True
+
+# Render every page fresh; test_cache.py turns the page cache on for its own tests
+app.config['PAGE_CACHE_ENABLED'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+# made in place (inside the data directory), so the test needs no directory of its own
+TABLESPACE = 'blogly_test_archive'
+THIS_MONTH = month_of(datetime.datetime.now())
+
+
+class PartitionedPostsTestCase(TestCase):
+    """Tests for the app on a partitioned posts table, and for partitions.py."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Partition posts as migration 0009 does in production."""
+
+        db.session.remove()
+        migration = next(m for m in load_migrations() if m.name == "partition_posts")
+        with db.engine.begin() as conn:
+            migration.upgrade(conn)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Back to the tables the other test files expect."""
+
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        with db.engine.connect() as conn:
+            conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+            conn.execute(text(f"DROP TABLESPACE IF EXISTS {TABLESPACE}"))
+
+    def setUp(self):
+        """A user with a post this month and one two years back, both tagged."""
+
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+
+        user, tag = User(first_name='Donna', last_name='Meagle'), Tag(name='treat-yo-self')
+        db.session.add_all([user, tag])
+        db.session.commit()
+        recent = Post(title="Treat Yo Self 2026", content="Fine leather goods", user_id=user.id, tags=[tag])
+        old = Post(title="Treat Yo Self 2011", content="Mimosas", user_id=user.id, tags=[tag],
+                   created_at=datetime.datetime.now() - datetime.timedelta(days=730))
+        db.session.add_all([recent, old])
+        db.session.commit()
+        self.user_id, self.tag_id, self.recent_id, self.old_id = user.id, tag.id, recent.id, old.id
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up this test's rows."""
+
+        db.session.rollback()
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def partition_of(self, post_id):
+        return db.session.execute(text("SELECT tableoid::regclass::text FROM posts WHERE id = :id"),
+                                  {"id": post_id}).scalar()
+
+    def test_posts_routed_by_month(self):
+        self.assertEqual(db.session.execute(text("SELECT relkind FROM pg_class WHERE relname = 'posts'")).scalar(),
+                         'p')
+        self.assertEqual(self.partition_of(self.recent_id), f"posts_{THIS_MONTH:%Y_%m}")
+        self.assertEqual(self.partition_of(self.old_id), "posts_earlier")
+
+    def test_pages_and_writes_work_unchanged(self):
+        with app.test_client() as client:
+            for url in ["/", f"/users/{self.user_id}", f"/tags/{self.tag_id}", f"/posts/{self.old_id}"]:
+                resp = client.get(url)
+                self.assertEqual(resp.status_code, 200, url)
+                self.assertIn("Treat Yo Self 2011", resp.get_data(as_text=True), url)
+
+            d = {"title": "Treat Yo Self 2012", "content": "Cronuts", "tag_group": [str(self.tag_id)]}
+            client.post(f"/users/{self.user_id}/posts/new", data=d)
+            client.post(f"/posts/{self.old_id}/delete")
+
+        titles = {post.title for post in Tag.query.get(self.tag_id).posts}
+        self.assertEqual(titles, {"Treat Yo Self 2026", "Treat Yo Self 2012"})
+        self.assertIsNone(Post.query.get(self.old_id))
+        self.assertEqual(User.query.get(self.user_id).post_count, 2)
+        self.assertEqual(Tag.query.get(self.tag_id).post_count, 2)
+
+    def test_post_tags_reference_posts(self):
+        db.session.add(PostTag(post_id=self.old_id + self.recent_id, tag_id=self.tag_id))
+        with self.assertRaises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
+        # the post's user going takes its posts, and their post_tags with them
+        User.bulk_delete([self.user_id])
+        db.session.commit()
+        self.assertEqual(PostTag.query.count(), 0)
+        self.assertEqual(Tag.query.get(self.tag_id).post_count, 0)
+
+    def test_post_ids_stay_unique(self):
+        # the same id in another month's partition, as an import keeping old ids could write
+        taken = Post(id=self.old_id, title="Again", content="Twice", user_id=self.user_id)
+        db.session.add(taken)
+        with self.assertRaises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
+        insert = text("INSERT INTO posts (id, title, content, created_at, user_id) "
+                      "VALUES (:id, 'One', 'Once', now(), :user_id), "
+                      "(:id, 'Two', 'Twice', now() - interval '1 year', :user_id)")
+        with self.assertRaises(IntegrityError):
+            db.session.execute(insert, {"id": self.old_id + self.recent_id, "user_id": self.user_id})
+        db.session.rollback()
+
+        with self.assertRaises(IntegrityError):
+            db.session.execute(text("UPDATE posts SET id = :taken WHERE id = :id"),
+                               {"taken": self.old_id, "id": self.recent_id})
+        db.session.rollback()
+        self.assertEqual(Post.query.count(), 2)
+
+    def test_concurrent_inserts_of_one_id(self):
+        insert = text("INSERT INTO posts (id, title, content, created_at, user_id) "
+                      "VALUES (:id, :title, 'Import', :created_at, :user_id)")
+        row = {"id": self.old_id + self.recent_id, "user_id": self.user_id}
+        errors = []
+
+        def second_import():
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(insert, dict(row, title="Second", created_at=datetime.datetime(2020, 1, 1)))
+            except IntegrityError as err:
+                errors.append(err)
+
+        with db.engine.connect() as first:
+            transaction = first.begin()
+            first.execute(insert, dict(row, title="First", created_at=datetime.datetime.now()))
+            # waits on the first's lock on the id, then finds its row
+            thread = threading.Thread(target=second_import)
+            thread.start()
+            thread.join(0.5)
+            self.assertTrue(thread.is_alive())
+            transaction.commit()
+        thread.join()
+
+        self.assertEqual(len(errors), 1)
+        self.assertEqual([post.title for post in Post.query.filter_by(id=row["id"])], ["First"])
+
+    def test_keyset_page_prunes_newer_partitions(self):
+        cursor = datetime.datetime.now() - datetime.timedelta(days=365)
+        # psycopg2 sends the cursor inline, so the planner sees it as the app's pages do
+        plan = "\n".join(row[0] for row in db.session.execute(text(
+            "EXPLAIN SELECT * FROM posts WHERE user_id = :user_id AND created_at < :cursor "
+            "ORDER BY created_at DESC, id DESC LIMIT 50"), {"user_id": self.user_id, "cursor": cursor}))
+
+        self.assertIn("posts_earlier", plan)
+        self.assertNotIn(f"posts_{THIS_MONTH:%Y_%m}", plan)
+
+    def test_maintain_adds_months_and_moves_strays(self):
+        # a post beyond the partitions made so far lands in posts_later
+        stray = Post(title="Treat Yo Self 2027", content="Velvet", user_id=self.user_id,
+                     created_at=add_months(THIS_MONTH, 6) + datetime.timedelta(days=3))
+        db.session.add(stray)
+        db.session.commit()
+        stray_id = stray.id
+        self.assertEqual(self.partition_of(stray_id), "posts_later")
+        db.session.commit()
+
+        with db.engine.begin() as conn:
+            created = maintain(conn, months_ahead=8)
+            self.assertEqual(maintain(conn, months_ahead=8), [])
+            later = partitions(conn)[-1]
+
+        self.assertIn(f"posts_{add_months(THIS_MONTH, 6):%Y_%m}", created)
+        self.assertEqual(self.partition_of(stray_id), f"posts_{add_months(THIS_MONTH, 6):%Y_%m}")
+        self.assertEqual((later.name, later.lower), ("posts_later", add_months(THIS_MONTH, 9)))
+        db.session.commit()
+        with db.engine.begin() as conn:
+            self.assertEqual(reconcile(conn, check=True), {"users": 0, "tags": 0})
+
+    def test_archive_moves_cold_partitions(self):
+        db.session.commit()
+        with db.engine.connect() as conn:
+            conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+            conn.execute(text("SET allow_in_place_tablespaces = on"))
+            conn.execute(text(f"DROP TABLESPACE IF EXISTS {TABLESPACE}"))
+            conn.execute(text(f"CREATE TABLESPACE {TABLESPACE} LOCATION ''"))
+
+        # a year from next month: this month's partition has been cold for a year
+        archived = archive(db.engine, TABLESPACE, older_than=12, now=add_months(THIS_MONTH, 13))
+        self.assertEqual(archived, ["posts_earlier", f"posts_{THIS_MONTH:%Y_%m}"])
+        self.assertEqual(archive(db.engine, TABLESPACE, older_than=12, now=add_months(THIS_MONTH, 13)), [])
+
+        placed = dict(db.session.execute(text(
+            "SELECT c.relname, coalesce(t.spcname, 'pg_default') FROM pg_class c "
+            "LEFT JOIN pg_tablespace t ON t.oid = c.reltablespace WHERE c.relname LIKE 'posts_earlier%'")).fetchall())
+        self.assertTrue(len(placed) > 1 and set(placed.values()) == {TABLESPACE}, placed)
+        self.assertEqual(self.partition_of(self.old_id), "posts_earlier")
+        with app.test_client() as client:
+            self.assertIn("Mimosas", client.get(f"/posts/{self.old_id}").get_data(as_text=True))
@@ -0,0 +1,183 @@
+import threading
+import time
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from app import app, profiler
+from models import db, User, Post, Tag, PostTag
+from profiler import Capture, RequestState
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///test_db'
+app.config['SQLALCHEMY_ECHO'] = False
+
+# Make Flask errors be real errors, rather than HTML pages with error info
+app.config['TESTING'] = True
+
+# Render every page fresh; test_cache.py turns the page cache on for its own tests
+app.config['PAGE_CACHE_ENABLED'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+AUTH = {"Authorization": "Bearer let-me-in"}
+
+
+class ProfilerTestCase(TestCase):
+    """Tests for the on-demand sampling profiler."""
+
+    def setUp(self):
+        """A user with a few posts, and the profiler's endpoints switched on."""
+
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+
+        user = User(first_name='Ben', last_name='Wyatt')
+        db.session.add(user)
+        db.session.commit()
+        db.session.add_all([Post(title=f"Cones of Dunshire {i}", content="Rules", user_id=user.id) for i in range(20)])
+        db.session.commit()
+        self.user_id = user.id
+        app.config['PROFILER_TOKEN'] = 'let-me-in'
+
+    def tearDown(self):
+        """Capture stopped and endpoints off, and clean up this test's rows."""
+
+        profiler.stop()
+        app.config['PROFILER_TOKEN'] = None
+        db.session.rollback()
+        Post.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def profile(self, client, url, want, timeout=5):
+        """Request url until the capture has stacks with every phase in want."""
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            client.get(url)
+            collapsed = client.get("/_profiler/collapsed", headers=AUTH).get_data(as_text=True)
+            if all(f";[{phase}];" in collapsed for phase in want):
+                return collapsed
+        self.fail(f"no {want} samples in:\n{collapsed}")
+
+    def test_endpoints_need_the_token(self):
+        with app.test_client() as client:
+            self.assertEqual(client.get("/_profiler", headers={"Authorization": "Bearer nope"}).status_code, 403)
+            self.assertEqual(client.post("/_profiler/start").status_code, 403)
+            self.assertEqual(client.get("/_profiler", headers=AUTH).status_code, 200)
+
+            app.config['PROFILER_TOKEN'] = None
+            self.assertEqual(client.get("/_profiler", headers=AUTH).status_code, 404)
+
+    def test_capture_by_route_and_phase(self):
+        with app.test_client() as client:
+            resp = client.post("/_profiler/start?route=/users/*&interval_ms=1", headers=AUTH)
+            self.assertTrue(resp.json["running"])
+            collapsed = self.profile(client, f"/users/{self.user_id}", ["db", "template"])
+            client.get("/tags")
+
+            status = client.get("/_profiler", headers=AUTH).json
+
+        lines = collapsed.splitlines()
+        self.assertTrue(all(line.startswith("GET /users/<int:user_id>;[") for line in lines))
+        self.assertTrue(any("show_user (app.py:" in line for line in lines))
+        self.assertTrue(all(line.rsplit(" ", 1)[1].isdigit() for line in lines))
+        self.assertEqual(status["samples"], sum(int(line.rsplit(" ", 1)[1]) for line in lines))
+        self.assertNotIn("/tags", collapsed)
+
+    def test_percent_picks_requests(self):
+        with app.test_client() as client:
+            client.post("/_profiler/start?percent=0", headers=AUTH)
+            for _ in range(5):
+                client.get(f"/users/{self.user_id}")
+            self.assertEqual(client.get("/_profiler", headers=AUTH).json["requests"], 0)
+
+            client.post("/_profiler/start?percent=100", headers=AUTH)
+            for _ in range(5):
+                client.get(f"/users/{self.user_id}")
+            self.assertEqual(client.get("/_profiler", headers=AUTH).json["requests"], 5)
+
+    def test_capture_stops_after_its_time(self):
+        with app.test_client() as client:
+            client.post("/_profiler/start?seconds=0", headers=AUTH)
+            client.get(f"/users/{self.user_id}")
+
+            status = client.get("/_profiler", headers=AUTH).json
+        self.assertFalse(status["running"])
+        self.assertEqual(status["requests"], 0)
+
+    def test_start_needs_finite_numbers(self):
+        with app.test_client() as client:
+            for query in ["seconds=nan", "seconds=inf", "percent=nan", "interval_ms=nan", "interval_ms=inf",
+                          "seconds=soon", "interval_ms=0.5"]:
+                resp = client.post(f"/_profiler/start?{query}", headers=AUTH)
+                self.assertEqual(resp.status_code, 400, query)
+            self.assertFalse(client.get("/_profiler", headers=AUTH).json["running"])
+
+            self.assertEqual(client.post("/_profiler/start?seconds=1e9", headers=AUTH).json["capture"]["seconds"],
+                             3600)
+
+    def test_one_sampler_thread(self):
+        profiler.start(Capture(seconds=5))
+        ready = threading.Barrier(20)
+        start_thread = threading.Thread.start
+
+        def slow_start(thread):
+            # widen the gap between checking for a sampler and it being alive
+            time.sleep(0.01)
+            start_thread(thread)
+
+        def request():
+            ready.wait()
+            profiler.ensure_sampler()
+
+        threading.Thread.start = slow_start
+        try:
+            requests = [threading.Thread(target=request) for _ in range(20)]
+            for thread in requests:
+                start_thread(thread)
+            for thread in requests:
+                thread.join()
+        finally:
+            threading.Thread.start = start_thread
+        samplers = [thread for thread in threading.enumerate() if thread.name == "blogly-profiler"]
+        self.assertEqual(len(samplers), 1)
+
+    def test_orm_hydration_is_its_own_phase(self):
+        profiler.start(Capture())
+        state = profiler.profiled[threading.get_ident()] = RequestState("GET /test")
+        sample = lambda *args: profiler.sample()
+        event.listen(Post, "load", sample)
+        try:
+            Post.query.filter_by(user_id=self.user_id).first()
+            state.db = 1
+            profiler.sample()
+            state.db, state.templates = 0, 1
+            profiler.sample()
+        finally:
+            event.remove(Post, "load", sample)
+
+        phases = {key[1] for key in profiler.stacks}
+        self.assertEqual(phases, {"[orm]", "[db]", "[template]"})
+
+    def test_speedscope_profile(self):
+        with app.test_client() as client:
+            client.post("/_profiler/start?route=/users/<int:user_id>&interval_ms=1", headers=AUTH)
+            self.profile(client, f"/users/{self.user_id}", ["db"])
+            resp = client.get("/_profiler/speedscope.json", headers=AUTH)
+
+        data = resp.json
+        profile = data["profiles"][0]
+        frames = data["shared"]["frames"]
+        self.assertEqual(profile["type"], "sampled")
+        self.assertEqual(len(profile["samples"]), len(profile["weights"]))
+        self.assertTrue(all(0 <= i < len(frames) for sample in profile["samples"] for i in sample))
+        self.assertEqual(frames[profile["samples"][0][0]]["name"], "GET /users/<int:user_id>")
+        self.assertIn({"name": "show_user", "file": "app.py"}, [{k: f.get(k) for k in ("name", "file")} for f in frames])
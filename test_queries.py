@@ -0,0 +1,176 @@
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from app import app
+from models import db, User, Post, Tag, PostTag
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///test_db'
+app.config['SQLALCHEMY_ECHO'] = False
+
+# Make Flask errors be real errors, rather than HTML pages with error info
+app.config['TESTING'] = True
+
+# Fail the request if a template lazy loads a relationship
+app.config['RAISE_ON_LAZY_LOAD'] = True
+
+# Render every page fresh; test_cache.py turns the page cache on for its own tests
+app.config['PAGE_CACHE_ENABLED'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class QueryCounter:
+    """Count the SQL statements sent to the database inside a with block."""
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(db.engine, "before_cursor_execute", self.callback)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(db.engine, "before_cursor_execute", self.callback)
+
+    def callback(self, *args):
+        self.count += 1
+
+
+class EagerLoadingTestCase(TestCase):
+    """Read routes run a fixed number of queries however much they show."""
+
+    def setUp(self):
+        """Add a user with tagged posts."""
+
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+
+        user = User(first_name='Leslie', last_name="Knope")
+        tags = [Tag(name='cool'), Tag(name='fun')]
+        db.session.add(user)
+        db.session.add_all(tags)
+        db.session.commit()
+
+        self.user_id = user.id
+        self.tag_id = tags[0].id
+        self.tags = tags
+
+    def tearDown(self):
+        """Clean up any fouled transaction and the rows this test added."""
+
+        db.session.rollback()
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def add_posts(self, n):
+        """Add n posts, each with every tag."""
+
+        tags = Tag.query.all()
+        posts = [Post(title=f'Post {i}', content='Content', user_id=self.user_id, tags=tags) for i in range(n)]
+        db.session.add_all(posts)
+        db.session.commit()
+        return posts[0].id
+
+    def count_queries(self, url):
+        """Return the number of queries issued to render url."""
+
+        with app.test_client() as client:
+            with QueryCounter() as counter:
+                resp = client.get(url)
+            self.assertEqual(resp.status_code, 200)
+        return counter.count
+
+    def test_homepage_fixed_queries(self):
+        self.add_posts(1)
+        few = self.count_queries("/")
+        self.add_posts(4)
+        many = self.count_queries("/")
+
+        self.assertEqual(few, many)
+        # plus one for the page's ETag validator (see cache.py)
+        self.assertLessEqual(many, 3)
+
+    def test_show_tag_fixed_queries(self):
+        self.add_posts(1)
+        few = self.count_queries(f"/tags/{self.tag_id}")
+        self.add_posts(10)
+        many = self.count_queries(f"/tags/{self.tag_id}")
+
+        self.assertEqual(few, many)
+
+    def test_show_user_fixed_queries(self):
+        self.add_posts(1)
+        few = self.count_queries(f"/users/{self.user_id}")
+        self.add_posts(10)
+        many = self.count_queries(f"/users/{self.user_id}")
+
+        self.assertEqual(few, many)
+
+    def test_show_post_loads_user_and_tags(self):
+        post_id = self.add_posts(1)
+        with app.test_client() as client:
+            resp = client.get(f"/posts/{post_id}")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('Leslie Knope', html)
+            self.assertIn('cool', html)
+
+
+class BulkDeleteTestCase(TestCase):
+    """Deletes run a fixed number of statements however many children they cascade to."""
+
+    def setUp(self):
+        """Add two users with tagged posts, one prolific."""
+
+        tag = Tag(name='cool')
+        users = [User(first_name='Jerry', last_name="Gergich"), User(first_name='Mark', last_name="Brendanawicz")]
+        db.session.add(tag)
+        db.session.add_all(users)
+        db.session.commit()
+        db.session.add_all([Post(title='Gerry', content='Oops', user_id=users[0].id, tags=[tag]) for _ in range(10)])
+        db.session.add(Post(title='Mark', content='Hi', user_id=users[1].id, tags=[tag]))
+        db.session.commit()
+
+        self.prolific_id, self.quiet_id = (user.id for user in users)
+        self.tag_id = tag.id
+
+    def tearDown(self):
+        """Clean up any fouled transaction and this test's rows."""
+
+        db.session.rollback()
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def count_statements(self, url):
+        with app.test_client() as client:
+            with QueryCounter() as counter:
+                resp = client.post(url)
+            self.assertEqual(resp.status_code, 302)
+        return counter.count
+
+    def test_delete_user_cascades_in_fixed_statements(self):
+        quiet = self.count_statements(f"/users/{self.quiet_id}/delete")
+        prolific = self.count_statements(f"/users/{self.prolific_id}/delete")
+
+        self.assertEqual(quiet, prolific)
+        self.assertEqual(Post.query.count(), 0)
+        self.assertEqual(PostTag.query.count(), 0)
+
+    def test_delete_tag_cascades_to_post_tags(self):
+        self.count_statements(f"/tags/{self.tag_id}/delete")
+
+        self.assertEqual(PostTag.query.count(), 0)
+        self.assertEqual(Post.query.count(), 11)
@@ -0,0 +1,108 @@
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from app import app
+from models import db, User, Post, Tag, PostTag
+import readmodels
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///test_db'
+app.config['SQLALCHEMY_ECHO'] = False
+
+# Make Flask errors be real errors, rather than HTML pages with error info
+app.config['TESTING'] = True
+
+# Fail the request if a template lazy loads a relationship
+app.config['RAISE_ON_LAZY_LOAD'] = True
+
+# Render every page fresh; test_cache.py turns the page cache on for its own tests
+app.config['PAGE_CACHE_ENABLED'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class ReadModelsTestCase(TestCase):
+    """Tests for the column-only list rows."""
+
+    def setUp(self):
+        """Add users sharing a last name, and tagged posts."""
+
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+
+        users = [User(first_name=first, last_name=last, img_url='http://example.com/' + first)
+                 for first, last in [('Ben', 'Wyatt'), ('Ann', 'Wyatt'), ('Ann', 'Perkins')]]
+        tag = Tag(name='pawnee')
+        db.session.add_all([*users, tag])
+        db.session.commit()
+        posts = [Post(title=f'Post {i}', content='Long content ' * 100, user_id=users[0].id,
+                      tags=[tag] if i % 2 else []) for i in range(5)]
+        db.session.add_all(posts)
+        db.session.commit()
+
+        self.user_id = users[0].id
+        self.tag_id = tag.id
+        db.session.expunge_all()
+
+    def tearDown(self):
+        """Clean up this test's rows."""
+
+        db.session.rollback()
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def test_same_pages_as_the_models(self):
+        with app.test_request_context():
+            users = readmodels.users_by_last_name(per_page=2)
+            entities = User.order_by_last_name(per_page=2)
+            self.assertEqual([u.id for u in users], [u.id for u in entities])
+            self.assertEqual(users.next_cursor, entities.next_cursor)
+            self.assertEqual([u.full_name for u in users], ['Ann Wyatt', 'Ben Wyatt'])
+
+            tagged = readmodels.posts_by_tag(self.tag_id)
+            self.assertEqual([p.id for p in tagged], [p.id for p in Post.by_tag(self.tag_id)])
+            self.assertEqual(len(readmodels.posts_by_user(self.user_id)), 5)
+            self.assertEqual([p.title for p in readmodels.post_titles("post 3")], ['Post 3'])
+
+    def test_rows_skip_the_session_and_unneeded_columns(self):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            with app.test_request_context():
+                posts = readmodels.post_titles()
+                users = readmodels.users_by_last_name()
+                self.assertEqual(len(db.session.identity_map), 0)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+
+        self.assertNotIn("posts.content", statements[0])
+        self.assertNotIn("users.img_url", statements[1])
+        self.assertEqual(posts.items[0].friendly_date, posts.items[0].created_at.strftime("%a %b %d  %Y, %I:%M %p"))
+        with self.assertRaises(AttributeError):
+            users.items[0].img_url
+
+    def test_list_pages_render(self):
+        with app.test_client() as client:
+            users = client.get("/users").get_data(as_text=True)
+            user = client.get(f"/users/{self.user_id}").get_data(as_text=True)
+            form = client.get(f"/tags/{self.tag_id}/edit").get_data(as_text=True)
+            picker = client.get("/posts/picker?q=post+4").json
+
+            self.assertIn("Ann Perkins", users)
+            self.assertIn("Post 4", user)
+            self.assertIn('<option value=', form)
+            self.assertEqual([p["title"] for p in picker["posts"]], ["Post 4"])
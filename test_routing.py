@@ -0,0 +1,138 @@
+from unittest import TestCase
+
+from sqlalchemy import create_engine, text
+
+from app import app
+from models import db, User, Post, Tag, PostTag
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///test_db'
+app.config['SQLALCHEMY_ECHO'] = False
+
+# Make Flask errors be real errors, rather than HTML pages with error info
+app.config['TESTING'] = True
+
+# Render every page fresh; test_cache.py turns the page cache on for its own tests
+app.config['PAGE_CACHE_ENABLED'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+# a second local database stands in for the read replica; nothing copies rows
+# across, so each test can tell which database answered
+REPLICA_URI = 'postgresql:///test_replica_db'
+
+db.drop_all()
+db.create_all()
+
+
+def create_replica_database():
+    engine = create_engine('postgresql:///postgres', isolation_level='AUTOCOMMIT')
+    with engine.connect() as conn:
+        exists = conn.execute(text("SELECT 1 FROM pg_database WHERE datname = 'test_replica_db'")).scalar()
+        if not exists:
+            conn.execute(text("CREATE DATABASE test_replica_db"))
+    engine.dispose()
+
+    replica = create_engine(REPLICA_URI)
+    db.Model.metadata.drop_all(replica)
+    db.Model.metadata.create_all(replica)
+    return replica
+
+
+replica = create_replica_database()
+
+
+def clear(conn):
+    for table in ['post_tags', 'posts', 'tags', 'users']:
+        conn.execute(text(f"DELETE FROM {table}"))
+
+
+class RoutingTestCase(TestCase):
+    """Tests for reading from a replica and writing to the primary."""
+
+    def setUp(self):
+        """Put a different user in each database."""
+
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+        db.session.add(User(first_name='Leslie', last_name='Knope'))
+        db.session.commit()
+
+        with replica.begin() as conn:
+            clear(conn)
+            conn.execute(text("INSERT INTO users (first_name, last_name) VALUES ('Ron', 'Swanson')"))
+
+        app.config['SQLALCHEMY_BINDS'] = {'replica': REPLICA_URI}
+        app.config['READ_REPLICAS'] = ['replica']
+        app.config['READ_YOUR_WRITES_SECONDS'] = 5.0
+
+    def tearDown(self):
+        """Back to the primary alone, and clean up this test's rows."""
+
+        app.config['READ_REPLICAS'] = []
+        app.config['SQLALCHEMY_BINDS'] = None
+        db.session.rollback()
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+        db.session.commit()
+        with replica.begin() as conn:
+            clear(conn)
+
+    def test_get_reads_replica(self):
+        with app.test_client() as client:
+            html = client.get("/users").get_data(as_text=True)
+
+            self.assertIn("Swanson", html)
+            self.assertNotIn("Knope", html)
+
+    def test_no_replicas_reads_primary(self):
+        app.config['READ_REPLICAS'] = []
+        with app.test_client() as client:
+            html = client.get("/users").get_data(as_text=True)
+
+            self.assertIn("Knope", html)
+
+    def test_post_writes_primary_and_redirect_reads_it(self):
+        with app.test_client() as client:
+            d = {"first_name": "Ann", "last_name": "Perkins", "img_url": ""}
+            html = client.post("/users/new", data=d, follow_redirects=True).get_data(as_text=True)
+
+            self.assertIn("Perkins", html)
+            self.assertIn("Knope", html)
+        self.assertEqual(User.query.filter_by(last_name='Perkins').count(), 1)
+        with replica.connect() as conn:
+            self.assertEqual(conn.execute(text("SELECT count(*) FROM users WHERE last_name = 'Perkins'")).scalar(), 0)
+
+    def test_read_your_writes_window_ends(self):
+        app.config['READ_YOUR_WRITES_SECONDS'] = 0
+        with app.test_client() as client:
+            d = {"first_name": "Ann", "last_name": "Perkins", "img_url": ""}
+            html = client.post("/users/new", data=d, follow_redirects=True).get_data(as_text=True)
+
+            self.assertIn("Swanson", html)
+            self.assertNotIn("Perkins", html)
+
+    def test_window_is_per_visitor(self):
+        with app.test_client() as writer, app.test_client() as reader:
+            writer.post("/users/new", data={"first_name": "Ann", "last_name": "Perkins", "img_url": ""})
+
+            self.assertIn("Perkins", writer.get("/users").get_data(as_text=True))
+            self.assertNotIn("Perkins", reader.get("/users").get_data(as_text=True))
+
+    def test_reads_after_a_write_in_a_request_use_primary(self):
+        with app.test_request_context("/users"):
+            app.preprocess_request()
+            self.assertEqual([u.last_name for u in User.query], ['Swanson'])
+
+            db.session.add(Tag(name='pawnee'))
+            db.session.flush()
+            self.assertEqual([u.last_name for u in User.query], ['Knope'])
+            db.session.rollback()
+
+    def test_outside_requests_use_primary(self):
+        self.assertEqual([u.last_name for u in User.query], ['Knope'])
@@ -0,0 +1,172 @@
+from unittest import TestCase
+
+from app import app, search
+from models import db, User, Post, Tag, PostTag
+from search import InvertedIndex, highlight
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///test_db'
+app.config['SQLALCHEMY_ECHO'] = False
+
+# Make Flask errors be real errors, rather than HTML pages with error info
+app.config['TESTING'] = True
+
+# Fail the request if a template lazy loads a relationship
+app.config['RAISE_ON_LAZY_LOAD'] = True
+
+# Render every page fresh; test_cache.py turns the page cache on for its own tests
+app.config['PAGE_CACHE_ENABLED'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class InvertedIndexTestCase(TestCase):
+    """Tests for the in-process fallback index."""
+
+    def setUp(self):
+        self.index = InvertedIndex()
+        self.index.add(1, 10, "Waffle day", "Breakfast at JJ's diner", [100])
+        self.index.add(2, 10, "Budget meeting", "Waffle party after the budget meeting", [200])
+        self.index.add(3, 20, "Calzones", "Nobody likes calzones", [100, 200])
+
+    def ids(self, text, **filters):
+        return [post_id for _, post_id in self.index.search(text, **filters)]
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(self.ids("waffle"), [1, 2])
+
+    def test_every_term_must_match(self):
+        self.assertEqual(self.ids("waffle budget"), [2])
+        self.assertEqual(self.ids("waffle calzones"), [])
+
+    def test_stopwords_only_matches_nothing(self):
+        self.assertEqual(self.ids("the"), [])
+
+    def test_filters(self):
+        self.assertEqual(self.ids("waffle", tag_id=200), [2])
+        self.assertEqual(self.ids("calzones", user_id=10), [])
+
+    def test_add_replaces_and_discard_removes(self):
+        self.index.add(1, 10, "Pancake day", "Breakfast", [100])
+        self.assertEqual(self.ids("waffle"), [2])
+        self.assertEqual(self.ids("pancake"), [1])
+
+        self.index.discard(2)
+        self.assertEqual(self.ids("waffle"), [])
+        self.assertNotIn("budget", self.index.postings)
+
+    def test_discard_user_and_tag(self):
+        self.index.discard_user(10)
+        self.assertEqual(self.ids("waffle"), [])
+
+        self.index.discard_tag(100)
+        self.assertEqual(self.ids("calzones", tag_id=100), [])
+        self.assertEqual(self.ids("calzones", tag_id=200), [3])
+
+    def test_highlight_escapes(self):
+        self.assertEqual(str(highlight("<b>Waffle</b> time", {"waffle"})),
+                         "&lt;b&gt;<mark>Waffle</mark>&lt;/b&gt; time")
+
+
+class SearchViewsTestCase(TestCase):
+    """Tests for /search and /api/search on both backends."""
+
+    def setUp(self):
+        """Add two users' posts, one of them tagged."""
+
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+
+        leslie = User(first_name='Leslie', last_name='Knope')
+        ron = User(first_name='Ron', last_name='Swanson')
+        tag = Tag(name='food')
+        db.session.add_all([leslie, ron, tag])
+        db.session.commit()
+        db.session.add_all([
+            Post(title='Waffles', content='Waffles & whipped cream at JJs', user_id=leslie.id, tags=[tag]),
+            Post(title='Budget', content='The waffle budget is approved', user_id=leslie.id),
+            Post(title='Woodworking', content='A canoe, no waffles', user_id=ron.id),
+        ])
+        db.session.commit()
+
+        self.leslie_id = leslie.id
+        self.ron_id = ron.id
+        self.tag_id = tag.id
+        search.reset()
+
+    def tearDown(self):
+        """Clean up this test's rows and go back to picking the backend by database."""
+
+        db.session.rollback()
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+        db.session.commit()
+        search.backend = None
+        search.reset()
+
+    def titles(self, client, query):
+        resp = client.get(f"/api/search?{query}")
+        return [result["title"] for result in resp.json["results"]]
+
+    def check_backend(self):
+        with app.test_client() as client:
+            self.assertEqual(self.titles(client, "q=waffles")[0], "Waffles")
+            self.assertEqual(set(self.titles(client, "q=waffles")), {"Waffles", "Woodworking"}
+                             | ({"Budget"} if search.uses_postgres else set()))
+            self.assertEqual(self.titles(client, f"q=waffles&user={self.ron_id}"), ["Woodworking"])
+            self.assertEqual(self.titles(client, f"q=waffles&tag={self.tag_id}"), ["Waffles"])
+            self.assertEqual(self.titles(client, "q="), [])
+
+            html = client.get("/search?q=waffles").get_data(as_text=True)
+            self.assertIn("<mark>Waffles</mark>", html)
+            self.assertIn("&amp; whipped", html)
+
+    def test_postgres_backend(self):
+        search.backend = "postgresql"
+        self.check_backend()
+
+    def test_memory_backend(self):
+        search.backend = "memory"
+        self.check_backend()
+
+    def test_pages_cover_every_match(self):
+        user_id = self.leslie_id
+        db.session.add_all([Post(title=f'Waffle {i}', content='waffle', user_id=user_id) for i in range(8)])
+        db.session.commit()
+
+        for backend in ("postgresql", "memory"):
+            search.backend = backend
+            with app.test_request_context():
+                everything = [hit.post.id for hit in search.posts("waffle", per_page=100)]
+                seen, cursor = [], None
+                while True:
+                    page = search.posts("waffle", cursor=cursor, per_page=3)
+                    seen += [hit.post.id for hit in page]
+                    cursor = page.next_cursor
+                    if not cursor:
+                        break
+            # no stemming in the fallback, so "waffles" doesn't match there
+            self.assertEqual(len(everything), 11 if backend == "postgresql" else 9, backend)
+            self.assertEqual(seen, everything, backend)
+
+    def test_memory_index_follows_writes(self):
+        search.backend = "memory"
+        with app.test_client() as client:
+            self.assertEqual(self.titles(client, "q=calzone"), [])
+
+            client.post(f"/users/{self.ron_id}/posts/new", data={"title": "Calzone", "content": "Bad"})
+            self.assertEqual(self.titles(client, "q=calzone"), ["Calzone"])
+
+            client.post(f"/tags/{self.tag_id}/delete")
+            self.assertEqual(self.titles(client, f"q=waffles&tag={self.tag_id}"), [])
+
+            client.post(f"/users/{self.ron_id}/delete")
+            self.assertEqual(self.titles(client, "q=calzone"), [])
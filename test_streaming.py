@@ -0,0 +1,154 @@
+import gzip
+import zlib
+from unittest import TestCase
+
+import brotli
+
+from app import app, page_cache
+from models import db, User, Post, Tag, PostTag
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///test_db'
+app.config['SQLALCHEMY_ECHO'] = False
+
+# Make Flask errors be real errors, rather than HTML pages with error info
+app.config['TESTING'] = True
+
+# Render every page fresh; test_cache.py turns the page cache on for its own tests
+app.config['PAGE_CACHE_ENABLED'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class StreamingTestCase(TestCase):
+    """Tests for streamed pages and compressed responses."""
+
+    def setUp(self):
+        """A user with 30 tagged posts."""
+
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+
+        user, tag = User(first_name='April', last_name='Ludgate'), Tag(name='janet-snakehole')
+        db.session.add_all([user, tag])
+        db.session.commit()
+        db.session.add_all([Post(title=f"Entry {i}", content="Ugh", user_id=user.id, tags=[tag]) for i in range(30)])
+        db.session.commit()
+        self.user_id, self.tag_id = user.id, tag.id
+
+    def tearDown(self):
+        """Back to rendered pages, and clean up this test's rows."""
+
+        app.config['STREAM_TEMPLATES'] = False
+        app.config['STREAM_PER_PAGE'] = 500
+        app.config['STREAM_CHUNK_BYTES'] = 8192
+        app.config['PAGE_CACHE_ENABLED'] = False
+        db.session.rollback()
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def test_streamed_pages_match_rendered(self):
+        with app.test_client() as client:
+            for url in [f"/users/{self.user_id}", f"/tags/{self.tag_id}"]:
+                app.config['STREAM_TEMPLATES'] = False
+                rendered = client.get(url)
+                app.config['STREAM_TEMPLATES'] = True
+                streamed = client.get(url)
+
+                self.assertIn("Content-Length", rendered.headers)
+                self.assertNotIn("Content-Length", streamed.headers)
+                html = streamed.get_data(as_text=True)
+                self.assertEqual(html, rendered.get_data(as_text=True))
+                self.assertEqual(html.count('href="/posts/'), 30)
+
+    def test_streamed_page_links_next_page(self):
+        app.config['STREAM_TEMPLATES'] = True
+        app.config['STREAM_PER_PAGE'] = 20
+        with app.test_client() as client:
+            first = client.get(f"/users/{self.user_id}").get_data(as_text=True)
+            self.assertEqual(first.count('href="/posts/'), 20)
+            self.assertIn("Next page", first)
+
+            cursor = first.split(f'/users/{self.user_id}?after=')[1].split('"')[0]
+            second = client.get(f"/users/{self.user_id}?after={cursor}").get_data(as_text=True)
+            self.assertEqual(second.count('href="/posts/'), 10)
+            self.assertNotIn("Next page", second)
+
+    def test_flash_shown_once_on_streamed_page(self):
+        app.config['STREAM_TEMPLATES'] = True
+        with app.test_client() as client:
+            d = {"title": "Li'l Sebastian", "content": "5000 candles", "tag_group": []}
+            html = client.post(f"/users/{self.user_id}/posts/new", data=d, follow_redirects=True).get_data(as_text=True)
+            self.assertIn("Post successfully added.", html)
+
+            html = client.get(f"/users/{self.user_id}").get_data(as_text=True)
+            self.assertNotIn("Post successfully added.", html)
+
+    def test_compressed_for_accepting_clients(self):
+        url = f"/users/{self.user_id}"
+        with app.test_client() as client:
+            plain = client.get(url)
+            br = client.get(url, headers={"Accept-Encoding": "gzip, deflate, br"})
+            gz = client.get(url, headers={"Accept-Encoding": "gzip, br;q=0.5"})
+            unchanged = client.get(url, headers={"Accept-Encoding": "br", "If-None-Match": br.headers["ETag"]})
+
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertEqual(br.headers["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(br.data), plain.data)
+        self.assertEqual(gz.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(gz.data), plain.data)
+        for resp in (br, gz):
+            self.assertIn("Accept-Encoding", resp.headers["Vary"])
+            self.assertNotIn("Content-Length", resp.headers)
+            self.assertEqual(resp.headers["ETag"], f'W/{plain.headers["ETag"]}')
+        self.assertEqual(unchanged.status_code, 304)
+
+    def test_streamed_page_compressed_chunk_by_chunk(self):
+        app.config['STREAM_TEMPLATES'] = True
+        app.config['STREAM_CHUNK_BYTES'] = 1024
+        with app.test_client() as client:
+            resp = client.get(f"/users/{self.user_id}", headers={"Accept-Encoding": "gzip"}, buffered=False)
+            chunks = list(resp.response)
+            resp.close()
+
+        self.assertGreater(len(chunks), 2)
+        # each chunk decompresses to the page so far, without waiting for the rest
+        decompressor = zlib.decompressobj(31)
+        html = b""
+        for chunk in chunks[:-1]:
+            data = decompressor.decompress(chunk)
+            self.assertTrue(data)
+            html += data
+        html += decompressor.decompress(chunks[-1]) + decompressor.flush()
+        self.assertIn(b"Entry 0", html)
+        self.assertTrue(html.rstrip().endswith(b"</html>"))
+
+    def test_small_responses_not_compressed(self):
+        with app.test_client() as client:
+            resp = client.get(f"/api/v1/users/{self.user_id}", headers={"Accept-Encoding": "gzip, br"})
+
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(resp.json["first_name"], "April")
+
+    def test_streamed_page_cached_once_sent(self):
+        app.config['STREAM_TEMPLATES'] = True
+        app.config['PAGE_CACHE_ENABLED'] = True
+        page_cache.clear()
+        with app.test_client() as client:
+            client.get(f"/users/{self.user_id}").get_data()
+            # changed behind the app's back, so the cached copy is still served
+            Post.query.filter_by(title="Entry 0").update({"title": "Entry zero"})
+            db.session.commit()
+            html = client.get(f"/users/{self.user_id}").get_data(as_text=True)
+
+        self.assertIn("Entry 0", html)
+        self.assertNotIn("Entry zero", html)
@@ -0,0 +1,170 @@
+import threading
+import time
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from app import app, post_writer
+from models import db, User, Post, Tag, PostTag
+from writebehind import QueueFull, WriteFailed
+
+# Use test database and don't clutter tests with SQL
+app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///test_db'
+app.config['SQLALCHEMY_ECHO'] = False
+
+# Make Flask errors be real errors, rather than HTML pages with error info
+app.config['TESTING'] = True
+
+# Render every page fresh; test_cache.py turns the page cache on for its own tests
+app.config['PAGE_CACHE_ENABLED'] = False
+
+# This is a bit of hack, but don't use Flask DebugToolbar
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class WriteBehindTestCase(TestCase):
+    """Tests for batching new posts into group commits."""
+
+    def setUp(self):
+        """A user and a tag, and write-behind on."""
+
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+
+        user, tag = User(first_name='Andy', last_name='Dwyer'), Tag(name='mouse-rat')
+        db.session.add_all([user, tag])
+        db.session.commit()
+        self.user_id, self.tag_id = user.id, tag.id
+
+        app.config['WRITE_BEHIND'] = True
+        app.config['WRITE_BEHIND_ACK'] = 'commit'
+        app.config['WRITE_BEHIND_MAX_LATENCY'] = 0.05
+
+    def tearDown(self):
+        """Write-behind off again, and clean up this test's rows."""
+
+        post_writer.stop()
+        app.config['WRITE_BEHIND'] = False
+        db.session.rollback()
+        PostTag.query.delete()
+        Post.query.delete()
+        Tag.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def test_route_commits_before_redirect(self):
+        with app.test_client() as client:
+            d = {"title": "5000 Candles", "content": "In the wind", "tag_group": [str(self.tag_id)]}
+            resp = client.post(f"/users/{self.user_id}/posts/new", data=d, follow_redirects=True)
+            html = resp.get_data(as_text=True)
+
+            self.assertIn("Post successfully added.", html)
+            self.assertIn("5000 Candles", html)
+        post = Post.query.filter_by(title="5000 Candles").one()
+        self.assertEqual([tag.name for tag in post.tags], ['mouse-rat'])
+
+    def test_concurrent_posts_share_commits(self):
+        app.config['WRITE_BEHIND_MAX_LATENCY'] = 0.5
+        commits = []
+        record = lambda conn: commits.append(1)
+        event.listen(db.engine, "commit", record)
+        try:
+            def add(i):
+                with app.app_context():
+                    post_writer.submit(f"Song {i}", "Lyrics", self.user_id, [self.tag_id])
+
+            threads = [threading.Thread(target=add, args=(i,)) for i in range(20)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            event.remove(db.engine, "commit", record)
+
+        self.assertEqual(Post.query.count(), 20)
+        self.assertEqual(PostTag.query.count(), 20)
+        self.assertLess(len(commits), 5)
+
+    def test_queue_ack_returns_before_commit(self):
+        pending = post_writer.submit("Ann", "Pawnee", self.user_id, ack="queue")
+        post_writer.flush()
+
+        self.assertTrue(pending.done.is_set())
+        self.assertEqual(Post.query.get(pending.post_id).title, "Ann")
+
+    def test_full_queue_pushes_back(self):
+        app.config['WRITE_BEHIND_QUEUE_SIZE'] = 1
+        app.config['WRITE_BEHIND_MAX_BATCH'] = 1
+        app.config['WRITE_BEHIND_ENQUEUE_TIMEOUT'] = 0
+        gate = threading.Event()
+        write_batch = post_writer.write_batch
+
+        def held_write_batch(pending):
+            gate.wait()
+            write_batch(pending)
+
+        post_writer.write_batch = held_write_batch
+        try:
+            # the worker takes the first post and blocks on the gate; the second fills the queue
+            post_writer.submit("One", "Post", self.user_id, ack="queue")
+            while post_writer.queue.qsize():
+                time.sleep(0.01)
+            post_writer.submit("Two", "Post", self.user_id, ack="queue")
+            with self.assertRaises(QueueFull):
+                post_writer.submit("Three", "Post", self.user_id, ack="queue")
+            with app.test_client() as client:
+                resp = client.post(f"/users/{self.user_id}/posts/new", data={"title": "Four", "content": "Post"})
+                self.assertEqual(resp.status_code, 503)
+                self.assertEqual(resp.headers["Retry-After"], "1")
+        finally:
+            gate.set()
+            post_writer.flush()
+            del post_writer.write_batch
+            app.config['WRITE_BEHIND_QUEUE_SIZE'] = 1000
+            app.config['WRITE_BEHIND_MAX_BATCH'] = 200
+            app.config['WRITE_BEHIND_ENQUEUE_TIMEOUT'] = 0.5
+
+        self.assertEqual(sorted(p.title for p in Post.query), ["One", "Two"])
+
+    def test_bad_post_fails_alone(self):
+        app.config['WRITE_BEHIND_MAX_LATENCY'] = 0.5
+        good = post_writer.submit("Good", "Post", self.user_id, ack="queue")
+        bad = post_writer.submit("Orphan", "Post", 0, ack="queue")
+        post_writer.flush()
+
+        self.assertEqual(Post.query.get(good.wait()).title, "Good")
+        with self.assertRaises(WriteFailed):
+            bad.wait()
+
+    def test_tag_deleted_after_submit_is_dropped(self):
+        kept = Tag(name='land-ho')
+        db.session.add(kept)
+        db.session.commit()
+        kept_id = kept.id
+        gate = threading.Event()
+        write_batch = post_writer.write_batch
+
+        def held_write_batch(pending):
+            gate.wait()
+            write_batch(pending)
+
+        post_writer.write_batch = held_write_batch
+        try:
+            pending = post_writer.submit("The Pit", "Lot 48", self.user_id, [self.tag_id, kept_id], ack="queue")
+            # another worker deletes a tag the post was validated against
+            Tag.query.filter_by(id=self.tag_id).delete()
+            db.session.commit()
+        finally:
+            gate.set()
+            post_writer.flush()
+            del post_writer.write_batch
+
+        post = Post.query.get(pending.wait())
+        self.assertEqual(post.title, "The Pit")
+        self.assertEqual([tag.name for tag in post.tags], ['land-ho'])
+        self.assertEqual(pending.tag_ids, [kept_id])
@@ -0,0 +1,219 @@
+"""Write-behind post creation: many new posts per commit.
+
+Each add_post normally commits on its own, so in a burst every request waits for
+its own fsync on the primary. With WRITE_BEHIND on, the route validates the post
+and puts it on a bounded in-process queue instead. A background thread takes
+posts off the queue, waiting at most WRITE_BEHIND_MAX_LATENCY seconds for a batch
+of up to WRITE_BEHIND_MAX_BATCH to gather, and writes each batch as multi-row
+INSERTs into posts and post_tags with one commit.
+
+Callers pick when a post counts as written (WRITE_BEHIND_ACK, or ack= per call):
+
+    "commit"  submit() returns once the post's batch has committed; the post is
+              durable and has an id, at the cost of up to the max latency
+    "queue"   submit() returns once the post is queued; it is written shortly
+              after, but is lost if the process dies first
+
+When the queue is full, submit() waits up to WRITE_BEHIND_ENQUEUE_TIMEOUT for
+room and then raises QueueFull, so a backlog slows writers down instead of
+growing without bound (add_post answers 503 with Retry-After).
+
+The queue and thread belong to one process: a preforking server starts one per
+worker, on its first post. Queued posts are written at interpreter exit.
+"""
+
+import atexit
+import datetime
+import logging
+import os
+import queue
+import threading
+import time
+
+from sqlalchemy import Integer, column, select, values
+
+from models import db, Post, PostTag, Tag
+
+ACKS = ("commit", "queue")
+
+log = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """The write-behind queue stayed full for the whole enqueue timeout."""
+
+
+class WriteFailed(Exception):
+    """The post's batch, and then the post on its own, could not be written."""
+
+
+class PendingPost:
+    """A post on the queue; wait() for its batch to commit."""
+
+    def __init__(self, row, tag_ids):
+        self.row = row
+        self.tag_ids = sorted(tag_ids)
+        self.post_id = None
+        self.error = None
+        self.done = threading.Event()
+
+    def finish(self, post_id=None, error=None):
+        self.post_id, self.error = post_id, error
+        self.done.set()
+
+    def wait(self, timeout=None):
+        """The new post's id once committed; raises the error if writing it failed."""
+
+        if not self.done.wait(timeout):
+            raise TimeoutError("post not written yet")
+        if self.error is not None:
+            raise self.error
+        return self.post_id
+
+
+class PostWriter:
+    """Flask extension batching new posts into group commits."""
+
+    def __init__(self, app=None, after_commit=None):
+        # called in an app context with the PendingPosts of each committed batch
+        self.after_commit = after_commit
+        self.app = None
+        self.queue = None
+        self.thread = None
+        self.pid = None
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # off by default: add_post commits each post itself
+        app.config.setdefault("WRITE_BEHIND", False)
+        # longest a queued post waits for its batch to fill
+        app.config.setdefault("WRITE_BEHIND_MAX_LATENCY", 0.05)
+        app.config.setdefault("WRITE_BEHIND_MAX_BATCH", 200)
+        app.config.setdefault("WRITE_BEHIND_QUEUE_SIZE", 1000)
+        # how long submit() waits for room in a full queue before raising QueueFull
+        app.config.setdefault("WRITE_BEHIND_ENQUEUE_TIMEOUT", 0.5)
+        # "commit" or "queue": when submit() returns (see the module docstring)
+        app.config.setdefault("WRITE_BEHIND_ACK", "commit")
+        # longest an ack="commit" caller waits for its batch
+        app.config.setdefault("WRITE_BEHIND_ACK_TIMEOUT", 10.0)
+
+        self.app = app
+        app.extensions["post_writer"] = self
+
+    @property
+    def enabled(self):
+        return self.app is not None and self.app.config["WRITE_BEHIND"]
+
+    def submit(self, title, content, user_id, tag_ids=(), ack=None):
+        """Queue a validated post; return its PendingPost, after its commit for ack="commit"."""
+
+        config = self.app.config
+        ack = ack or config["WRITE_BEHIND_ACK"]
+        if ack not in ACKS:
+            raise ValueError(f"ack must be one of {ACKS}, not {ack!r}")
+
+        row = {"title": title, "content": content, "user_id": user_id, "created_at": datetime.datetime.now()}
+        pending = PendingPost(row, tag_ids)
+        try:
+            self.start().put(pending, timeout=config["WRITE_BEHIND_ENQUEUE_TIMEOUT"])
+        except queue.Full:
+            raise QueueFull(f"{config['WRITE_BEHIND_QUEUE_SIZE']} posts already waiting") from None
+        if ack == "commit":
+            pending.wait(config["WRITE_BEHIND_ACK_TIMEOUT"])
+        return pending
+
+    def flush(self):
+        """Block until everything queued so far has been written."""
+
+        if self.queue is not None and self.pid == os.getpid():
+            self.queue.join()
+
+    def start(self):
+        """This process's queue, starting its worker thread on first use (and again after a fork)."""
+
+        with self.lock:
+            if self.pid != os.getpid():
+                self.queue = queue.Queue(self.app.config["WRITE_BEHIND_QUEUE_SIZE"])
+                self.thread = threading.Thread(target=self.run, args=(self.queue,), name="post-writer", daemon=True)
+                self.thread.start()
+                if self.pid is None:
+                    atexit.register(self.stop)
+                self.pid = os.getpid()
+            return self.queue
+
+    def stop(self):
+        """Write what is queued and end the worker thread."""
+
+        with self.lock:
+            if self.pid != os.getpid():
+                return
+            self.queue.put(None)
+            self.thread.join()
+            self.queue = self.thread = self.pid = None
+
+    def run(self, posts):
+        while True:
+            batch = [posts.get()]
+            deadline = time.monotonic() + self.app.config["WRITE_BEHIND_MAX_LATENCY"]
+            while batch[-1] is not None and len(batch) < self.app.config["WRITE_BEHIND_MAX_BATCH"]:
+                try:
+                    batch.append(posts.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+
+            stopping = batch[-1] is None
+            pending = [p for p in batch if p is not None]
+            if pending:
+                with self.app.app_context():
+                    self.write(pending)
+            for _ in batch:
+                posts.task_done()
+            if stopping:
+                return
+
+    def write(self, pending):
+        """Write a batch with one commit; if that fails, retry its posts one by one."""
+
+        try:
+            self.write_batch(pending)
+        except Exception:
+            db.session.rollback()
+            if len(pending) == 1:
+                log.exception("write-behind post failed")
+                pending[0].finish(error=WriteFailed("post could not be saved"))
+                return
+            # e.g. an author deleted since their post was queued: only that post fails
+            for post in pending:
+                self.write([post])
+            return
+
+        if self.after_commit is not None:
+            try:
+                self.after_commit(pending)
+            except Exception:
+                log.exception("write-behind after_commit failed")
+        for post in pending:
+            post.finish(post.post_id)
+
+    def write_batch(self, pending):
+        # the importer's multi-row INSERT ... RETURNING, imported here to keep it out of app startup
+        from importer import insert_returning_ids
+
+        post_ids = insert_returning_ids(Post.__table__, [post.row for post in pending])
+        post_tags = []
+        for post, post_id in zip(pending, post_ids):
+            post.post_id = post_id
+            post_tags += [(post_id, tag_id) for tag_id in post.tag_ids]
+        if post_tags:
+            # as in set_tags_for_post: only tags that still exist, key share locked until the commit,
+            # so a tag deleted since the post was queued is dropped rather than failing the post
+            wanted = values(column("post_id", Integer), column("tag_id", Integer), name="wanted").data(post_tags)
+            existing = select(wanted.c.post_id, Tag.id).join(Tag, Tag.id == wanted.c.tag_id) \
+                .with_for_update(read=True, key_share=True, of=Tag)
+            insert = PostTag.__table__.insert().from_select(["post_id", "tag_id"], existing)
+            written = db.session.execute(insert.returning(PostTag.post_id, PostTag.tag_id)).fetchall()
+            for post in pending:
+                post.tag_ids = sorted(tag_id for post_id, tag_id in written if post_id == post.post_id)
+        db.session.commit()